@@ -2,9 +2,11 @@
 
 HELP="
 
-./pages-generate.sh x y z ...
+./pages-generate.sh [runmode] [--jobs n] x y z ...
 
-where x, y, z are integers that specify the featured projects.
+where runmode defaults to prod,
+x, y, z are integers that specify the featured projects,
+and n is the number of worker processes that render the pages.
 "
 
 source .env
@@ -13,9 +15,12 @@ repodir="`pwd`"
 cd src
 
 
+# the runmode is optional: an option or a project number is not a runmode
+
 if [[ "$1" == "--help" ]]; then
-    printf $HELP
-elif [[ "$1" == "" ]]; then
+    printf "$HELP"
+    exit
+elif [[ "$1" == "" || "$1" == --* || "$1" =~ ^[0-9]+$ ]]; then
     runmode=prod
 else
     runmode="$1"
@@ -0,0 +1,237 @@
+"""Measure the cost of evaluating the authorisation rules.
+
+USAGE
+
+python benchauth.py [options]
+
+`control.auth.Auth.authorise()` used to select the rules for the table and state,
+and to determine the roles and related tables involved, on every call,
+and then to test the roles of the user against the rules one by one.
+Now the rules are compiled when the configuration is read,
+see `control.authrules.compileRules()`, and an authorisation is a few
+lookups and set unions.
+
+This script compares both ways on the rules in `yaml/authorise.yml`, for all
+combinations of table, state, role, and nameSpace.
+It does not need a database: the part of `authorise()` that finds the
+roles of the user with respect to records is not measured, because it is the same
+in both ways.
+That both ways give the same results is tested in `test/test_authrules.py`.
+
+Options:
+
+--repeat n
+    The number of times each measurement is repeated; the best time counts
+    (default 5).
+
+--number n
+    The number of times all combinations are evaluated per measurement
+    (default 1000).
+"""
+
+import sys
+import os
+from itertools import chain
+from timeit import repeat
+
+from control.generic import AttrDict
+from control.files import readYaml
+from control.authrules import compileRules, allowedActions
+
+
+HELP = """
+Measure the cost of evaluating the authorisation rules.
+
+USAGE
+
+python benchauth.py [--repeat n] [--number n]
+"""
+
+YAML_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/yaml"
+
+
+def authoriseBefore(auth, detailMaster, table, state, roles, nameSpace):
+    """The rule evaluation of `authorise()` as it was before compilation."""
+    authRules = auth.authRules
+    tableRules = authRules.get(table, AttrDict())
+    stateInfo = tableRules.state
+
+    rules = {
+        act: actInfo[state] if stateInfo else actInfo
+        for (act, actInfo) in tableRules.items()
+        if act != "state"
+    }
+
+    tableFromRole = auth.tableFromRole
+    userCoupled = set(auth.userCoupled)
+
+    allAllowedRoles = {
+        role: tableFromRole[role]
+        for role in set(
+            chain.from_iterable(v.keys() for v in rules.values() if v is not None)
+        )
+    }
+
+    allRelatedTables = {
+        relatedTable: (
+            "self"
+            if relatedTable == table
+            else (
+                "detail"
+                if detailMaster[relatedTable] == table
+                else "master" if detailMaster[table] == relatedTable else ""
+            )
+        )
+        for relatedTable in allAllowedRoles.values()
+    }
+    relatedTables = {
+        relatedTable: kind
+        for (relatedTable, kind) in allRelatedTables.items()
+        if kind != "" and relatedTable in userCoupled
+    }
+
+    allowed = set()
+
+    for act, requiredRoles in rules.items():
+        if requiredRoles is None:
+            continue
+
+        for presentRole in roles:
+            permValue = requiredRoles.get(presentRole, False)
+
+            if type(permValue) is not bool:
+                if nameSpace is None:
+                    permValue = "" in permValue
+                else:
+                    permValue = nameSpace in permValue
+
+            if permValue:
+                allowed.add(act)
+                break
+
+    return (relatedTables, allowed)
+
+
+def authoriseAfter(auth, table, state, roles, nameSpace):
+    """The rule evaluation of `authorise()` with compiled rules."""
+    relatedTables = auth.relatedTables.get((table, state), {})
+    allowed = allowedActions(auth.permissions, table, state, roles, nameSpace)
+    return (relatedTables, allowed)
+
+
+def loadAuth():
+    """Reads and compiles the authorisation rules, as the app does at startup.
+
+    Returns
+    -------
+    AttrDict, dict
+        The authorisation settings, with the compiled rules in `permissions` and
+        `relatedTables`; and the master table of each detail table.
+    """
+    auth = readYaml(asFile=f"{YAML_DIR}/authorise.yml")
+    datamodel = readYaml(asFile=f"{YAML_DIR}/datamodel.yml", preferTuples=False)
+    detailMaster = datamodel.detailMaster
+
+    tableFromRole = AttrDict()
+
+    for table, roles in auth.roles.items():
+        for role in roles:
+            tableFromRole[role] = table
+
+    auth.tableFromRole = tableFromRole
+
+    (auth.permissions, auth.relatedTables) = compileRules(
+        auth.authRules, tableFromRole, auth.userCoupled, detailMaster
+    )
+    return (auth, detailMaster)
+
+
+def makeCases(auth):
+    """All combinations of table, state, roles, and nameSpace.
+
+    Returns
+    -------
+    list of tuple
+    """
+
+    # the roles of a user: a site-wide role, possibly with one extra role
+
+    siteRoles = list(auth.roles.site)
+    extraRoles = [
+        role
+        for (table, roles) in auth.roles.items()
+        if table != "site"
+        for role in roles
+        if role is not None
+    ]
+    roleSets = [{siteRole} for siteRole in siteRoles] + [
+        {siteRole, extraRole} for siteRole in siteRoles for extraRole in extraRoles
+    ]
+
+    # the nameSpaces: all that occur in the rules, plus the empty one and None
+
+    nameSpaces = {""}
+
+    for tableRules in auth.authRules.values():
+        for act, actInfo in tableRules.items():
+            if act == "state":
+                continue
+
+            for stateRules in actInfo.values() if tableRules.state else [actInfo]:
+                for permValue in (stateRules or {}).values():
+                    if type(permValue) is not bool:
+                        nameSpaces |= set(permValue)
+
+    nameSpaces = sorted(nameSpaces) + [None]
+
+    return [
+        (table, state, roles, nameSpace)
+        for (table, tableRules) in auth.authRules.items()
+        for state in (tableRules.state.values if tableRules.state else [None])
+        for roles in roleSets
+        for nameSpace in nameSpaces
+    ]
+
+
+def main():
+    args = sys.argv[1:]
+
+    params = dict(repeat=5, number=1000)
+
+    while args:
+        arg = args.pop(0)
+        name = arg.removeprefix("--")
+
+        if name not in params or not args or not args[0].isdecimal():
+            print(HELP)
+            return 1
+
+        params[name] = int(args.pop(0))
+
+    nRepeat = params["repeat"]
+    nNumber = params["number"]
+
+    (auth, detailMaster) = loadAuth()
+    cases = makeCases(auth)
+
+    def before():
+        for case in cases:
+            authoriseBefore(auth, detailMaster, *case)
+
+    def after():
+        for case in cases:
+            authoriseAfter(auth, *case)
+
+    tBefore = min(repeat(before, number=nNumber, repeat=nRepeat))
+    tAfter = min(repeat(after, number=nNumber, repeat=nRepeat))
+    nCalls = len(cases) * nNumber
+
+    print(f"{len(cases)} combinations of table, state, roles, and nameSpace")
+    print(f"rules evaluated per call : {tBefore / nCalls * 1e6:8.2f} µs")
+    print(f"compiled rules per call  : {tAfter / nCalls * 1e6:8.2f} µs")
+    print(f"speedup                  : {tBefore / tAfter:8.1f} x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Measure the cost of decoding MongoDb records into AttrDicts.
+
+USAGE
+
+python benchdecode.py [options]
+
+Records used to be decoded by pymongo into plain dicts, after which
+`control.generic.deepAttrDict` made a second, recursive copy of them.
+Now the database handle decodes them directly into AttrDicts,
+see `control.mongo.CODEC_OPTIONS`.
+
+This script compares both ways on synthetic, large edition records.
+It does not need a database: the records are encoded to BSON in memory.
+
+Options:
+
+--records n
+    The number of records to decode (default 200).
+
+--fields n
+    The number of metadata fields per record (default 200).
+
+--repeat n
+    The number of times each measurement is repeated; the best time counts
+    (default 5).
+"""
+
+import sys
+from timeit import repeat
+
+from bson import ObjectId, encode, decode_all
+
+from control.generic import deepAttrDict
+from control.mongo import CODEC_OPTIONS
+
+
+HELP = """
+Measure the cost of decoding MongoDb records into AttrDicts.
+
+USAGE
+
+python benchdecode.py [--records n] [--fields n] [--repeat n]
+"""
+
+
+def makeEdition(nFields):
+    """Make a synthetic edition record with a big `dc` metadata section."""
+    dc = {
+        f"field{i}": dict(
+            value=f"value of field {i} " * 4,
+            items=[dict(name=f"item{j}", note=f"note {j}") for j in range(3)],
+        )
+        for i in range(nFields)
+    }
+    settings = dict(
+        authorTool=dict(name="voyager", version="0.41.0"),
+        voyager=dict(scene="scene.svx.json", options=dict(light=True, pose=[1, 2])),
+    )
+    return dict(
+        _id=ObjectId(),
+        projectId=ObjectId(),
+        title="A big edition",
+        dc=dc,
+        settings=settings,
+        isPublished=False,
+    )
+
+
+def main():
+    args = sys.argv[1:]
+
+    params = dict(records=200, fields=200, repeat=5)
+
+    while args:
+        arg = args.pop(0)
+        name = arg.removeprefix("--")
+
+        if name not in params or not args or not args[0].isdecimal():
+            print(HELP)
+            return 1
+
+        params[name] = int(args.pop(0))
+
+    nRecords = params["records"]
+    nFields = params["fields"]
+    nRepeat = params["repeat"]
+
+    data = b"".join(encode(makeEdition(nFields)) for i in range(nRecords))
+    size = len(data) / 1024 / 1024
+    print(f"{nRecords} records with {nFields} metadata fields: {size:.1f} MB BSON")
+
+    def before():
+        return [deepAttrDict(r) for r in decode_all(data)]
+
+    def after():
+        return decode_all(data, codec_options=CODEC_OPTIONS)
+
+    assert before() == after()
+
+    tBefore = min(repeat(before, number=1, repeat=nRepeat))
+    tAfter = min(repeat(after, number=1, repeat=nRepeat))
+
+    print(f"decode + deepAttrDict : {tBefore * 1000:8.1f} ms")
+    print(f"decode as AttrDict    : {tAfter * 1000:8.1f} ms")
+    print(f"speedup               : {tBefore / tAfter:8.1f} x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
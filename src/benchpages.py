@@ -0,0 +1,344 @@
+"""Measure the cost of generating the edition pages.
+
+USAGE
+
+python benchpages.py [options]
+
+`control.static.Static.getData()` prepares, for every edition, a page per viewer
+version, plus a default page.
+The data of those pages used to be a deep copy of the data of the edition, with
+a few values changed.
+Now the data of the edition is shared by those pages, and the values that differ
+are layered on top of it, see `control.generic.AttrChainMap`.
+When the pages are generated, the shared data is turned into JSON once per
+edition, see `control.static.pageJson()`.
+
+This script compares both ways on a synthetic site, by running
+`control.static.Static.genPages()` from start to finish: preparing the page data,
+turning it into JSON, writing the JSON twins, filling in a template,
+and writing the pages.
+It does not need a database or published files: the pages are generated in a
+temporary directory.
+
+Options:
+
+--editions n
+    The number of editions (default 300).
+
+--versions n
+    The number of versions of the viewer (default 15).
+
+--fields n
+    The number of metadata fields per edition (default 30).
+
+--repeat n
+    The number of times each measurement is repeated; the best time counts
+    (default 3).
+"""
+
+import os
+import sys
+import tracemalloc
+from copy import deepcopy
+from tempfile import TemporaryDirectory
+from timeit import repeat
+
+from control.files import dirMake, dirRemove
+from control.generic import AttrDict, AttrChainMap, deepAttrDict, deepdict
+from control.handlebars import Handlebars
+from control.helpers import genViewerSelector
+from control.static import Static
+
+
+HELP = """
+Measure the cost of generating the edition pages.
+
+USAGE
+
+python benchpages.py [--editions n] [--versions n] [--fields n] [--repeat n]
+"""
+
+
+def makeViewers(nVersions):
+    """Make synthetic viewer info, as delivered by `getData("viewers")`."""
+    versions = [AttrDict(name=f"0.{40 + i}.0") for i in range(nVersions)]
+    versions[0].isDefault = True
+    return [
+        AttrDict(
+            name="voyager",
+            element="voyager-explorer",
+            isDefault=True,
+            versions=versions,
+        )
+    ]
+
+
+def makeEdition(pNum, eNum, nFields):
+    """Make synthetic edition page data, as in `get_editionpages()`."""
+    dc = AttrDict(
+        {
+            f"field{i}": [f"value {j} of field {i} " * 4 for j in range(3)]
+            for i in range(nFields)
+        }
+    )
+    dc.title = f"Edition {eNum} of project {pNum}"
+    toc = "".join(
+        f"""<details><summary>Section {i}</summary><p>{"text " * 40}</p></details>"""
+        for i in range(40)
+    )
+
+    return AttrDict(
+        boilerplate=dict(leftText="left " * 50, rightText="right " * 50, rightUrl=""),
+        template="edition.html",
+        projectNum=pNum,
+        projectName=f"Project {pNum}",
+        projectFileName=f"project/{pNum}/index.html",
+        authorLink=f"https://author/frompub/{pNum}/{eNum}",
+        url=f"https://pub/project/{pNum}/edition/{eNum}/index.html",
+        num=eNum,
+        name=dc.title,
+        dc=dc,
+        isPublished=True,
+        sceneFile="scene.svx.json",
+        toc=toc,
+        obfuscated=False,
+        peerInfo="",
+        peerLogo="",
+        citation=f"<p><small><code>{dc.title}. PURE3D.</code></small></p>",
+    )
+
+
+def pagesBefore(editions, viewers, viewersLean):
+    """The page data of the edition pages as it was before."""
+    result = []
+
+    for fileBase, er in editions:
+        for viewerInfo in viewers:
+            viewer = viewerInfo.name
+            element = viewerInfo.element
+            isDefaultViewer = viewerInfo.isDefault
+
+            for versionInfo in viewerInfo.versions:
+                version = versionInfo.name
+                isDefault = versionInfo.isDefault
+                ver = deepAttrDict(deepcopy(deepdict(er)))
+                ver.viewer = viewer
+                ver.version = version
+                ver.element = element
+                ver.fileName = f"{fileBase}-{viewer}-{version}.html"
+                isDefault = isDefaultViewer and isDefault
+                ver.viewerSelector = genViewerSelector(
+                    viewersLean, viewer, version, viewer, version, fileBase
+                )
+                result.append(ver)
+
+                if isDefault:
+                    ver = deepAttrDict(deepcopy(deepdict(ver)))
+                    ver.fileName = f"{fileBase}.html"
+                    result.append(ver)
+
+    return result
+
+
+def pagesAfter(editions, viewers, viewersLean):
+    """The page data of the edition pages as it is now."""
+    result = []
+
+    for fileBase, er in editions:
+        for viewerInfo in viewers:
+            viewer = viewerInfo.name
+            element = viewerInfo.element
+            isDefaultViewer = viewerInfo.isDefault
+
+            for versionInfo in viewerInfo.versions:
+                version = versionInfo.name
+                isDefault = isDefaultViewer and versionInfo.isDefault
+                overlay = dict(
+                    viewer=viewer,
+                    version=version,
+                    element=element,
+                    fileName=f"{fileBase}-{viewer}-{version}.html",
+                    viewerSelector=genViewerSelector(
+                        viewersLean, viewer, version, viewer, version, fileBase
+                    ),
+                )
+                result.append(AttrChainMap(overlay, er))
+
+                if isDefault:
+                    result.append(
+                        AttrChainMap(dict(fileName=f"{fileBase}.html"), overlay, er)
+                    )
+
+    return result
+
+
+YAML_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/yaml"
+
+TEMPLATE = """<html>
+<head><title>{{name}}</title></head>
+<body>
+<h1>{{projectName}}: {{name}}</h1>
+{{#with dc}}{{#each field0}}<p>{{this}}</p>{{/each}}{{/with}}
+<div>{{{toc}}}</div>
+<div>{{{viewerSelector}}}</div>
+<{{element}} root="{{url}}" version="{{version}}"></{{element}}>
+{{{citation}}}
+{{> footer}}
+</body>
+</html>
+"""
+
+FOOTER = """<footer>{{boilerplate.leftText}} {{boilerplate.rightText}}</footer>"""
+
+
+class Messages:
+    """Receives the messages of the page generation, and reports errors only."""
+
+    def debugAdd(self, obj):
+        pass
+
+    def info(self, msg=None, logmsg=None):
+        pass
+
+    def special(self, msg=None, logmsg=None):
+        pass
+
+    def warning(self, msg=None, logmsg=None):
+        pass
+
+    def error(self, msg=None, logmsg=None):
+        print(logmsg or msg)
+
+
+class Tailwind:
+    def generate(self):
+        return True
+
+
+class BenchStatic(Static):
+    """Generates the edition pages from synthetic data instead of the database."""
+
+    def __init__(self, Settings, Handlebars, makePages, viewers):
+        super().__init__(Settings, Messages(), None, None, Tailwind(), Handlebars)
+        self.makePages = makePages
+        self.viewers = viewers
+
+    def getDbData(self):
+        pass
+
+    def getData(self, kind, pNumGiven, eNumGiven):
+        return (
+            self.viewers
+            if kind == "viewers"
+            else self.makePages() if kind == "editionpages" else []
+        )
+
+
+def makeSettings(workDir):
+    """Settings for generating the pages in a working directory."""
+    Settings = AttrDict(
+        yamlDir=YAML_DIR,
+        viewerDir=f"{workDir}/viewers",
+        pubModeDir=f"{workDir}/published",
+        templateDir=f"{workDir}/templates",
+        partialsIn=f"{workDir}/partials",
+        jsDir=f"{workDir}/js",
+        imageDir=f"{workDir}/images",
+        buildManifest=f"{workDir}/published/build.json",
+        editionPages="versions",
+    )
+
+    for key in ("viewerDir", "templateDir", "partialsIn", "jsDir", "imageDir"):
+        dirMake(Settings[key])
+
+    with open(f"{Settings.templateDir}/edition.html", "w", encoding="utf8") as fh:
+        fh.write(TEMPLATE)
+
+    with open(f"{Settings.partialsIn}/footer.html", "w", encoding="utf8") as fh:
+        fh.write(FOOTER)
+
+    return Settings
+
+
+def peakMemory(func):
+    """The peak of the memory allocated while a function runs, in MB."""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    args = sys.argv[1:]
+
+    params = dict(editions=300, versions=15, fields=30, repeat=3)
+
+    while args:
+        arg = args.pop(0)
+        name = arg.removeprefix("--")
+
+        if name not in params or not args or not args[0].isdecimal():
+            print(HELP)
+            return 1
+
+        params[name] = int(args.pop(0))
+
+    nEditions = params["editions"]
+    nVersions = params["versions"]
+    nFields = params["fields"]
+    nRepeat = params["repeat"]
+
+    viewers = makeViewers(nVersions)
+    viewersLean = tuple(
+        (
+            vw.name,
+            vw.isDefault,
+            tuple((vv.name, vv.isDefault) for vv in vw.versions),
+        )
+        for vw in viewers
+    )
+    editions = [
+        (
+            f"project/{1 + e // 10}/edition/{e}/index",
+            makeEdition(1 + e // 10, e, nFields),
+        )
+        for e in range(nEditions)
+    ]
+
+    with TemporaryDirectory() as workDir:
+        Settings = makeSettings(workDir)
+        handlebars = Handlebars(f"{workDir}/templatecache")
+
+        def generator(makePages):
+            static = BenchStatic(Settings, handlebars, makePages, viewers)
+
+            def generate():
+                dirRemove(Settings.pubModeDir)
+
+                if not static.genPages(True, True):
+                    raise RuntimeError("page generation failed")
+
+            return generate
+
+        before = generator(lambda: pagesBefore(editions, viewers, viewersLean))
+        after = generator(lambda: pagesAfter(editions, viewers, viewersLean))
+
+        # the first run compiles the template and fills the template cache
+
+        after()
+
+        pBefore = peakMemory(before)
+        pAfter = peakMemory(after)
+        tBefore = min(repeat(before, number=1, repeat=nRepeat))
+        tAfter = min(repeat(after, number=1, repeat=nRepeat))
+
+    print(f"{nEditions} editions x ({nVersions} voyager versions + 1 default page)")
+    print(f"deep copies : {tBefore:6.2f} s  peak {pBefore:8.1f} MB")
+    print(f"overlays    : {tAfter:6.2f} s  peak {pAfter:8.1f} MB")
+    print(f"speedup     : {tBefore / tAfter:6.1f} x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
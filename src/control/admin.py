@@ -2,7 +2,7 @@ import re
 import json
 
 from .flask import requestData
-from .generic import AttrDict, lessAgo, amountTogo, isonow, dateOnly
+from .generic import AttrDict, amountTogo, isonow, isoago, dateOnly
 from .helpers import normalize
 from .files import dirExists, fileExists, fileRemove, FDEL
 
@@ -488,6 +488,7 @@ class Admin:
         ----------
         projectsAll: list
             The list of all projects, in as far they have not been marked as deleted.
+            Only the projects that the current user may read are shown.
 
         Returns
         -------
@@ -495,6 +496,10 @@ class Admin:
             The html for the section and a TOC entry
         """
         H = self.H
+        Auth = self.Auth
+
+        permitted = Auth.authoriseMany("project", projectsAll, action="read")
+        projectsAll = [p for p in projectsAll if permitted.get(p._id, False)]
 
         title = "All projects and editions"
         name = "all-projects"
@@ -1189,6 +1194,7 @@ class Admin:
             )
 
         Mongo.insertRecord("keyword", dict(name=name, value=value))
+        Content.clearKeywordCache()
 
         self.update()
         return dict(stat=True, messages=[], updated=self.wrap())
@@ -1219,7 +1225,7 @@ class Admin:
         User = Auth.myDetails()
         uName = User.nickname
 
-        keywords = Content.getKeywords()
+        keywords = Content.getKeywords(fresh=True)
         specs = json.loads(requestData())
         name = specs["name"]
         value = specs["value"]
@@ -1248,6 +1254,7 @@ class Admin:
             )
 
         good = Mongo.deleteRecord("keyword", dict(name=name, value=value), uName)
+        Content.clearKeywordCache()
         messages = [] if good else [["warning", "no keyword has been deleted"]]
 
         self.update()
@@ -1714,10 +1721,6 @@ class Admin:
         and editions.
         It also changes the possible user management actions in the future.
         """
-        Settings = self.Settings
-        delayUndel = Settings.sweeper.delayUndel
-
-        Mongo = self.Mongo
         Auth = self.Auth
         Auth.identify()
         User = Auth.myDetails()
@@ -1733,31 +1736,25 @@ class Admin:
         if not user:
             return
 
-        siteRecord = Mongo.getRecord("site", {})
-        userList = Mongo.getList("user", {}, sort="nickname")
-        projectList = Mongo.getList("project", {}, sort="title")
-        projectList2 = Mongo.getList("project", {}, sort="title")
-        editionList = Mongo.getList("edition", {}, sort="title")
-        projectLinks = Mongo.getList("projectUser", {})
-        editionLinks = Mongo.getList("editionUser", {})
+        (siteRecord, userList, projectList, editionList) = self.getOverview()
 
-        delProjectListAll = Mongo.getList("project", {}, deleted=True, sort="title")
-        delEditionListAll = Mongo.getList("edition", {}, deleted=True, sort="title")
-
-        delProjectList = [
-            r for r in delProjectListAll if lessAgo(delayUndel, r.get(MDELDT, None))
-        ]
-        delProjectSet = {r._id for r in delProjectList}
-        delEditionList = [
-            r for r in delEditionListAll if lessAgo(delayUndel, r.get(MDELDT, None))
-        ]
+        delProjectSet = {r._id for r in projectList if r.get(MDEL, False)}
 
         users = AttrDict({x.user: x for x in userList})
-        projects = AttrDict({x._id: x for x in projectList})
-        projects2 = AttrDict({x._id: x for x in projectList2})
-        editions = AttrDict({x._id: x for x in editionList})
+        projects = AttrDict(
+            {x._id: x for x in projectList if x._id not in delProjectSet}
+        )
+        editions = AttrDict({x._id: x for x in editionList if not x.get(MDEL, False)})
 
-        delProjects = AttrDict({x._id: x for x in delProjectList} | projects2)
+        # the deleted projects, and copies of the other projects,
+        # so that they can hold the deleted editions separately
+
+        delProjects = AttrDict(
+            {
+                x._id: x if x._id in delProjectSet else AttrDict(x)
+                for x in projectList
+            }
+        )
 
         myIds = AttrDict()
 
@@ -1771,12 +1768,13 @@ class Admin:
         for eRecord in editionList:
             eId = eRecord._id
             pId = eRecord.projectId
-            projects[pId].setdefault("editions", {})[eId] = eRecord
+            deleted = eRecord.get(MDEL, False)
+            pRecord = (delProjects if deleted else projects)[pId]
 
-        for eRecord in delEditionList:
-            eId = eRecord._id
-            pId = eRecord.projectId
-            delProjects[pId].setdefault("editions", {})[eId] = eRecord
+            if pRecord is None:
+                continue
+
+            pRecord.setdefault("editions", {})[eId] = eRecord
 
         # delete projects that are not themselves deleted and have no deleted editions
 
@@ -1794,24 +1792,15 @@ class Admin:
         for pID in toBeRemoved:
             del delProjects[pID]
 
-        for pLink in projectLinks:
-            role = pLink.role
-
-            if role:
+        for pId, pRecord in projects.items():
+            for pLink in pRecord.pop("links", []):
                 u = pLink.user
+                role = pLink.role
                 uRecord = users[u]
 
                 if uRecord is None:
                     continue
 
-                pId = pLink.projectId
-                pRecord = projects[pId]
-
-                if pRecord is None:
-                    continue
-
-                pRecord.setdefault("users", AttrDict())
-
                 if user == u:
                     myIds.setdefault("project", set()).add(pId)
 
@@ -1820,22 +1809,15 @@ class Admin:
 
                 pRecord.setdefault("users", AttrDict())[u] = (uRecord, role)
 
-        for eLink in editionLinks:
-            role = eLink.role
-
-            if role:
+        for eId, eRecord in editions.items():
+            for eLink in eRecord.pop("links", []):
                 u = eLink.user
+                role = eLink.role
                 uRecord = users[u]
 
                 if uRecord is None:
                     continue
 
-                eId = eLink.editionId
-                eRecord = editions[eId]
-
-                if eRecord is None:
-                    continue
-
                 pId = eRecord.projectId
 
                 if user == u:
@@ -1844,6 +1826,127 @@ class Admin:
 
                 eRecord.setdefault("users", AttrDict())[u] = (uRecord, role)
 
+    def getOverview(self):
+        """Fetch the users, projects and editions for the admin page.
+
+        This is done in a single aggregation on the database,
+        so it costs one round trip, however big the site is.
+
+        The pipeline starts with the site record, and adds the users, projects
+        and editions to it by means of `$unionWith`.
+        Only the fields that the `wrap` functions need are retrieved.
+
+        Projects and editions that are marked as deleted are only retrieved
+        if they are deleted recently enough to be undeleted.
+        For the other projects and editions, the users with their roles are
+        looked up in the link tables by means of `$lookup`,
+        and stored in the field `links`.
+
+        Returns
+        -------
+        tuple
+            *   the site record
+            *   the list of users, sorted by nickname
+            *   the list of projects, sorted by title
+            *   the list of editions, sorted by title
+        """
+        Settings = self.Settings
+        delayUndel = Settings.sweeper.delayUndel
+        Mongo = self.Mongo
+
+        notDeleted = {MDEL: None}
+        recentlyDeleted = {
+            MDEL: {"$exists": True},
+            "$or": [
+                {MDELDT: {"$gt": isoago(delayUndel), "$lte": isonow()}},
+                {MDELDT: None},
+            ],
+        }
+
+        def itemPipeline(kind, fields, crossTable, idField):
+            projection = {"$project": {f: 1 for f in fields} | {"_kind": kind}}
+
+            # only the live items get their links, the deleted ones are added
+            # without them
+
+            return [
+                {"$match": notDeleted},
+                projection,
+                {
+                    "$lookup": {
+                        "from": crossTable,
+                        "localField": "_id",
+                        "foreignField": idField,
+                        "pipeline": [
+                            {"$match": notDeleted | {"role": {"$nin": [None, ""]}}},
+                            {"$project": {"_id": 0, "user": 1, "role": 1}},
+                        ],
+                        "as": "links",
+                    }
+                },
+                {
+                    "$unionWith": {
+                        "coll": kind,
+                        "pipeline": [{"$match": recentlyDeleted}, projection],
+                    }
+                },
+                {"$sort": {"title": 1}},
+            ]
+
+        delFields = (MDEL, MDELDT, MDELBY)
+        pipeline = [
+            {"$limit": 1},
+            {"$addFields": {"_kind": "site"}},
+            {
+                "$unionWith": {
+                    "coll": "user",
+                    "pipeline": [
+                        {"$match": notDeleted},
+                        {"$sort": {"nickname": 1}},
+                        {"$project": {"user": 1, "nickname": 1, "role": 1}},
+                        {"$addFields": {"_kind": "user"}},
+                    ],
+                }
+            },
+            {
+                "$unionWith": {
+                    "coll": "project",
+                    "pipeline": itemPipeline(
+                        "project",
+                        ("title", "isVisible", *delFields),
+                        "projectUser",
+                        "projectId",
+                    ),
+                }
+            },
+            {
+                "$unionWith": {
+                    "coll": "edition",
+                    "pipeline": itemPipeline(
+                        "edition",
+                        ("title", "isPublished", "projectId", *delFields),
+                        "editionUser",
+                        "editionId",
+                    ),
+                }
+            },
+        ]
+
+        (good, records) = Mongo.executeMongo("site", "aggregate", pipeline, fetch=True)
+
+        site = AttrDict()
+        itemLists = dict(user=[], project=[], edition=[])
+
+        for record in records or []:
+            kind = record.pop("_kind")
+
+            if kind == "site":
+                site = record
+            else:
+                itemLists[kind].append(record)
+
+        return (site, itemLists["user"], itemLists["project"], itemLists["edition"])
+
     def authUser(self, otherUser, table=None, record=None):
         """Check whether a user may change the role of another user.
 
@@ -37,6 +37,7 @@ def appFactory(objects):
 
     Settings = objects.Settings
     Messages = objects.Messages
+    Mongo = objects.Mongo
     Auth = objects.Auth
     AuthOidc = objects.AuthOidc
     Content = objects.Content
@@ -74,6 +75,25 @@ def appFactory(objects):
         if not appInitializing():
             Auth.identify()
 
+    @app.after_request
+    def report(response):
+        """Report on the database usage of the current request.
+
+        A summary goes to the log and the time spent in the database
+        is added to the response as a `Server-Timing` header.
+
+        See `control.mongo.Mongo.identityReport()` and
+        `control.mongo.Mongo.requestSummary()`.
+        """
+        if Mongo is not None:
+            Mongo.identityReport()
+            timing = Mongo.requestSummary()
+
+            if timing is not None:
+                response.headers["Server-Timing"] = timing
+
+        return response
+
     @app.route("/favicon.ico")
     def favicon():
         """Get the favicon."""
@@ -1,5 +1,8 @@
-from itertools import chain
+from time import monotonic
+
 from .generic import AttrDict
+from .flask import acg, hasAcg
+from .authrules import allowedActions
 from .users import Users
 
 
@@ -30,6 +33,9 @@ class Auth(Users):
         """
         super().__init__(Settings, Messages, Mongo)
         self.Content = Content
+        self.decisionCache = {}
+        self.webdavCache = {}
+        self.webdavStats = AttrDict(hits=0, misses=0)
 
     def authorise(self, table, record, nameSpace=None, action=None, insertTable=None):
         """Check whether an action is allowed on data.
@@ -61,6 +67,8 @@ class Auth(Users):
         states of the records and master records in order to select the
         appropriate rules.
 
+        The decisions are memoised, see `Auth.cachedDecision()`.
+
         Parameters
         ----------
         table: string
@@ -94,7 +102,6 @@ class Auth(Users):
             `action in result`
         """
         Messages = self.Messages
-        Content = self.Content
         isCreate = action == "create"
 
         if (
@@ -117,17 +124,18 @@ class Auth(Users):
         Settings = self.Settings
         Mongo = self.Mongo
 
-        detailMaster = Content.detailMaster
-
         User = self.myDetails()
-        user = User.user
         role = User.role
 
         # we select the authorisation rules for this table
+        # Note that in case of "create" the table we act upon is a detail of
+        # what we passed as "table"
+
+        actTable = insertTable if isCreate else table
 
         auth = Settings.auth
         authRules = auth.authRules
-        tableRules = authRules.get(insertTable if isCreate else table, AttrDict())
+        tableRules = authRules.get(actTable, AttrDict())
 
         # we need the state of the record that we want to apply the action to
         # If the action is create, we have no record.
@@ -155,99 +163,143 @@ class Auth(Users):
                 if state is None:
                     state = initState
 
-        # we select the rules for the given state, if any
+        # The decision may have been made before
 
-        rules = {
-            act: actInfo[state] if stateInfo else actInfo
-            for (act, actInfo) in tableRules.items()
-            if act != "state"
-        }
+        key = (
+            User.user,
+            role,
+            table,
+            recordId,
+            insertTable if isCreate else None,
+            state,
+            nameSpace,
+        )
+        allowed = self.cachedDecision(key)
 
-        # for each possible action, the rules specify the roles that may perform
-        # that action.
+        if allowed is None:
+            allowed = self.decide(
+                actTable, isCreate, state, recordId, record, role, nameSpace
+            )
+            self.cacheDecision(key, allowed)
 
-        # We collect the set of all possible roles and organize them by table
+        # Finally we return the result.
+        #
+        # If no action is given, we return the allowed actions as a dict.
+        # Otherwise we return whether the given action is allowed.
 
-        tableFromRole = auth.tableFromRole
-        userCoupled = set(auth.userCoupled)
+        return {act: True for act in allowed} if action is None else action in allowed
 
-        # for each of the roles we have to determine whether the role is
-        # * site wide (table = site)
-        # * associated with a master table
-        # * associated with a detail table
+    def authoriseMany(self, table, records, action=None, nameSpace=None):
+        """Check whether an action is allowed on each of a list of records.
 
-        # First we get the tables associated with each role
+        This is `Auth.authorise()` for lists of records, such as the projects
+        and editions in an overview.
+        Records that are given by id are fetched in a single query;
+        the roles of the current user are loaded once per request
+        (see `control.users.Users.myRoles()`), so no further queries are needed.
 
-        allAllowedRoles = {
-            role: tableFromRole[role]
-            for role in set(
-                chain.from_iterable(v.keys() for v in rules.values() if v is not None)
-            )
-        }
+        The decisions also end up in the caches of `Auth.authorise()`,
+        so subsequent calls for the same records, e.g. by
+        `control.content.Content.getUpload()`, do not compute them again.
 
-        # Then we determine which of these tables are master, detail, or none of
-        # those, with respect to the table we are acting upon.
-        # Note that in case of "create" the table we act upon is a detail of
-        # what we passed as "table"
+        The "create" action is not supported here.
 
-        allRelatedTables = (
-            {
-                relatedTable: (
-                    "self"
-                    if relatedTable == insertTable
-                    else (
-                        "detail"
-                        if detailMaster[relatedTable] == insertTable
-                        else (
-                            "master"
-                            if detailMaster[insertTable] == relatedTable
-                            else ""
-                        )
-                    )
-                )
-                for relatedTable in allAllowedRoles.values()
-            }
-            if isCreate
-            else {
-                relatedTable: (
-                    "self"
-                    if relatedTable == table
-                    else (
-                        "detail"
-                        if detailMaster[relatedTable] == table
-                        else "master" if detailMaster[table] == relatedTable else ""
-                    )
-                )
-                for relatedTable in allAllowedRoles.values()
-            }
+        Parameters
+        ----------
+        table: string
+            The table in which the records are.
+        records: iterable of ObjectId | string | AttrDict
+            The ids of the records or the records themselves.
+        action: string, optional None
+            The action for which permission is asked.
+        nameSpace: string, optional None
+            See `Auth.authorise()`.
+
+        Returns
+        -------
+        dict
+            Keyed by the ids of the records that exist, and valued by what
+            `Auth.authorise()` returns for that record.
+        """
+        Mongo = self.Mongo
+
+        records = list(records)
+        ids = [Mongo.cast(r) for r in records if type(r) is str or Mongo.isId(r)]
+        fetched = (
+            Mongo.getList(table, {"_id": {"$in": ids}}, asDict=True) if ids else {}
         )
 
+        decisions = {}
+
+        for record in records:
+            if type(record) is str or Mongo.isId(record):
+                record = fetched.get(Mongo.cast(record), None)
+
+            if not record:
+                continue
+
+            decisions[record._id] = self.authorise(
+                table, record, nameSpace=nameSpace, action=action
+            )
+
+        return decisions
+
+    def decide(self, actTable, isCreate, state, recordId, record, role, nameSpace):
+        """Computes the actions that the current user may perform on a record.
+
+        This is the part of `Auth.authorise()` that is memoised.
+
+        Parameters
+        ----------
+        actTable: string
+            The table of the record on which the actions will be performed;
+            for `create` actions it is the table in which a record will be inserted.
+        isCreate: boolean
+            Whether we decide about a `create` action.
+        state: any
+            The state of the record, or None if its table has no states.
+        recordId: ObjectId
+            The id of the record; for `create` actions the id of the master record.
+        record: AttrDict
+            The record; for `create` actions the master record.
+        role: string | void
+            The site-wide role of the current user.
+        nameSpace: string | void
+            The nameSpace of the fields on which the actions will be performed.
+
+        Returns
+        -------
+        frozenset
+            The allowed actions.
+        """
+        Settings = self.Settings
+        auth = Settings.auth
+
+        # The rules have been compiled into lookup tables by
+        # `control.config.Config.checkAuth()`.
+        #
+        # For the table and state we find the related tables that may give
+        # the current user extra roles, and for each of them whether it is
+        # the table itself, a master table, or a detail table.
+
+        relatedTables = auth.relatedTables.get((actTable, state), {})
+
         # for each of the relatedTables we compute whether it leads to extra roles
         # for the current user.
         # We look for related records in those tables to which the user is related.
 
         userRoles = {role}
+        myRoles = self.myRoles() if relatedTables else None
 
-        for relatedTable, kind in allRelatedTables.items():
-            if kind == "":
-                continue
-
-            if relatedTable not in userCoupled:
-                continue
-
+        for relatedTable, kind in relatedTables.items():
             relatedIdField = f"{relatedTable}Id"
-            relatedCrossTable = f"{relatedTable}User"
+            relatedRoles = myRoles.roles[relatedTable] or {}
 
             if kind == "self":
                 if isCreate:
                     continue
 
-                crossRecord = Mongo.getRecord(
-                    relatedCrossTable,
-                    {"user": user, relatedIdField: recordId},
-                    warn=False,
-                )
-                extraRole = crossRecord.role
+                extraRole = relatedRoles.get(recordId, None)
 
                 if extraRole is not None:
                     userRoles.add(extraRole)
@@ -262,16 +314,10 @@ class Auth(Users):
                     masterId = record[relatedIdField]
 
                 # we do not need the master record itself,
-                # instead we are interested in the coupling record
-                # of the relatedTable with the user table
-                # because we find a user role there
-
-                crossRecord = Mongo.getRecord(
-                    relatedCrossTable,
-                    {"user": user, relatedIdField: masterId},
-                    warn=False,
-                )
-                extraRole = crossRecord.role
+                # instead we are interested in the role of the user
+                # with respect to the master record
+
+                extraRole = relatedRoles.get(masterId, None)
 
                 if extraRole is not None:
                     userRoles.add(extraRole)
@@ -283,73 +329,265 @@ class Auth(Users):
                 if isCreate:
                     continue
 
-                # look up all detail records in the detail table
+                # we need the roles of the user with respect to the detail records
+                # of this record
 
-                idField = f"{table}Id"
-                detailRecords = Mongo.getList(relatedTable, {idField: recordId})
-                detailIds = [detailRecord._id for detailRecord in detailRecords]
+                relatedMasters = myRoles.masters[relatedTable] or {}
 
-                # we need the cross records between these detail records and
-                # the user table, and we read the extra roles from those
-                # records
+                for detailId, extraRole in relatedRoles.items():
+                    if relatedMasters.get(detailId, None) == recordId:
+                        userRoles.add(extraRole)
 
-                crossRecords = Mongo.getList(
-                    relatedCrossTable,
-                    {"user": user, relatedIdField: {"$in": detailIds}},
-                )
+        # Now we have the set of roles that this user has mbt to the given record
+        # and all of its relevant master and detail records.
+        # The compiled permissions give for each role the actions it allows,
+        # depending on the nameSpace.
 
-                for crossRecord in crossRecords:
-                    extraRole = crossRecord.role
-                    if extraRole is not None:
-                        userRoles.add(extraRole)
+        return frozenset(
+            allowedActions(
+                auth.permissions, actTable, state, userRoles, nameSpace=nameSpace
+            )
+        )
 
-        # Now we have
-        # 1. userRoles:
-        #    the set of roles that this user has mbt to the given record
-        #    and all of its relevant master and detail records
-        # 2. rules
-        #    a dictionary mapping each possible action to the
-        #    roles a user needs to have to perform that action
-        #    The roles itself are given as a dict, keyed by the role
-        #    and valued by a boolean or a set, depending on the action.
-        #    If it is a set (in fact, a list), it is a list of nameSpace,
-        #    and the nameSpace parameter that has been passed to this function
-        #    will be used.
-
-        # We compute the allowed actions resulting in a dict keyed by the action
-        # and valued by a boolean.
-
-        allowedActions = {}
-
-        for act, requiredRoles in rules.items():
-            if requiredRoles is None:
-                continue
+    def cachedDecision(self, key):
+        """Looks up an earlier authorisation decision.
+
+        Decisions are cached at two levels:
+
+        *   per request, in the application-context-global `authDecisions`;
+        *   per worker process, for the number of seconds in the setting
+            `cacheTtl.auth`, so that bursts of requests from the same user,
+            e.g. by WebDAV clients, can reuse them.
+            If that setting is 0 or absent, there is no such cache.
+
+        Decisions are stamped with the version of users and roles and the version
+        of the states of records, see `control.mongo.Mongo.decisionVersion()`.
+        When one of those changes, in whatever worker process, the decisions
+        are not used anymore.
 
-            permission = False
+        Parameters
+        ----------
+        key: tuple
+            The user, site-wide role, table, record id, insert table, record state,
+            and nameSpace of the decision.
 
-            for presentRole in userRoles:
-                permValue = requiredRoles.get(presentRole, False)
+        Returns
+        -------
+        frozenset | void
+            The allowed actions, or None if the decision is not in the caches.
+        """
+        Mongo = self.Mongo
+        version = Mongo.decisionVersion()
 
-                if type(permValue) is not bool:
-                    if nameSpace is None:
-                        permValue = "" in permValue
-                    else:
-                        permValue = nameSpace in permValue
+        requestCache = self.requestDecisions(version)
 
-                if permValue:
-                    permission = True
-                    break
+        if requestCache is not None:
+            allowed = requestCache.get(key, None)
 
-            if permission:
-                allowedActions[act] = True
+            if allowed is not None:
+                return allowed
 
-        # Finally we return the result.
-        #
-        # If no action is given, we return the allowedActions straightaway.
-        # Otherwise we lookup the given action in allowedActions, get the
-        # associated value (or provide a falsy default), and return that.
+        entry = self.decisionCache.get(key, None)
 
-        return allowedActions if action is None else allowedActions.get(action, False)
+        if entry is None:
+            return None
+
+        (expires, entryVersion, allowed) = entry
+
+        if version is None or entryVersion != version or monotonic() >= expires:
+            self.decisionCache.pop(key, None)
+            return None
+
+        if requestCache is not None:
+            requestCache[key] = allowed
+
+        return allowed
+
+    def cacheDecision(self, key, allowed):
+        """Stores an authorisation decision in the caches.
+
+        See `Auth.cachedDecision()`.
+
+        Parameters
+        ----------
+        key: tuple
+            The key of the decision.
+        allowed: frozenset
+            The allowed actions.
+        """
+        Settings = self.Settings
+        Mongo = self.Mongo
+        ttl = (Settings.cacheTtl or AttrDict()).auth or 0
+        version = Mongo.decisionVersion()
+
+        requestCache = self.requestDecisions(version)
+
+        if requestCache is not None:
+            requestCache[key] = allowed
+
+        if ttl and version is not None:
+            decisionCache = self.decisionCache
+            now = monotonic()
+
+            if len(decisionCache) > 10000:
+                for k, v in list(decisionCache.items()):
+                    if v[0] <= now:
+                        decisionCache.pop(k, None)
+
+            decisionCache[key] = (now + ttl, version, allowed)
+
+    @staticmethod
+    def requestDecisions(version):
+        """The authorisation decisions of the current request.
+
+        They are kept in the application-context-global `authDecisions`,
+        and they are dropped when the version of users, roles and states changes
+        during the request.
+
+        Parameters
+        ----------
+        version: tuple | void
+            The current version of users, roles and states,
+            see `control.mongo.Mongo.decisionVersion()`.
+
+        Returns
+        -------
+        dict | void
+            The decisions, keyed as in `Auth.cachedDecision()`,
+            or None if there is no request.
+        """
+        if not hasAcg():
+            return None
+
+        requestCache = acg.get("authDecisions", None)
+
+        if requestCache is None or requestCache.version != version:
+            requestCache = AttrDict(version=version, decisions={})
+            acg.authDecisions = requestCache
+
+        return requestCache.decisions
+
+    def clearDecisions(self):
+        """Clears the caches of authorisation decisions.
+
+        Call this after changes in the states of records, such as publishing
+        editions and changing the visibility of projects.
+
+        The version of the states of records is increased, so that the other worker
+        processes do not use their cached decisions anymore.
+        The caches of users and roles stay valid.
+        Changes in users and their roles increase their own version,
+        see `control.mongo.Mongo.forget()`, which also invalidates the decisions.
+        """
+        Mongo = self.Mongo
+
+        self.decisionCache.clear()
+        self.webdavCache.clear()
+        Mongo.bumpDecisionVersion()
+
+        if hasAcg():
+            acg.authDecisions = None
+
+    def webdavDecision(self, key, version):
+        """Looks up an earlier authorisation decision about a WebDAV request.
+
+        WebDAV requests are authorised by the main app in a request context of its
+        own, see `control.webdavapp.dispatchWebdav()`.
+        A viewer that opens a scene fires many WebDAV requests in a short time,
+        so those decisions are cached per worker process,
+        for the number of seconds in the setting `cacheTtl.webdav`.
+        The cache is checked before the request context is made.
+
+        Like the other authorisation decisions, these decisions are stamped with
+        the version of users, roles and states, see `Auth.cachedDecision()`.
+        The dispatcher reads that version before it looks up the decision;
+        outside requests the version counters are remembered for a second or so,
+        see `control.mongo.Mongo.versions()`, so a hit costs no database work.
+
+        If the setting `cacheLog.webdav` is a positive number, the hit rate
+        of this cache is logged after every so many lookups.
+
+        Parameters
+        ----------
+        key: tuple
+            The session cookie, project, edition, and action (`read` or `update`)
+            of the request.
+        version: tuple | void
+            The current version of users, roles and states.
+
+        Returns
+        -------
+        boolean | void
+            The decision, or None if it is not in the cache.
+        """
+        Settings = self.Settings
+        ttl = (Settings.cacheTtl or AttrDict()).webdav or 0
+
+        if not ttl:
+            return None
+
+        webdavStats = self.webdavStats
+        entry = self.webdavCache.get(key, None)
+        permitted = None
+
+        if entry is not None:
+            (expires, entryVersion, permitted) = entry
+
+            if version is None or entryVersion != version or monotonic() >= expires:
+                self.webdavCache.pop(key, None)
+                permitted = None
+
+        if permitted is None:
+            webdavStats.misses += 1
+        else:
+            webdavStats.hits += 1
+
+        logEvery = (Settings.cacheLog or AttrDict()).webdav or 0
+
+        if logEvery:
+            hits = webdavStats.hits
+            total = hits + webdavStats.misses
+
+            if total % logEvery == 0:
+                self.Messages.info(
+                    logmsg=(
+                        f"WEBDav auth cache: {hits} hits in {total} lookups "
+                        f"({100 * hits / total:.1f}%)"
+                    )
+                )
+
+        return permitted
+
+    def cacheWebdavDecision(self, key, permitted, version):
+        """Stores an authorisation decision about a WebDAV request.
+
+        See `Auth.webdavDecision()`.
+
+        Parameters
+        ----------
+        key: tuple
+            The key of the decision.
+        permitted: boolean
+            Whether the request is authorised.
+        version: tuple | void
+            The version of users, roles and states that was current before the
+            decision was made.
+        """
+        Settings = self.Settings
+        ttl = (Settings.cacheTtl or AttrDict()).webdav or 0
+
+        if not ttl or version is None:
+            return
+
+        webdavCache = self.webdavCache
+        now = monotonic()
+
+        if len(webdavCache) > 10000:
+            for k, v in list(webdavCache.items()):
+                if v[0] <= now:
+                    webdavCache.pop(k, None)
+
+        webdavCache[key] = (now + ttl, version, bool(permitted))
 
     def mayBackup(self, project=None):
         """Whether the current user is allowed to make backups.
@@ -389,11 +627,8 @@ class Auth(Users):
         if projectId is None:
             return False
 
-        user = User.user
-        projectUser = Mongo.getRecord(
-            "projectUser", dict(user=user, projectId=projectId), warn=False
-        )
-        return projectUser.role == "organiser"
+        myRoles = self.myRoles()
+        return (myRoles.roles.project or {}).get(projectId, None) == "organiser"
 
     def makeSafe(self, table, record, action):
         """Changes an update action into a read action if needed.
@@ -0,0 +1,161 @@
+"""Compiling the authorisation rules into lookup tables.
+
+The rules in `yaml/authorise.yml` are organised by table, action, state and role.
+But `control.auth.Auth.authorise()` asks the question the other way round:
+given a table, the state of a record in it, and the roles of the user,
+which actions are allowed?
+
+So we compile the rules once, when the configuration is read
+(see `control.config.Config.checkAuth()`), into tables that answer that question
+by lookup. At run time, authorisation is then a few lookups and set unions.
+
+This module does not depend on flask, so that `benchauth.py` can use it
+without a running app.
+"""
+
+
+def compileRules(authRules, tableFromRole, userCoupled, detailMaster):
+    """Compiles the authorisation rules.
+
+    Parameters
+    ----------
+    authRules: AttrDict
+        The rules as specified in `yaml/authorise.yml` under `authRules`.
+    tableFromRole: dict
+        Gives for each role the table with respect to which a user may have that role.
+    userCoupled: iterable
+        The tables whose records can be coupled to users, with a role.
+    detailMaster: dict
+        Gives for each detail table its master table.
+
+    Returns
+    -------
+    dict, dict
+        The permissions and the related tables.
+
+        The permissions are keyed by `(table, state, role)` and valued by a dict
+        keyed by nameSpace and valued by the frozen set of actions that the role
+        allows on a record of that table in that state, for fields in that
+        nameSpace.
+        The key `None` gives the actions that are allowed for the nameSpaces that
+        are not mentioned in the rules of that table, state, and role.
+
+        The related tables are keyed by `(table, state)` and valued by a dict,
+        keyed by the user-coupled tables of the roles that occur in the rules
+        of that table and state, and valued by how they relate to the table:
+        `self`, `master`, or `detail`.
+        Tables that are not related in one of these ways are left out.
+
+        If the table has no state, the state in the keys is `None`.
+    """
+    userCoupled = set(userCoupled)
+
+    # first we collect, per table, state and role, the actions that are allowed
+    # for all nameSpaces and the actions that are allowed for specific nameSpaces
+
+    allNs = {}
+    someNs = {}
+    roles = {}
+
+    for table, tableRules in authRules.items():
+        stateInfo = tableRules.get("state", None)
+
+        for act, actInfo in tableRules.items():
+            if act == "state":
+                continue
+
+            stateRules = actInfo.items() if stateInfo else [(None, actInfo)]
+
+            for state, requiredRoles in stateRules:
+                if requiredRoles is None:
+                    continue
+
+                for role, permValue in requiredRoles.items():
+                    roles.setdefault((table, state), set()).add(role)
+                    key = (table, state, role)
+                    allNs.setdefault(key, set())
+                    someNs.setdefault(key, {})
+
+                    if type(permValue) is bool:
+                        if permValue:
+                            allNs[key].add(act)
+                    else:
+                        for nameSpace in permValue:
+                            someNs[key].setdefault(nameSpace, set()).add(act)
+
+    permissions = {}
+
+    for key, acts in allNs.items():
+        permissions[key] = {None: frozenset(acts)} | {
+            nameSpace: frozenset(acts | nsActs)
+            for (nameSpace, nsActs) in someNs[key].items()
+        }
+
+    # then we determine, per table and state, which tables are relevant for finding
+    # extra roles of the user
+
+    relatedTables = {}
+
+    for (table, state), tableRoles in roles.items():
+        kinds = {}
+
+        for role in tableRoles:
+            relatedTable = tableFromRole.get(role, None)
+
+            if relatedTable not in userCoupled:
+                continue
+
+            kind = (
+                "self"
+                if relatedTable == table
+                else (
+                    "detail"
+                    if detailMaster.get(relatedTable, None) == table
+                    else (
+                        "master"
+                        if detailMaster.get(table, None) == relatedTable
+                        else ""
+                    )
+                )
+            )
+
+            if kind:
+                kinds[relatedTable] = kind
+
+        relatedTables[(table, state)] = kinds
+
+    return (permissions, relatedTables)
+
+
+def allowedActions(permissions, table, state, roles, nameSpace=None):
+    """Looks up the actions that are allowed by a set of roles.
+
+    Parameters
+    ----------
+    permissions: dict
+        The compiled permissions, see `compileRules()`.
+    table: string
+        The table of the record on which the actions will be performed.
+    state: any
+        The state of the record, or None if the table has no states.
+    roles: iterable
+        The roles that the user has with respect to the record.
+    nameSpace: string, optional None
+        The nameSpace of the fields on which the actions will be performed.
+        If None, nameSpace `''` is assumed.
+
+    Returns
+    -------
+    set
+        The allowed actions.
+    """
+    nameSpace = "" if nameSpace is None else nameSpace
+    allowed = set()
+
+    for role in roles:
+        perm = permissions.get((table, state, role), None)
+
+        if perm is not None:
+            allowed |= perm.get(nameSpace, perm[None])
+
+    return allowed
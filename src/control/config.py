@@ -6,6 +6,7 @@ from .files import dirMake, dirExists, fileExists, readYaml, readPath, listDirs
 from .helpers import ucFirst
 from .environment import var
 from .html import HtmlElements
+from .authrules import compileRules
 
 
 class Config:
@@ -73,6 +74,7 @@ class Config:
             self.checkData,
             self.checkMongo,
             self.checkDatamodel,
+            self.checkIndexes,
             self.checkAuth,
             self.checkViewers,
             self.checkBanner,
@@ -477,8 +479,36 @@ class Config:
 
         Settings.datamodel = datamodel
 
+    def checkIndexes(self):
+        """Read the yaml file with the index specifications of the MongoDb tables.
+
+        The indexes will be created by `control.mongo.Mongo.ensureIndexes()`.
+        """
+        if self.design or self.migrate:
+            return
+
+        Messages = self.Messages
+        Settings = self.Settings
+
+        yamlDir = Settings.yamlDir
+
+        indexesFile = "indexes.yml"
+        indexes = readYaml(asFile=f"{yamlDir}/{indexesFile}", preferTuples=False)
+
+        if indexes is None:
+            Messages.error(logmsg=f"Cannot read {indexesFile} in {yamlDir}")
+            self.good = False
+            return
+
+        Settings.indexes = indexes
+
     def checkAuth(self):
-        """Read the yaml file with the authorisation rules."""
+        """Read the yaml file with the authorisation rules.
+
+        The rules are also compiled into lookup tables, see
+        `control.authrules.compileRules()`, which are stored in the
+        `permissions` and `relatedTables` members of `Settings.auth`.
+        """
         if self.design or self.migrate:
             return
 
@@ -507,6 +537,15 @@ class Config:
         rank = {role: i for (i, role) in enumerate(authData.rolesOrder)}
         Settings.auth.roleRank = lambda role: rank[role]
 
+        (permissions, relatedTables) = compileRules(
+            authData.authRules,
+            tableFromRole,
+            authData.userCoupled,
+            Settings.datamodel.detailMaster,
+        )
+        Settings.auth.permissions = permissions
+        Settings.auth.relatedTables = relatedTables
+
     def checkViewers(self):
         """Make an inventory of the supported 3D viewers."""
         if self.migrate:
@@ -729,6 +768,8 @@ class Config:
 
         pubModeDir = Settings.pubModeDir
         Settings.cssOut = f"{pubModeDir}/css/style.css"
+        Settings.buildManifest = f"{pubModeDir}/build.json"
 
         dataDir = Settings.dataDir
         Settings.binDir = f"{dataDir}/bin"
+        Settings.templateCacheDir = f"{dataDir}/templatecache"
@@ -688,6 +688,9 @@ class Content(Datamodel):
         else:
             (recordId, record) = Mongo.get(table, recordId)
 
+        if tp == "keyword":
+            self.clearKeywordCache()
+
         now = isonow()
         dateCreatedPath = fieldPaths["dateCreated"]
         dateModifiedPath = fieldPaths["dateModified"]
@@ -1682,7 +1685,11 @@ class Content(Datamodel):
             "edition", record
         )
 
-        return Publish.updateEdition(site, project, edition, "add", uName, force=force)
+        result = Publish.updateEdition(
+            site, project, edition, "add", uName, force=force
+        )
+        Auth.clearDecisions()
+        return result
 
     def republish(self, record, force):
         """Re-ublish an edition.
@@ -1726,9 +1733,11 @@ class Content(Datamodel):
             "edition", record
         )
 
-        return Publish.updateEdition(
+        result = Publish.updateEdition(
             site, project, edition, "add", uName, force=force, again=True
         )
+        Auth.clearDecisions()
+        return result
 
     def unpublish(self, record):
         """Unpublish an edition.
@@ -1770,7 +1779,9 @@ class Content(Datamodel):
             "edition", record
         )
 
-        return Publish.updateEdition(site, project, edition, "remove", uName)
+        result = Publish.updateEdition(site, project, edition, "remove", uName)
+        Auth.clearDecisions()
+        return result
 
     def generate(self):
         """Regenerate the HTML for the published site.
@@ -1927,20 +1938,22 @@ class Content(Datamodel):
 
             dirCopy(src, landing)
 
-            with open(yamlDest, "w") as yh:
-                yaml.dump(Mongo.consolidate(project), yh, allow_unicode=True)
+            editions = (
+                Mongo.getList("edition", dict(projectId=projectId), sort="title")
+                if edition is None
+                else []
+            )
+            (projectInfo, *editionInfos) = Mongo.consolidateMany([project, *editions])
 
-            if edition is None:
-                editions = Mongo.getList(
-                    "edition", dict(projectId=projectId), sort="title"
-                )
+            with open(yamlDest, "w") as yh:
+                yaml.dump(projectInfo, yh, allow_unicode=True)
 
-                for ed in editions:
-                    edId = ed._id
-                    yamlDest = f"{landing}/edition/{edId}/edition.yaml"
+            for ed, edInfo in zip(editions, editionInfos):
+                edId = ed._id
+                yamlDest = f"{landing}/edition/{edId}/edition.yaml"
 
-                    with open(yamlDest, "w") as yh:
-                        yaml.dump(Mongo.consolidate(ed), yh, allow_unicode=True)
+                with open(yamlDest, "w") as yh:
+                    yaml.dump(edInfo, yh, allow_unicode=True)
 
             with ZipFile(zipFilePath, "w", compression=ZIP_DEFLATED) as zipFile:
 
@@ -1,6 +1,9 @@
+from time import monotonic
+
 from markdown import markdown
 
 from .generic import AttrDict, pseudoisonow
+from .mongo import MDEL
 from .files import fileExists, listFilesAccepted, writeYaml
 
 
@@ -60,6 +63,7 @@ class Datamodel:
         self.fieldsConfig = fieldsConfig
         self.fieldDistribution = fieldDistribution
         self.fieldPaths = fieldPaths
+        self.keywordCache = None
 
     @staticmethod
     def specialize(table, record):
@@ -375,8 +379,12 @@ class Datamodel:
             The number of editions
         """
         Mongo = self.Mongo
-        nProjects = len(Mongo.getList("projectUser", dict(user=user)))
-        nEditions = len(Mongo.getList("EditionUser", dict(user=user)))
+        nProjects = len(
+            Mongo.getList("projectUser", dict(user=user), projection=["_id"])
+        )
+        nEditions = len(
+            Mongo.getList("EditionUser", dict(user=user), projection=["_id"])
+        )
         return (nProjects, nEditions)
 
     def getLinkedCrit(self, table, record, deleted=False):
@@ -424,7 +432,7 @@ class Datamodel:
 
         return linkCriteria
 
-    def getKeywords(self, extra=None):
+    def getKeywords(self, extra=None, fresh=False):
         """Get the lists of keywords that act as values for metadata fields.
 
         A keyword is a string value and it belongs to a list of keywords.
@@ -433,6 +441,7 @@ class Datamodel:
 
         We read the table of keywords, organize it by metadata field, and count
         how many edition/project record use that keyword.
+        The counts come from `Datamodel.keywordCounts()`.
 
         Parameters
         ----------
@@ -442,6 +451,9 @@ class Datamodel:
             the respective keyword lists.
             These are typically from existing values in metadata fields that
             have been accepted when different keyword lists were in effect.
+        fresh: boolean, optional False
+            Whether to bypass the cache of keyword counts.
+            Use this when a decision depends on the counts.
 
         Returns
         -------
@@ -453,7 +465,6 @@ class Datamodel:
         Settings = self.Settings
         datamodel = Settings.datamodel
         fieldsConfig = datamodel.fields
-        fieldPaths = self.fieldPaths
 
         keywordLists = {
             field for (field, cfg) in fieldsConfig.items() if cfg.tp == "keyword"
@@ -464,7 +475,8 @@ class Datamodel:
         for name in keywordLists:
             keywords[name] = {}
 
-        keywordItems = Mongo.getList("keyword", {})
+        counts = self.keywordCounts(fresh=fresh)
+        keywordItems = Mongo.getList("keyword", {}, projection=["name", "value"])
 
         for keywordRecord in keywordItems:
             name = keywordRecord.name
@@ -476,27 +488,93 @@ class Datamodel:
                 # or the keywords come from a different instance
                 keywords[name] = {}
 
-            fieldPath = fieldPaths[name]
             value = keywordRecord.value
-            criteria = {fieldPath: value}
-            recordsP = Mongo.getList("project", criteria)
-            recordsE = Mongo.getList("edition", criteria)
-            occs = len(recordsP) + len(recordsE)
-            keywords[name][value] = occs
+            keywords[name][value] = counts.get(name, {}).get(value, 0)
 
         if extra is not None:
             for name, values in extra.items():
-                fieldPath = fieldPaths[name]
-
                 for value in values:
-                    criteria = {fieldPath: value}
-                    recordsP = Mongo.getList("project", criteria)
-                    recordsE = Mongo.getList("edition", criteria)
-                    occs = len(recordsP) + len(recordsE)
-                    keywords[name][value] = occs
+                    keywords[name][value] = counts.get(name, {}).get(value, 0)
 
         return keywords
 
+    def keywordCounts(self, fresh=False):
+        """Count the occurrences of the values of the keyword fields.
+
+        The counts are computed by a single aggregation over the project and
+        edition records that are not marked as deleted.
+        For each keyword field there is a facet that unwinds the values of that
+        field (see `Datamodel.fieldPaths`) and groups them.
+        A record in which a value occurs more than once counts once.
+
+        The result is cached. The cache is cleared by
+        `Datamodel.clearKeywordCache()`, and it expires after the number of seconds
+        in the setting `cacheTtl.keywords`.
+        The expiry is needed because the other workers of the app do not
+        clear their caches when keywords or values are saved in this one.
+
+        Parameters
+        ----------
+        fresh: boolean, optional False
+            Whether to bypass the cache.
+
+        Returns
+        -------
+        dict
+            keyed by name of the metadata field, then by the values that occur
+            in that field, and valued by the number of edition/project records
+            they occur in.
+        """
+        Mongo = self.Mongo
+        Settings = self.Settings
+        ttl = (Settings.cacheTtl or AttrDict()).keywords or 0
+        fieldsConfig = self.fieldsConfig
+        fieldPaths = self.fieldPaths
+        keywordCache = self.keywordCache
+
+        if (
+            not fresh
+            and keywordCache is not None
+            and monotonic() - keywordCache.time < ttl
+        ):
+            return keywordCache.counts
+
+        facets = {
+            name: [
+                {"$project": {"v": f"${fieldPaths[name]}"}},
+                {"$unwind": "$v"},
+                {"$group": {"_id": "$v", "ids": {"$addToSet": "$_id"}}},
+                {"$project": {"n": {"$size": "$ids"}}},
+            ]
+            for (name, cfg) in fieldsConfig.items()
+            if cfg.tp == "keyword"
+        }
+        pipeline = [
+            {"$match": {MDEL: None}},
+            {"$unionWith": {"coll": "edition", "pipeline": [{"$match": {MDEL: None}}]}},
+            {"$facet": facets},
+        ]
+
+        (good, result) = Mongo.executeMongo(
+            "project", "aggregate", pipeline, fetch=True
+        )
+        counts = {}
+
+        if good and result:
+            for name, groups in result[0].items():
+                counts[name] = {g._id: g.n for g in groups}
+
+        self.keywordCache = AttrDict(time=monotonic(), counts=counts)
+        return counts
+
+    def clearKeywordCache(self):
+        """Clears the cache of keyword counts.
+
+        Call this after saving or deleting keywords and after saving values
+        of metadata fields.
+        """
+        self.keywordCache = None
+
     def makeField(self, key, table):
         """Make a field object and registers it.
 
@@ -0,0 +1,558 @@
+"""Reading and writing database records from and to `.bson` files.
+
+This module is used by the web app, see `control.mongo.Mongo.mkBackup()` and
+`control.mongo.Mongo.restoreBackup()`, and by the stand-alone script `migrate.py`.
+That script runs in a container with just `pymongo` and `pyyaml`,
+so this module should not import anything that depends on flask.
+
+The files are read record by record, and records are inserted in batches,
+so that the memory needed does not grow with the size of the files.
+
+Tables are exported in parallel, each table in its own thread with its own cursor,
+to a gzip-compressed file `table.bson.gz`.
+Next to the table files we write a manifest `manifest.json`, with for each table
+the name of the file, the number of records and the sha256 checksum of the
+uncompressed bson data.
+
+Uncompressed `table.bson` files, as written by earlier versions, can still be read.
+
+Exports can be incremental: tables that did not change since the previous export
+to the same directory are left as they are, see `exportTables()`.
+"""
+
+import os
+import json
+import gzip
+from hashlib import sha256
+from itertools import chain, islice
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import BSON, decode_file_iter
+from bson.json_util import dumps as dumpjs
+
+
+BATCH_SIZE = 1000
+"""The default number of records that are inserted in one go."""
+
+CURSOR_BATCH_SIZE = 2000
+"""The number of records that an export cursor fetches per round trip."""
+
+WORKERS = 4
+"""The default number of tables that are exported in parallel."""
+
+MANIFEST = "manifest.json"
+"""The name of the manifest file in an export directory."""
+
+EXT = ".bson"
+EXT_GZ = ".bson.gz"
+CHUNK = 1 << 20
+
+
+def openTable(path, mode="rb", compressed=None):
+    """Opens a table file, compressed or not, depending on its extension.
+
+    Parameters
+    ----------
+    path: string
+        The path to the file, ending in `.bson` or `.bson.gz`.
+    mode: string, optional "rb"
+        The mode, "rb" or "wb".
+    compressed: boolean, optional None
+        Whether the file is compressed. If None, the extension of the path decides.
+
+    Returns
+    -------
+    object
+        A binary file handle.
+    """
+    if compressed is None:
+        compressed = path.endswith(EXT_GZ)
+
+    return gzip.open(path, mode, compresslevel=6) if compressed else open(path, mode)
+
+
+def tableFiles(src):
+    """Finds the table files in a directory.
+
+    Parameters
+    ----------
+    src: string
+        The directory.
+
+    Returns
+    -------
+    dict
+        Keyed by table name, valued by the name of its file.
+        If there is both a compressed and an uncompressed file for a table,
+        the compressed one is taken.
+        If the directory does not exist, the dict is empty.
+    """
+    files = {}
+
+    if not os.path.isdir(src):
+        return files
+
+    with os.scandir(src) as dh:
+        for entry in dh:
+            name = entry.name
+
+            if not entry.is_file():
+                continue
+
+            if name.endswith(EXT_GZ):
+                files[name.removesuffix(EXT_GZ)] = name
+            elif name.endswith(EXT):
+                files.setdefault(name.removesuffix(EXT), name)
+
+    return files
+
+
+def readManifest(src):
+    """Reads the manifest of an export directory.
+
+    Parameters
+    ----------
+    src: string
+        The directory.
+
+    Returns
+    -------
+    dict | void
+        The contents of the manifest, keyed by table name;
+        None if there is no manifest.
+    """
+    path = f"{src}/{MANIFEST}"
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def writeManifest(dst, manifest):
+    """Writes the manifest of an export directory.
+
+    Parameters
+    ----------
+    dst: string
+        The directory.
+    manifest: dict
+        Keyed by table name, valued by dicts with keys `file`, `records`, `sha256`.
+    """
+    with open(f"{dst}/{MANIFEST}", "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+
+def checkTable(src, table, info):
+    """Checks a table file against its entry in the manifest.
+
+    Parameters
+    ----------
+    src: string
+        The directory of the table file.
+    table: string
+        The name of the table.
+    info: dict
+        The manifest entry of the table.
+
+    Returns
+    -------
+    string | void
+        A description of what is wrong, or None if the file is OK.
+    """
+    path = f"{src}/{info['file']}"
+
+    if not os.path.isfile(path):
+        return f"{table}: file {info['file']} is missing"
+
+    h = sha256()
+
+    try:
+        with openTable(path) as fh:
+            while chunk := fh.read(CHUNK):
+                h.update(chunk)
+    except (OSError, EOFError) as e:
+        return f"{table}: file {info['file']} cannot be read: {e}"
+
+    if h.hexdigest() != info["sha256"]:
+        return f"{table}: checksum mismatch"
+
+    return None
+
+
+def checkTables(src):
+    """Checks all table files of an export directory against its manifest.
+
+    Parameters
+    ----------
+    src: string
+        The directory.
+
+    Returns
+    -------
+    list of string
+        Descriptions of the problems found.
+        If there is no manifest, nothing can be checked and the list is empty.
+    """
+    manifest = readManifest(src)
+
+    if manifest is None:
+        return []
+
+    return [
+        problem
+        for (table, info) in sorted(manifest.items())
+        if (problem := checkTable(src, table, info)) is not None
+    ]
+
+
+def readRecords(path, keep=None):
+    """Reads the records of a `.bson` file one by one.
+
+    Parameters
+    ----------
+    path: string
+        The path to the file.
+    keep: function, optional None
+        If given, a function that takes a record and returns whether it
+        should be delivered. Records for which it returns a falsy value are
+        skipped while reading.
+
+    Returns
+    -------
+    generator
+        The records, as dicts.
+    """
+    with openTable(path) as fh:
+        for record in decode_file_iter(fh):
+            if keep is None or keep(record):
+                yield record
+
+
+def peekRecords(records):
+    """Looks whether an iterable of records is empty, without consuming it.
+
+    Parameters
+    ----------
+    records: iterable
+        The records.
+
+    Returns
+    -------
+    iterator | void
+        If there are no records: None.
+        Otherwise an iterator that delivers all the records, including the first one.
+    """
+    records = iter(records)
+    first = next(records, None)
+
+    return None if first is None else chain([first], records)
+
+
+def insertBatched(collection, records, batchSize=BATCH_SIZE):
+    """Inserts records into a MongoDb collection in batches.
+
+    Parameters
+    ----------
+    collection: object
+        A pymongo collection handle.
+    records: iterable
+        The records to insert. It may be a generator; it is consumed
+        batch by batch.
+    batchSize: integer, optional `BATCH_SIZE`
+        The maximum number of records per `insert_many`.
+
+    Returns
+    -------
+    integer
+        The number of records inserted.
+    """
+    records = iter(records)
+    n = 0
+
+    while True:
+        batch = list(islice(records, batchSize))
+
+        if not batch:
+            break
+
+        collection.insert_many(batch)
+        n += len(batch)
+
+    return n
+
+
+def writeRecords(path, records, jsonPath=None, jOpts={}):
+    """Writes records to a bson file and possibly to a json file.
+
+    The files are written under a temporary name in the same directory, and are
+    moved into place only when all records have been written.
+    So if something goes wrong, existing destination files are left untouched
+    and no truncated files are left behind.
+
+    Parameters
+    ----------
+    path: string
+        The path of the bson file. If it ends with `.gz`, it will be compressed.
+    records: iterable
+        The records as they are retrieved from MongoDb.
+    jsonPath: string, optional None
+        The path of the json file.
+        If `None`, no json file will be written.
+    jOpts: dict, optional {}
+        Format options for writing the json file.
+
+    Returns
+    -------
+    integer, string
+        The number of records written and the sha256 checksum of the
+        (uncompressed) bson data.
+    """
+    asJson = jsonPath is not None
+    suffix = f".{os.getpid()}.tmp"
+    tmpPath = f"{path}{suffix}"
+    tmpJsonPath = f"{jsonPath}{suffix}" if asJson else None
+    h = sha256()
+    n = 0
+
+    try:
+        with (
+            openTable(tmpPath, "wb", compressed=path.endswith(EXT_GZ)) as bh,
+            open(tmpJsonPath, "w", encoding="utf8") if asJson else nullcontext() as jh,
+        ):
+            if asJson:
+                jh.write("[\n")
+
+            sep = ""
+            for record in records:
+                data = BSON.encode(record)
+                bh.write(data)
+                h.update(data)
+                n += 1
+                if asJson:
+                    jh.write(sep)
+                    jh.write(dumpjs(record, **jOpts))
+                sep = ",\n"
+
+            if asJson:
+                jh.write("\n]\n")
+
+        os.replace(tmpPath, path)
+
+        if asJson:
+            os.replace(tmpJsonPath, jsonPath)
+
+    except BaseException:
+        for tmp in (tmpPath, tmpJsonPath):
+            if tmp is not None and os.path.isfile(tmp):
+                os.unlink(tmp)
+        raise
+
+    return (n, h.hexdigest())
+
+
+def fingerprints(db, tables):
+    """Computes fingerprints of tables, by which we can see whether they changed.
+
+    We use the MongoDb command `dbHash`, which gives an md5 digest of the contents
+    of each collection. Together with the number of records, that is the
+    fingerprint.
+
+    Parameters
+    ----------
+    db: object
+        A pymongo database handle.
+    tables: iterable
+        The tables to compute the fingerprints for.
+
+    Returns
+    -------
+    dict
+        Keyed by table, valued by the fingerprint.
+        If the database user is not allowed to run `dbHash`, the dict is empty.
+    """
+    tables = list(tables)
+
+    try:
+        hashes = db.command("dbHash", collections=tables)["collections"]
+    except Exception:
+        return {}
+
+    return {
+        table: f"{db[table].estimated_document_count()}:{hashes[table]}"
+        for table in tables
+        if table in hashes
+    }
+
+
+def hashRecords(records):
+    """Computes the number of records and the checksum of their bson data.
+
+    This is what `writeRecords()` computes, but without writing anything.
+
+    Parameters
+    ----------
+    records: iterable
+        The records as they are retrieved from MongoDb.
+
+    Returns
+    -------
+    integer, string
+        The number of records and the sha256 checksum.
+    """
+    h = sha256()
+    n = 0
+
+    for record in records:
+        h.update(BSON.encode(record))
+        n += 1
+
+    return (n, h.hexdigest())
+
+
+def exportTables(
+    db,
+    dst,
+    tables=None,
+    compress=True,
+    workers=WORKERS,
+    jsonDst=None,
+    jOpts={},
+    report=None,
+    incremental=False,
+):
+    """Exports tables of a database in parallel, and writes a manifest.
+
+    Each table is exported in its own thread, with its own cursor.
+
+    In incremental mode, tables that have not changed since the previous export
+    to the same directory are not written again.
+    Whether a table has changed is determined by comparing its fingerprint
+    (see `fingerprints()`) with the one in the manifest.
+    If there are no fingerprints, we compare the checksum of the records
+    with the one in the manifest (see `hashRecords()`): that costs a read of the
+    table, but no writes.
+    Either way, the file of the table is checked against its checksum in the
+    manifest (see `checkTable()`), so that a damaged file is always written again.
+    Files of tables that no longer exist in the database are removed.
+
+    Parameters
+    ----------
+    db: object
+        A pymongo database handle.
+    dst: string
+        The directory to export to. It must exist.
+    tables: iterable, optional None
+        The tables to export. If None, all tables of the database are exported.
+    compress: boolean, optional True
+        Whether to write gzip-compressed files.
+    workers: integer, optional `WORKERS`
+        The maximum number of tables that are exported at the same time.
+    jsonDst: string, optional None
+        If given, a directory where also json files of the tables will be written.
+    jOpts: dict, optional {}
+        Format options for writing the json files.
+    report: function, optional None
+        If given, it will be called after each table with the name of the table,
+        its number of records (or the exception that occurred),
+        and whether the table has been skipped because it did not change.
+    incremental: boolean, optional False
+        Whether to skip tables that did not change.
+
+    Returns
+    -------
+    dict
+        The manifest entries of the tables that have been exported successfully.
+        They are also written to the manifest file, merged with the entries of
+        the tables in the manifest that are not exported now.
+        Tables whose export failed are removed from the manifest.
+    """
+    allTables = tables is None
+
+    if allTables:
+        tables = db.list_collection_names()
+
+    ext = EXT_GZ if compress else EXT
+    manifest = readManifest(dst) or {}
+    prints = fingerprints(db, tables) if incremental else {}
+
+    def unchanged(table, fileName):
+        info = manifest.get(table, None)
+
+        if info is None or info["file"] != fileName:
+            return False
+        if checkTable(dst, table, info) is not None:
+            return False
+        if jsonDst is not None and not os.path.isfile(f"{jsonDst}/{table}.json"):
+            return False
+
+        fingerprint = prints.get(table, None)
+
+        if fingerprint is not None:
+            return info.get("fingerprint", None) == fingerprint
+
+        records = db[table].find({}, batch_size=CURSOR_BATCH_SIZE)
+        return hashRecords(records) == (info["records"], info["sha256"])
+
+    def export(table):
+        fileName = f"{table}{ext}"
+
+        if incremental and unchanged(table, fileName):
+            return (manifest[table] | dict(fingerprint=prints.get(table, None)), True)
+
+        records = db[table].find({}, batch_size=CURSOR_BATCH_SIZE)
+        jsonPath = None if jsonDst is None else f"{jsonDst}/{table}.json"
+        (n, checksum) = writeRecords(
+            f"{dst}/{fileName}", records, jsonPath=jsonPath, jOpts=jOpts
+        )
+        info = dict(
+            file=fileName, records=n, sha256=checksum, fingerprint=prints.get(table)
+        )
+        return (info, False)
+
+    entries = {}
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {table: executor.submit(export, table) for table in tables}
+
+        for table, future in futures.items():
+            try:
+                (entries[table], skipped) = future.result()
+
+                if report is not None:
+                    report(table, entries[table]["records"], skipped)
+            except Exception as e:
+                failed.append(table)
+
+                if report is not None:
+                    report(table, e, False)
+
+    for table, info in entries.items():
+        otherExt = EXT if compress else EXT_GZ
+        otherFile = f"{dst}/{table}{otherExt}"
+
+        if os.path.isfile(otherFile):
+            os.unlink(otherFile)
+
+    if allTables:
+        for table in set(manifest) - set(tables):
+            path = f"{dst}/{manifest[table]['file']}"
+
+            if os.path.isfile(path):
+                os.unlink(path)
+
+            del manifest[table]
+
+    # the previous file of a failed table is still intact, but it is not
+    # what we have been asked to export, so we do not vouch for it anymore
+
+    for table in failed:
+        manifest.pop(table, None)
+
+    manifest.update(entries)
+    writeManifest(dst, manifest)
+
+    return entries
@@ -523,6 +523,7 @@ def readPath(filePath):
     !!! note "Not for binary files"
         The file will not be opened in binary mode.
         Use this only for files with textual content.
+        The file is read as UTF-8, whatever the locale of the system.
 
     Parameters
     ----------
@@ -537,7 +538,7 @@ def readPath(filePath):
     """
 
     if os.path.isfile(filePath):
-        with open(filePath) as fh:
+        with open(filePath, encoding="utf8") as fh:
             text = fh.read()
         return text
     return ""
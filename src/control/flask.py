@@ -12,6 +12,7 @@ from flask import (
     stream_with_context,
     flash,
     g,
+    has_app_context,
 )
 
 from .environment import var
@@ -37,6 +38,15 @@ def appInitializing():
     return var("WERKZEUG_RUN_MAIN") is None and not current_app
 
 
+def hasAcg():
+    """Whether there is an application context, so that `acg` can be used.
+
+    Outside of requests, e.g. in the sweeper or in command line scripts,
+    there is no application context, and `acg` cannot be used.
+    """
+    return has_app_context()
+
+
 def runInfo():
     """For things that should run once.
 
@@ -1,6 +1,7 @@
 import os
 import re
-from datetime import datetime as dt, UTC
+from collections import ChainMap
+from datetime import datetime as dt, timedelta, UTC
 from functools import cmp_to_key as keyFromComparison
 
 from bson.objectid import ObjectId
@@ -64,6 +65,26 @@ def isonow():
     return TZ_RE.sub("Z", utcnow().isoformat(timespec="seconds", sep="T"))
 
 
+def isoago(days):
+    """A moment in the past as an ISO 8601 string value.
+
+    The format is the same as in `isonow()`, so the results can be compared
+    as strings with the results of `isonow()`.
+
+    Parameters
+    ----------
+    days: float
+        How many days ago.
+
+    Returns
+    -------
+    string
+    """
+    return TZ_RE.sub(
+        "Z", (utcnow() - timedelta(days=days)).isoformat(timespec="seconds", sep="T")
+    )
+
+
 def pseudoisonow():
     """The current moment in time as a isolike string value.
 
@@ -234,6 +255,30 @@ class AttrDict(dict):
         return deepdict(self)
 
 
+class AttrChainMap(ChainMap):
+    """A `ChainMap` whose members can be read as attributes, like `AttrDict`.
+
+    We use it to layer a few specific values on top of a dict that is shared with
+    other `AttrChainMap` objects, without copying that dict.
+
+    Non-existing members read as `None`.
+    Write to the first map, not to the attributes.
+    """
+
+    def __missing__(self, key):
+        return None
+
+    def __getattr__(self, key):
+        # `maps` is looked up here only if it is not yet set, e.g. when unpickling
+        if key == "maps":
+            raise AttributeError(key)
+
+        return self[key]
+
+    def deepdict(self):
+        return deepdict(self)
+
+
 def deepdict(info):
     """Turns an `AttrDict` into a `dict`, recursively.
 
@@ -262,7 +307,7 @@ def deepdict(info):
 
     return (
         dict({k: deepdict(v) for (k, v) in info.items()})
-        if tp in {dict, AttrDict}
+        if tp in {dict, AttrDict, AttrChainMap}
         else (
             tuple(deepdict(item) for item in info)
             if tp is tuple
@@ -0,0 +1,148 @@
+import os
+from hashlib import sha256
+from time import perf_counter
+
+import pybars
+from pybars import Compiler
+
+from .files import dirMake, fileExists, readPath
+from .generic import AttrDict
+
+
+TIME_HEADER = "# compile time: "
+
+
+class Handlebars(Compiler):
+    def __init__(self, cacheDir=None):
+        """A pybars compiler that caches the compiled templates.
+
+        Pybars compiles a template to Python code, and then executes that code
+        to get the render function of the template.
+        Generating the code is by far the most expensive step.
+        We store the code in a file, named after the hash of the pybars version and
+        the template source, so that later compilations of the same source,
+        also in other processes, only need to execute the code.
+
+        Compiled templates are also kept in memory, so that a process that compiles
+        the same source again gets it straight away.
+
+        Parameters
+        ----------
+        cacheDir: string, optional None
+            The directory of the cache. If None, nothing is cached, and this
+            compiler behaves exactly as `pybars.Compiler`.
+        """
+        super().__init__()
+        self.cacheDir = cacheDir
+        self.compiled = {}
+        self.takeStats()
+
+        if cacheDir is not None:
+            dirMake(cacheDir)
+
+    def takeStats(self):
+        """Delivers the statistics of the cache and starts a new count.
+
+        Returns
+        -------
+        AttrDict
+            Since the previous call: how many templates came from the cache,
+            how many were compiled, and how many seconds of compiling have been
+            saved by the cache.
+        """
+        stats = getattr(self, "stats", None)
+        self.stats = AttrDict(cached=0, compiled=0, saved=0.0)
+        return stats
+
+    def compile(self, source, path=None):
+        """Compiles a template, via the cache.
+
+        Parameters
+        ----------
+        source: string
+            The source of the template.
+        path: string, optional None
+            Passed to `pybars.Compiler.compile()` if there is no cache.
+
+        Returns
+        -------
+        function
+            The render function of the template.
+        """
+        cacheDir = self.cacheDir
+
+        if cacheDir is None:
+            return super().compile(source, path=path)
+
+        compiled = self.compiled
+        stats = self.stats
+
+        key = sha256(f"{pybars.__version__}\n{source}".encode("utf8")).hexdigest()
+
+        if key in compiled:
+            (template, compileTime) = compiled[key]
+            stats.cached += 1
+            stats.saved += compileTime
+            return template
+
+        cacheFile = f"{cacheDir}/{key}.py"
+
+        if fileExists(cacheFile):
+            start = perf_counter()
+            code = readPath(cacheFile)
+            readTime = perf_counter() - start
+
+            try:
+                compileTime = float(code.split("\n", 1)[0].removeprefix(TIME_HEADER))
+                template = self.load(code, cacheFile)
+            except Exception:
+                template = None
+
+            if template is not None:
+                compiled[key] = (template, compileTime)
+                stats.cached += 1
+                stats.saved += compileTime - readTime
+                return template
+
+        start = perf_counter()
+        code = self.precompile(source)
+        compileTime = perf_counter() - start
+        code = f"{TIME_HEADER}{compileTime:.6f}\n{code}"
+
+        # other processes may compile the same template at the same time,
+        # so we write to a temporary file and move it into place
+
+        tmpFile = f"{cacheFile}.{os.getpid()}"
+
+        try:
+            with open(tmpFile, "w", encoding="utf8") as fh:
+                fh.write(code)
+
+            os.replace(tmpFile, cacheFile)
+        except OSError:
+            pass
+
+        template = self.load(code, cacheFile)
+        compiled[key] = (template, compileTime)
+        stats.compiled += 1
+        return template
+
+    @staticmethod
+    def load(code, fileName):
+        """Turns compiled code into a render function.
+
+        Parameters
+        ----------
+        code: string
+            The Python code as generated by `pybars.Compiler.precompile()`.
+        fileName: string
+            The file name under which the code is known in tracebacks.
+
+        Returns
+        -------
+        function
+            The render function of the template.
+        """
+        namespace = {}
+        exec(compile(code, fileName, "exec", dont_inherit=True), namespace)
+        return namespace["render"]
@@ -1,11 +1,26 @@
 import os
+from threading import Lock
+from time import monotonic, perf_counter
 
-from bson import ObjectId, BSON, decode_all
-from bson.json_util import dumps as dumpjs
-from pymongo import MongoClient
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from pymongo import MongoClient, ReturnDocument
 
-from .generic import AttrDict, deepAttrDict, isonow
+from .flask import acg, hasAcg
+from .generic import AttrDict, isonow
 from .files import dirMake, dirExists
+from .dbfiles import (
+    BATCH_SIZE,
+    EXT_GZ,
+    readRecords,
+    peekRecords,
+    insertBatched,
+    writeRecords,
+    exportTables,
+    writeManifest,
+    checkTables,
+    tableFiles,
+)
 
 MDEL = "markedDeleted"
 MDELDT = "dateDeleted"
@@ -13,6 +28,44 @@ MDELBY = "deletedBy"
 MRESDT = "dateUndeleted"
 MRESBY = "undeletedBy"
 
+CODEC_OPTIONS = CodecOptions(document_class=AttrDict)
+"""Decode MongoDb documents straight into `control.generic.AttrDict` objects.
+
+This holds for embedded documents as well, so records that come from the database
+need not be converted by `control.generic.deepAttrDict` anymore.
+"""
+
+
+def planIndexes(plan):
+    """Collect the names of the indexes used in a query plan.
+
+    Parameters
+    ----------
+    plan: dict
+        A (winning) query plan as delivered by the `explain()` of a MongoDb cursor.
+
+    Returns
+    -------
+    set
+        The names of the indexes that occur in the plan stages.
+    """
+    names = set()
+
+    if type(plan) is dict:
+        indexName = plan.get("indexName", None)
+
+        if indexName is not None:
+            names.add(indexName)
+
+        for v in plan.values():
+            names |= planIndexes(v)
+
+    elif type(plan) is list:
+        for v in plan:
+            names |= planIndexes(v)
+
+    return names
+
 
 class Mongo:
     @staticmethod
@@ -113,6 +166,37 @@ class Mongo:
 
             `{markedDeleted: {$exists: false}}`
 
+        !!! note "Identity map"
+            During a request, records that are fetched by their id are remembered
+            in an identity map on `flask.g`, keyed by table, id and whether we
+            searched among the deleted records.
+            When the same record is asked for again during the same request,
+            it is delivered from the map, without a round trip to MongoDb.
+            Every write to a table forgets the records of that table.
+            Each delivery is a shallow copy of the record in the map.
+            See `Mongo.identityMap()` and `Mongo.getRecord()`.
+
+        !!! note "Version of users and roles"
+            Users, their site-wide roles, and their roles with respect to projects
+            and editions are cached by the worker processes of the app.
+            In order to let a change take effect immediately in all workers,
+            there is a version counter in the database, which is increased by every
+            write that affects users or their roles.
+            Cached data is stamped with the version, and is only used as long as the
+            version has not changed.
+            Authorisation decisions also depend on the states of records, such as
+            publication; those have a version counter of their own, so that
+            publishing does not invalidate the caches of users and roles.
+            See `Mongo.versions()`.
+
+        !!! note "Instrumentation"
+            All database commands go through `Mongo.executeMongo()`,
+            which times them and passes the timing to the instruments,
+            see `Mongo.addInstrument()`.
+            There are two instruments by default: one that collects statistics
+            per request (see `Mongo.requestSummary()`) and one that logs
+            slow commands (see `Mongo.slowCommands()`).
+
         Parameters
         ----------
         Settings: AttrDict
@@ -127,7 +211,31 @@ class Mongo:
         Messages.debugAdd(self)
         self.client = None
         self.db = None
+        self.pid = None
+        self.connectLock = Lock()
         self.database = f"{Settings.database}_{runMode}"
+        self.indexesEnsured = False
+
+        userCoupled = (Settings.auth or AttrDict()).userCoupled or []
+        self.roleTables = frozenset(("user", *(f"{t}User" for t in userCoupled)))
+        """Tables whose every write changes users or their roles."""
+
+        self.roleMasters = frozenset(userCoupled)
+        """Tables whose records users may have roles on.
+
+        Creating, deleting and undeleting records in these tables changes the roles.
+        """
+
+        self.versionMemo = None
+        """The version counters as read outside requests, with their expiry time."""
+
+        dbInstrument = Settings.dbInstrument or AttrDict()
+        self.slowCommand = dbInstrument.slowCommand
+        self.instruments = []
+        self.addInstrument(self.requestStats)
+
+        if self.slowCommand is not None:
+            self.addInstrument(self.slowCommands)
 
     def connect(self):
         """Make connection with MongoDb if there is no connection yet.
@@ -137,23 +245,48 @@ class Mongo:
         After a successful connection attempt, the connection handle
         is stored in the `client` and `db` members of the Mongo object.
 
+        The database handle decodes documents as `AttrDict`, see `CODEC_OPTIONS`.
+
+        The first time a connection is made, the indexes are checked,
+        see `Mongo.ensureIndexes()`.
+
         When a connection handle exists, this method does nothing.
+
+        !!! note "Processes and threads"
+            A `MongoClient` must not be used across a fork.
+            When the server forks worker processes after the connection has been
+            made, e.g. gunicorn with `preload_app`, each worker sees that the
+            connection was made by another process, and makes its own.
+            The handle of the parent is dropped without closing it, because closing
+            it would affect the sockets of the parent.
+
+            Within a process, the client is shared by all threads (or greenlets),
+            and a lock makes sure that only one of them creates it.
         """
         Messages = self.Messages
         Settings = self.Settings
-        client = self.client
-        db = self.db
         database = self.database
+        pid = os.getpid()
+
+        if self.db is not None and self.pid == pid:
+            return
+
+        with self.connectLock:
+            if self.db is not None and self.pid == pid:
+                return
+
+            client = None
+            db = None
 
-        if db is None:
             try:
                 client = MongoClient(
                     Settings.mongoHost,
                     Settings.mongoPort,
                     username=Settings.mongoUser,
                     password=Settings.mongoPassword,
+                    connect=False,
                 )
-                db = client[database]
+                db = client.get_database(database, codec_options=CODEC_OPTIONS)
             except Exception as e:
                 Messages.error(
                     msg="Could not connect to the database",
@@ -161,16 +294,22 @@ class Mongo:
                 )
             self.client = client
             self.db = db
+            self.pid = pid
+
+        if db is not None and not self.indexesEnsured:
+            self.indexesEnsured = True
+            self.ensureIndexes()
 
     def disconnect(self):
         """Disconnect from the MongoDB."""
         client = self.client
 
-        if client:
+        if client and self.pid == os.getpid():
             client.close()
 
         self.client = None
         self.db = None
+        self.pid = None
 
     def tables(self):
         """List the existent tables in the database.
@@ -185,6 +324,454 @@ class Mongo:
 
         return list(db.list_collection_names())
 
+    def ensureIndexes(self):
+        """Create the indexes that are declared in `yaml/indexes.yml`.
+
+        Indexes that already exist are left alone by MongoDb.
+        If an index exists under the same name but with a different specification,
+        MongoDb refuses to create it; we issue a warning and go on.
+
+        This happens on the first connection in every process, so we do nothing
+        more expensive than that.
+        Only if the setting `dbInstrument.indexReport` is true, we log the index
+        report afterwards, see `Mongo.indexReport()`.
+
+        Returns
+        -------
+        boolean
+            Whether all indexes could be created.
+        """
+        Messages = self.Messages
+        Settings = self.Settings
+        indexes = Settings.indexes or {}
+
+        good = True
+        n = 0
+
+        for table, specs in indexes.items():
+            for spec in specs:
+                name = spec.name
+                keys = list(spec["keys"].items())
+                options = dict(name=name)
+                partial = spec.partial
+
+                if partial is not None:
+                    options["partialFilterExpression"] = partial.deepdict()
+
+                (thisGood, result) = self.executeMongo(
+                    table, "create_index", keys, warn=False, **options
+                )
+
+                if thisGood:
+                    n += 1
+                else:
+                    good = False
+                    Messages.warning(
+                        logmsg=f"Could not create index {name} on table {table}"
+                    )
+
+        plural = "" if n == 1 else "es"
+        self.debug(logmsg=f"Ensured {n} index{plural}")
+
+        if (Settings.dbInstrument or AttrDict()).indexReport:
+            for line in self.indexReport():
+                Messages.info(logmsg=line)
+
+        return good
+
+    def indexReport(self):
+        """Reports how the indexes in `yaml/indexes.yml` are being used.
+
+        For each declared index we report how many operations have used it
+        since the start of the MongoDb server (by means of `$indexStats`).
+
+        For each of the typical queries that are declared with the index,
+        we ask MongoDb which index it would choose (by means of `explain()`).
+        If no index would be chosen, we report `COLLSCAN`.
+
+        Returns
+        -------
+        list of string
+            The lines of the report.
+        """
+        Settings = self.Settings
+        indexes = Settings.indexes or {}
+
+        lines = []
+
+        for table, specs in indexes.items():
+            (good, stats) = self.executeMongo(
+                table, "aggregate", [{"$indexStats": {}}], warn=False
+            )
+            usage = (
+                {s["name"]: s["accesses"]["ops"] for s in stats} if good else {}
+            )
+
+            for spec in specs:
+                name = spec.name
+                lines.append(f"index {table}.{name}: used {usage.get(name, 0)} x")
+
+                for criteria in spec.queries or []:
+                    criteria = criteria.deepdict()
+                    (good, cursor) = self.executeMongo(
+                        table, "find", criteria, warn=False
+                    )
+                    used = set()
+
+                    if good:
+                        try:
+                            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+                            used = planIndexes(plan)
+                        except Exception:
+                            pass
+
+                    usedRep = ", ".join(sorted(used)) or "COLLSCAN"
+                    lines.append(f"\tquery {criteria} => {usedRep}")
+
+        return lines
+
+    def identityMap(self):
+        """Get the identity map of the current request.
+
+        The map is created on `flask.g` the first time it is needed in a request.
+        Outside of requests there is no identity map.
+
+        Returns
+        -------
+        AttrDict | void
+            With members
+
+            *   `records`: dict, keyed by `(table, _id, deleted)`, with the records
+                that have been fetched by id during this request.
+            *   `hits`: the number of times a record has been delivered from the map.
+            *   `misses`: the number of times a record had to be fetched from MongoDb.
+
+            If there is no request, `None` is returned.
+        """
+        if not hasAcg():
+            return None
+
+        idMap = acg.get("mongoIdMap", None)
+
+        if idMap is None:
+            idMap = AttrDict(records={}, hits=0, misses=0)
+            acg.mongoIdMap = idMap
+
+        return idMap
+
+    def forget(self, table, structural=False):
+        """Removes the records of a table from the identity map.
+
+        This is done after every write to a table.
+
+        If the write affects users or their roles, the version of those is
+        increased, see `Mongo.bumpAuthVersion()`.
+
+        Parameters
+        ----------
+        table: string
+            The table whose records must be forgotten.
+        structural: boolean, optional False
+            Whether records have been created or (un)deleted, as opposed to updated.
+        """
+        if table in self.roleTables or (structural and table in self.roleMasters):
+            self.bumpAuthVersion()
+
+        idMap = self.identityMap()
+
+        if idMap is None:
+            return
+
+        records = idMap.records
+
+        for key in [key for key in records if key[0] == table]:
+            del records[key]
+
+    def identityReport(self):
+        """Reports on the usage of the identity map in the current request.
+
+        The report is written to the log as a debug message,
+        but only if records have been fetched by id.
+        """
+        idMap = self.identityMap()
+
+        if idMap is None:
+            return
+
+        hits = idMap.hits
+        misses = idMap.misses
+
+        if hits or misses:
+            self.debug(
+                logmsg=(
+                    f"Identity map: {hits} round trips saved, {misses} records fetched"
+                )
+            )
+
+    def versionTable(self):
+        """The table that holds the version counters.
+
+        It lives in a database of its own, next to the main database, so that it
+        does not end up in backups.
+
+        Returns
+        -------
+        object
+            The pymongo collection of the version counters.
+        """
+        self.connect()
+        return self.client[f"{self.database}_cache"]["versions"]
+
+    def versions(self):
+        """The current version counters.
+
+        There are two counters, shared by all processes that use the database:
+
+        *   `auth`: the version of users and their roles;
+        *   `decisions`: the version of the states of records that authorisation
+            decisions depend on, such as publication and visibility.
+
+        They are read at most once per request and then remembered in the
+        application-context-global `versions`.
+        Outside requests, e.g. when the WebDAV dispatcher consults its cache,
+        they are remembered in the process for the number of seconds in the setting
+        `cacheTtl.versions`, so that a burst of WebDAV requests does not query the
+        database for each request.
+        So a change made by another process may go unnoticed there for that long.
+        Changes made by this process are noticed at once, see `Mongo.bumpVersion()`.
+
+        Returns
+        -------
+        AttrDict | void
+            The counters, keyed by name, or None if they could not be read.
+        """
+        inRequest = hasAcg()
+
+        if inRequest:
+            versions = acg.get("versions", None)
+
+            if versions is not None:
+                return versions
+        else:
+            memo = self.versionMemo
+
+            if memo is not None and monotonic() < memo[0]:
+                return memo[1]
+
+        try:
+            records = list(self.versionTable().find({}))
+        except Exception as e:
+            self.Messages.error(logmsg=f"Reading versions: {e}")
+            return None
+
+        versions = AttrDict(auth=0, decisions=0)
+
+        for record in records:
+            versions[record["_id"]] = record["version"]
+
+        if inRequest:
+            acg.versions = versions
+        else:
+            ttl = (self.Settings.cacheTtl or AttrDict()).versions or 0
+
+            if ttl:
+                self.versionMemo = (monotonic() + ttl, versions)
+
+        return versions
+
+    def bumpVersion(self, name):
+        """Increases a version counter.
+
+        All data that is cached with an older version will no longer be used,
+        in all processes, see `Mongo.versions()`.
+
+        Parameters
+        ----------
+        name: string
+            The name of the counter: `auth` or `decisions`.
+
+        Returns
+        -------
+        integer | void
+            The new version, or None if it could not be increased.
+        """
+        try:
+            record = self.versionTable().find_one_and_update(
+                {"_id": name},
+                {"$inc": {"version": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception as e:
+            self.Messages.error(logmsg=f"Increasing {name} version: {e}")
+            record = None
+
+        version = None if record is None else record["version"]
+        self.versionMemo = None
+
+        if hasAcg():
+            versions = acg.get("versions", None)
+
+            if version is None:
+                acg.versions = None
+            elif versions is not None:
+                versions[name] = version
+
+        return version
+
+    def authVersion(self):
+        """The current version of users and their roles.
+
+        See `Mongo.versions()`.
+
+        Returns
+        -------
+        integer | void
+            The version, or None if it could not be read.
+        """
+        versions = self.versions()
+        return None if versions is None else versions.auth
+
+    def decisionVersion(self):
+        """The current version of everything that authorisation decisions depend on.
+
+        That is: users, their roles, and the states of records,
+        see `Mongo.versions()`.
+
+        Returns
+        -------
+        tuple | void
+            The version of users and roles and the version of the states,
+            or None if they could not be read.
+        """
+        versions = self.versions()
+        return None if versions is None else (versions.auth, versions.decisions)
+
+    def bumpAuthVersion(self):
+        """Increases the version of users and their roles.
+
+        Returns
+        -------
+        integer | void
+            The new version, or None if it could not be increased.
+        """
+        return self.bumpVersion("auth")
+
+    def bumpDecisionVersion(self):
+        """Increases the version of the states that authorisation decisions use.
+
+        Users and roles are not affected, so their caches stay valid.
+
+        Returns
+        -------
+        integer | void
+            The new version, or None if it could not be increased.
+        """
+        return self.bumpVersion("decisions")
+
+    def addInstrument(self, instrument):
+        """Adds an instrument to the database commands.
+
+        After each command that is executed by `Mongo.executeMongo()`,
+        all instruments are called.
+
+        Parameters
+        ----------
+        instrument: function
+            It will be called with the arguments:
+
+            *   `table`: the table of the command;
+            *   `command`: the name of the command;
+            *   `args`: the positional arguments of the command,
+                typically the criteria come first;
+            *   `duration`: the time the command took, in seconds;
+            *   `good`: whether the command succeeded.
+        """
+        self.instruments.append(instrument)
+
+    def requestStats(self, table, command, args, duration, good):
+        """Instrument that collects the timings of the current request.
+
+        The statistics are stored on `flask.g`,
+        see `Mongo.requestSummary()`.
+        Outside of requests, it does nothing.
+
+        Parameters
+        ----------
+        See `Mongo.addInstrument()`.
+        """
+        if not hasAcg():
+            return
+
+        stats = acg.get("mongoStats", None)
+
+        if stats is None:
+            stats = AttrDict(n=0, duration=0, commands={})
+            acg.mongoStats = stats
+
+        stats.n += 1
+        stats.duration += duration
+        key = f"{table}.{command}"
+        stats.commands[key] = stats.commands.get(key, 0) + 1
+
+    def slowCommands(self, table, command, args, duration, good):
+        """Instrument that logs commands that are slower than a threshold.
+
+        The threshold is the setting `dbInstrument.slowCommand` in seconds,
+        see `yaml/settings.yml`.
+
+        Parameters
+        ----------
+        See `Mongo.addInstrument()`.
+        """
+        if duration < self.slowCommand:
+            return
+
+        argsRep = repr(args)
+
+        if len(argsRep) > 200:
+            argsRep = f"{argsRep[0:200]} ..."
+
+        self.Messages.warning(
+            logmsg=(
+                f"Slow db command {table}.{command} "
+                f"{duration * 1000:.1f} ms: {argsRep}"
+            )
+        )
+
+    def requestSummary(self):
+        """Summarizes the database commands of the current request.
+
+        The summary is written to the log.
+
+        Returns
+        -------
+        string | void
+            A value for the `Server-Timing` header of the response:
+            the total time spent on database commands, in milliseconds.
+            If no database commands have been executed, None is returned.
+        """
+        if not hasAcg():
+            return None
+
+        stats = acg.get("mongoStats", None)
+
+        if stats is None:
+            return None
+
+        n = stats.n
+        ms = stats.duration * 1000
+        frequent = ", ".join(
+            f"{key} {m}x"
+            for (key, m) in sorted(stats.commands.items(), key=lambda x: -x[1])[0:3]
+        )
+        plural = "" if n == 1 else "s"
+        self.Messages.info(
+            logmsg=f"DB: {n} command{plural} in {ms:.1f} ms; most: {frequent}"
+        )
+
+        return f'db;dur={ms:.1f};desc="{n} command{plural}"'
+
     def clearTable(self, table, delete=False):
         """Make sure that a table exists and that it is empty.
 
@@ -295,12 +882,35 @@ class Mongo:
             The single record found,
             or an empty AttrDict if no record
             satisfies the criteria.
+
+            If the record is looked up by id, it passes through the identity map,
+            see `Mongo.identityMap()`. Every call then gets its own shallow copy
+            of the record, so callers may set and delete its fields without
+            affecting later calls.
+            But the nested values (lists, dicts) are shared between those copies,
+            and must not be modified in place.
         """
         Messages = self.Messages
 
+        idMap = self.identityMap() if list(criteria) == ["_id"] else None
+        key = None
+
+        if idMap is not None:
+            key = (table, criteria["_id"], bool(deleted))
+            record = idMap.records.get(key, None)
+
+            if record is not None:
+                idMap.hits += 1
+                return AttrDict(record)
+
         criteria[MDEL] = {"$exists": True} if deleted else None
         (good, result) = self.executeMongo(table, "find_one", criteria, {}, warn=False)
 
+        if key is not None and good and result is not None:
+            idMap.misses += 1
+            idMap.records[key] = result
+            return AttrDict(result)
+
         if not good or result is None:
             if warn:
                 Messages.warning(
@@ -312,10 +922,20 @@ class Mongo:
                     Messages.warning(
                         logmsg=f"No record in {table} with {criteria}",
                     )
-            result = {}
-        return deepAttrDict(result)
-
-    def getList(self, table, criteria, deleted=False, sort=None, asDict=False):
+            result = AttrDict()
+        return result
+
+    def getList(
+        self,
+        table,
+        criteria,
+        deleted=False,
+        sort=None,
+        asDict=False,
+        projection=None,
+        limit=None,
+        skip=None,
+    ):
         """Get a list of records from a table.
 
         Parameters
@@ -326,37 +946,67 @@ class Mongo:
             A set of criteria to narrow down the search.
         deleted: boolean, optional False
             Search only in the records that are marked for deletion
-        sort: string | function, optional None
+        sort: string | list | function, optional None
             Sort key. If `None`, the results will not be sorted.
             If a string, it is the name of a field by which the results
             will be sorted in ascending order.
+            If a list, it is a list of tuples `(field, direction)`,
+            where direction is `1` (ascending) or `-1` (descending).
+            In both cases, MongoDb does the sorting.
             If a function, the function should take a record as input and return a
-            value. The records will be sorted by this value.
+            value. The records will be sorted by this value, after they have been
+            retrieved from MongoDb.
         asDict: boolean or string, optional False
             If False, returns a list of records as result. If True or a string, returns
             the same records, but now as dict, keyed by the `_id` field if
             asDict is True, else keyed by the field in dictated by asDict.
+        projection: list | dict, optional None
+            If given, only the fields mentioned in it will be retrieved
+            (the `_id` field is always retrieved, unless excluded explicitly).
+            If a list, it is a list of field names.
+            If a dict, it is a MongoDb projection, e.g. `{"dc": 0}` to retrieve
+            everything except the `dc` field.
+            Note that the field used for sorting or keying (`asDict`)
+            should be retrieved as well.
+        limit: integer, optional None
+            If given, at most this number of records will be retrieved.
+        skip: integer, optional None
+            If given, this number of records will be skipped.
+            Together with `limit` this can be used to retrieve records page by page.
+            Only meaningful if the records are sorted by MongoDb.
 
         Returns
         -------
         list of AttrDict
             The list of records found, empty if no records are found.
-            Each record is cast to an AttrDict.
+            Each record is an AttrDict, see `CODEC_OPTIONS`.
         """
         criteria[MDEL] = {"$exists": True} if deleted else None
 
-        (good, result) = self.executeMongo(table, "find", criteria, {})
+        sortFunc = None
+        options = {}
+
+        if type(sort) is str:
+            options["sort"] = [(sort, 1)]
+        elif type(sort) in {list, tuple}:
+            options["sort"] = list(sort)
+        elif sort is not None:
+            sortFunc = sort
+
+        if limit is not None:
+            options["limit"] = limit
+        if skip is not None:
+            options["skip"] = skip
+
+        (good, result) = self.executeMongo(
+            table, "find", criteria, projection or {}, fetch=True, **options
+        )
 
         if not good:
             return []
 
-        unsorted = [deepAttrDict(record) for record in result]
-
-        if sort is None:
-            result = unsorted
-        else:
-            sortFunc = (lambda r: r[sort] or "") if type(sort) is str else sort
-            result = sorted(unsorted, key=sortFunc)
+        if sortFunc is not None:
+            result = sorted(result, key=sortFunc)
 
         return (
             {r[asDict]: r for r in result}
@@ -389,6 +1039,7 @@ class Mongo:
             return False
 
         (good, result) = self.executeMongo(table, "delete_one", criteria)
+        self.forget(table, structural=True)
         return result.deleted_count > 0 if good else False
 
     def deleteRecord(self, table, criteria, uName):
@@ -422,6 +1073,7 @@ class Mongo:
         (good, result) = self.executeMongo(
             table, "update_one", criteria, {"$set": updates}
         )
+        self.forget(table, structural=True)
         return good
 
     def undeleteRecord(self, table, criteria, uName):
@@ -454,6 +1106,7 @@ class Mongo:
         criteria[MDEL] = {"$exists": True}
         updates = {"$unset": {MDEL: None}, "$set": {MRESDT: isonow(), MRESBY: uName}}
         (good, result) = self.executeMongo(table, "update_one", criteria, updates)
+        self.forget(table, structural=True)
         return good
 
     def hardDeleteRecords(self, table, criteria, uName):
@@ -478,6 +1131,7 @@ class Mongo:
             return False
 
         (good, result) = self.executeMongo(table, "delete_many", criteria)
+        self.forget(table, structural=True)
         count = result.deleted_count if good else 0
         return (good, count)
 
@@ -509,6 +1163,7 @@ class Mongo:
         (good, result) = self.executeMongo(
             table, "update_many", criteria, {"$set": updates}
         )
+        self.forget(table, structural=True)
         count = result.modified_count if good else 0
         return (good, count)
 
@@ -536,6 +1191,7 @@ class Mongo:
         criteria[MDEL] = {"$exists": True}
         updates = {"$unset": {MDEL: False}, "$set": {MRESDT: isonow(), MRESBY: uName}}
         (good, result) = self.executeMongo(table, "update_many", criteria, updates)
+        self.forget(table, structural=True)
         count = result.modified_count if good else 0
         return (good, count)
 
@@ -574,6 +1230,7 @@ class Mongo:
         (good, result) = self.executeMongo(
             table, "update_one", criteria, {"$set": updates}
         )
+        self.forget(table)
         return result.modified_count > 0 if good else False
 
     def insertRecord(self, table, fields):
@@ -593,11 +1250,15 @@ class Mongo:
             inserted.
         """
         (good, result) = self.executeMongo(table, "insert_one", dict(**fields))
+        self.forget(table, structural=True)
         return result.inserted_id if good else None
 
-    def executeMongo(self, table, command, *args, warn=True, **kwargs):
+    def executeMongo(self, table, command, *args, warn=True, fetch=False, **kwargs):
         """Executes a MongoDb command and returns the result.
 
+        The command is timed, and the timing is passed to the instruments,
+        see `Mongo.addInstrument()`.
+
         Parameters
         ----------
         table: string
@@ -611,6 +1272,9 @@ class Mongo:
             Any number of additional arguments that the command requires.
         warn: boolean, optional True
             If True, warn if there is an error.
+        fetch: boolean, optional False
+            If True, the result (a cursor) is fetched completely into a list,
+            so that the time of retrieving the records is included in the timing.
         kwargs: list
             Any number of additional keyword arguments that the command requires.
 
@@ -638,8 +1302,14 @@ class Mongo:
                     msg="Database action", logmsg=f"Unknown Mongo command: `{method}`"
                 )
             good = False
+
+        start = perf_counter()
+
         try:
             result = method(*args, **kwargs)
+
+            if fetch:
+                result = list(result)
         except Exception as e:
             if warn:
                 Messages.error(
@@ -649,14 +1319,17 @@ class Mongo:
             good = False
             result = None
 
+        duration = perf_counter() - start
+
+        for instrument in self.instruments:
+            instrument(table, command, args, duration, good)
+
         return (good, result)
 
     def consolidate(self, record):
         """Resolves all links in a record to title values of linked records.
 
-        The `_id` field of the record will be removed.
-        Values of fields with names like `xxxId` will be looked up in table `xxx`,
-        and will be replaced by the value of the `title` field of the found record.
+        This is `Mongo.consolidateMany()` for a single record.
 
         Parameters
         ----------
@@ -668,21 +1341,67 @@ class Mongo:
         dict
             All AttrDict values will be recursively transformed in ordinary dict values.
         """
-        newRecord = AttrDict()
+        return self.consolidateMany([record])[0]
 
-        for k, v in record.items():
-            if k == "_id":
-                continue
-            if k.endswith("Id"):
-                table = k.removesuffix("Id")
-                linkedRecord = self.getRecord(table, dict(_id=v), warn=False)
-                v = linkedRecord.title
-                if v is not None:
-                    newRecord[table] = v
-            else:
-                newRecord[k] = v
+    def consolidateMany(self, records):
+        """Resolves all links in records to title values of linked records.
 
-        return newRecord.deepdict()
+        The `_id` field of the records will be removed.
+        Values of fields with names like `xxxId` will be looked up in table `xxx`,
+        and will be replaced by the value of the `title` field of the found record.
+
+        The linked records are fetched with one query per table, for all records
+        together.
+
+        Parameters
+        ----------
+        records: iterable of dict or AttrDict
+            The records to consolidate.
+
+        Returns
+        -------
+        list of dict
+            The consolidated records, in the same order as the input.
+            All AttrDict values will be recursively transformed in ordinary dict
+            values.
+        """
+        records = list(records)
+        linkedIds = {}
+
+        for record in records:
+            for k, v in record.items():
+                if k != "_id" and k.endswith("Id") and v is not None:
+                    linkedIds.setdefault(k.removesuffix("Id"), set()).add(v)
+
+        titles = {}
+
+        for table, ids in linkedIds.items():
+            titles[table] = {
+                r._id: r.title
+                for r in self.getList(
+                    table, dict(_id={"$in": list(ids)}), projection=["title"]
+                )
+            }
+
+        newRecords = []
+
+        for record in records:
+            newRecord = AttrDict()
+
+            for k, v in record.items():
+                if k == "_id":
+                    continue
+                if k.endswith("Id"):
+                    table = k.removesuffix("Id")
+                    v = titles.get(table, {}).get(v, None)
+                    if v is not None:
+                        newRecord[table] = v
+                else:
+                    newRecord[k] = v
+
+            newRecords.append(newRecord.deepdict())
+
+        return newRecords
 
     def mkBackup(self, dstBase, project=None, asJson=False):
         """Backs up data as record files in table folders.
@@ -696,6 +1415,10 @@ class Mongo:
         This function backs up database data in
         [`bson`](https://www.mongodb.com/basics/bson) and/or `json` format.
 
+        The bson data is written gzip-compressed, together with a manifest,
+        and in site-wide backups the tables are exported in parallel;
+        see `control.dbfiles`.
+
         Inspired by this
         [gist](https://gist.github.com/Lh4cKg/939ce683e2876b314a205b3f8c6e8e9d).
 
@@ -720,7 +1443,6 @@ class Mongo:
         Messages = self.Messages
         self.connect()
         db = self.db
-        tables = db.list_collection_names()
 
         dstb = f"{dstBase}/bson"
         dirMake(dstb)
@@ -733,32 +1455,53 @@ class Mongo:
             jOpts = dict(ensure_ascii=False, indent=2, sort_keys=True)
 
         if project is None:
-            for table in tables:
-                records = db[table].find()
-                n = self.writeRecords(table, records, dstb, dstj=dstj, jOpts=jOpts)
-                plural = "" if n == 1 else ""
-                Messages.info(msg=f"table {table} {n} record{plural}")
-            return True
+            good = True
+
+            def report(table, n, skipped):
+                nonlocal good
+
+                if isinstance(n, Exception):
+                    good = False
+                    Messages.error(
+                        msg=f"table {table} could not be backed up",
+                        logmsg=f"Backup of table {table}: {n}",
+                    )
+                else:
+                    plural = "" if n == 1 else "s"
+                    Messages.info(msg=f"table {table} {n} record{plural}")
+
+            exportTables(db, dstb, jsonDst=dstj, jOpts=jOpts, report=report)
+            return good
 
         (projectId, project) = self.get("project", project)
-        records = db.project.find(dict(_id=projectId))
-        n = self.writeRecords("project", records, dstb, dstj=dstj, jOpts=jOpts)
-        records = db.edition.find(dict(projectId=projectId))
-        n = self.writeRecords("edition", records, dstb, dstj=dstj, jOpts=jOpts)
+        manifest = {}
+
+        for table, criteria in (
+            ("project", dict(_id=projectId)),
+            ("edition", dict(projectId=projectId)),
+        ):
+            records = db[table].find(criteria)
+            manifest[table] = self.writeRecords(
+                table, records, dstb, dstj=dstj, jOpts=jOpts
+            )
+
+        writeManifest(dstb, manifest)
         return True
 
     def writeRecords(self, table, records, dstb, dstj=None, jOpts={}):
-        """Writes records to bson and possibly json file.
+        """Writes records to a compressed bson file and possibly a json file.
 
         If the destination file already exists, it will be wiped.
 
+        See `control.dbfiles.writeRecords()`.
+
         Parameters
         ----------
         table: string
             Table that contains the record. Will be used as file name
             for the record to be written to.
-        record: dict
-            The record as it is retrieved from MongoDb
+        records: iterable
+            The records as they are retrieved from MongoDb
         dstb: string
             Destination folder for the bson file.
         dstj: string, optional None
@@ -766,37 +1509,21 @@ class Mongo:
             If `None`, no json file will be written.
         jOpts: dict, optional {}
             Format options for writing the json file.
-        first
 
         Returns
         -------
-        integer
-            The number of records written
+        dict
+            The manifest entry for this table: the file name, the number of
+            records written and the checksum.
         """
-        asJson = dstj is not None
+        fileName = f"{table}{EXT_GZ}"
+        jsonPath = None if dstj is None else f"{dstj}/{table}.json"
+        (n, checksum) = writeRecords(
+            f"{dstb}/{fileName}", records, jsonPath=jsonPath, jOpts=jOpts
+        )
+        return dict(file=fileName, records=n, sha256=checksum)
 
-        n = 0
-        with open(f"{dstb}/{table}.bson", "wb") as bh:
-            if asJson:
-                jh = open(f"{dstj}/{table}.json", "w")
-                jh.write("[\n")
-
-            sep = ""
-            for record in records:
-                bh.write(BSON.encode(record))
-                n += 1
-                if asJson:
-                    jh.write(sep)
-                    jh.write(dumpjs(record, **jOpts))
-                sep = ",\n"
-
-            if asJson:
-                jh.write("\n]\n")
-                jh.close()
-
-        return n
-
-    def restoreBackup(self, src, project=None, clean=True):
+    def restoreBackup(self, src, project=None, clean=True, batchSize=BATCH_SIZE):
         """Restores the database from record files in table folders.
 
         We do site-wide restores or project-specific restores.
@@ -808,13 +1535,22 @@ class Mongo:
         This function restores database data given in
         [`bson`](https://www.mongodb.com/basics/bson).
 
+        The files are read record by record and the records are inserted in batches,
+        see `control.dbfiles`. In project-specific restores the irrelevant records
+        are skipped while reading.
+
+        The files may be compressed (`.bson.gz`) or not (`.bson`).
+        If there is a manifest, the files are checked against it before anything
+        is restored.
+
         Inspired by this
         [gist](https://gist.github.com/Lh4cKg/939ce683e2876b314a205b3f8c6e8e9d).
 
         Parameters
         ----------
         src: string
-            Source folder.
+            Source folder. If it has a subfolder `bson`, as made by
+            `Mongo.mkBackup()`, the files are read from there.
         project: string, optional None
             If given, only restores the given project.
         clean: boolean, optional True
@@ -823,6 +1559,8 @@ class Mongo:
             If `clean=True` then, in case of site-wide restores, all records
             will be cleaned. In case of project restores, only the relevant
             project/edition records will be cleaned.
+        batchSize: integer, optional `control.dbfiles.BATCH_SIZE`
+            The maximum number of records that are inserted in one go.
 
         Returns
         -------
@@ -840,114 +1578,111 @@ class Mongo:
             )
             return False
 
-        good = True
+        if dirExists(f"{src}/bson"):
+            src = f"{src}/bson"
 
-        if project is None:
-            with os.scandir(src) as dh:
-                for entry in dh:
-                    name = entry.name
-                    if not (entry.is_file() and name.endswith(".bson")):
-                        continue
+        problems = checkTables(src)
 
-                    table = name.rsplit(".", 1)[0]
+        if problems:
+            for problem in problems:
+                Messages.error(
+                    msg="The backup is damaged, nothing has been restored",
+                    logmsg=f"Backup {src}: {problem}",
+                )
+            return False
 
-                    with open(f"{src}/{name}", "rb") as f:
-                        records = decode_all(f.read())
+        files = tableFiles(src)
+        good = True
 
-                    n = len(records)
-                    plural = "" if n == 1 else "s"
-                    Messages.info(msg=f"table {table} {n} record{plural}")
-                    if db[table] is not None and clean:
-                        (thisGood, count) = self.hardDeleteRecords(
-                            table, {}, "backuprestore"
-                        )
-                        if not thisGood:
-                            good = False
-
-                    db[table].insert_many(records)
+        if project is None:
+            for table, name in files.items():
+                if db[table] is not None and clean:
+                    (thisGood, count) = self.hardDeleteRecords(
+                        table, {}, "backuprestore"
+                    )
+                    if not thisGood:
+                        good = False
+
+                n = insertBatched(
+                    db[table], readRecords(f"{src}/{name}"), batchSize=batchSize
+                )
+                self.forget(table, structural=True)
+                plural = "" if n == 1 else "s"
+                Messages.info(msg=f"table {table} {n} record{plural}")
             return good
 
         (projectId, project) = self.get("project", project)
 
-        with os.scandir(src) as dh:
-            for entry in dh:
-                name = entry.name
-                if not (entry.is_file() and name.endswith(".bson")):
-                    continue
+        for table, name in files.items():
+            if table not in {"project", "edition"}:
+                continue
 
-                table = name.rsplit(".", 1)[0]
+            thisGood = True
 
-                if table not in {"project", "edition"}:
+            if table == "project":
+                records = list(
+                    readRecords(f"{src}/{name}", keep=lambda r: r["_id"] == projectId)
+                )
+                nRecords = len(records)
+
+                if nRecords == 0:
+                    Messages.warning(
+                        msg=f"No {table} records found! Restore skipped.",
+                        logmsg=(
+                            f"Project restore {projectId}: "
+                            f"No {table} records found! Skipped."
+                        ),
+                    )
                     continue
+                elif nRecords > 1:
+                    Messages.warning(
+                        msg=f"Multiple {table} records found. Will restore first.",
+                        logmsg=(
+                            f"Project restore {projectId}: "
+                            f"Multiple ({nRecords}) {table} records found."
+                        ),
+                    )
 
-                with open(f"{src}/{name}", "rb") as f:
-                    records = decode_all(f.read())
-
-                thisGood = True
-
-                if table == "project":
-                    records = [r for r in records if r._id == projectId]
-                    nRecords = len(records)
-
-                    if nRecords == 0:
-                        Messages.warning(
-                            msg=f"No {table} records found! Restore skipped.",
-                            logmsg=(
-                                f"Project restore {projectId}: "
-                                f"No {table} records found! Skipped."
-                            ),
-                        )
-                        continue
-                    elif nRecords > 1:
-                        Messages.warning(
-                            msg=f"Multiple {table} records found. Will restore first.",
-                            logmsg=(
-                                f"Project restore {projectId}: "
-                                f"Multiple ({nRecords}) {table} records found."
-                            ),
-                        )
-
-                    record = records[0]
-
-                    Messages.info(msg=f"Restoring {table} record ...")
-                    if db[table] is not None and clean:
-                        thisGood = self.hardDeleteRecord(
-                            table, dict(_id=projectId), "backuprestore"
-                        )
-                    if thisGood:
-                        db[table].insert_one(record)
-                    else:
-                        good = False
+                record = records[0]
 
-                elif table == "edition":
-                    records = [r for r in records if r.projectId == projectId]
-                    nRecords = len(records)
-                    if nRecords == 0:
-                        Messages.info(
-                            msg=f"No {table} records found.",
-                            logmsg=(
-                                f"Project restore {projectId}: "
-                                f"No {table} records found."
-                            ),
-                        )
-                        continue
-
-                    Messages.info(msg=f"Restoring {table} records ...")
-
-                    if db[table] is not None and clean:
-                        (thisGood, count) = self.hardDeleteRecords(
-                            table, dict(projectId=projectId), "backuprestore"
-                        )
-                    if thisGood:
-                        db[table].insert_many(records)
-                    else:
-                        good = False
+                Messages.info(msg=f"Restoring {table} record ...")
+                if db[table] is not None and clean:
+                    thisGood = self.hardDeleteRecord(
+                        table, dict(_id=projectId), "backuprestore"
+                    )
+                if thisGood:
+                    db[table].insert_one(record)
+                    self.forget(table, structural=True)
                 else:
-                    Messages.warning(
-                        msg=f"Skipping {name} as it is not legal in a project backup",
+                    good = False
+
+            elif table == "edition":
+                records = peekRecords(
+                    readRecords(
+                        f"{src}/{name}",
+                        keep=lambda r: r.get("projectId", None) == projectId,
+                    )
+                )
+                if records is None:
+                    Messages.info(
+                        msg=f"No {table} records found.",
                         logmsg=(
-                            f"Skipping {name} as it is not legal in a project backup"
+                            f"Project restore {projectId}: "
+                            f"No {table} records found."
                         ),
                     )
+                    continue
+
+                Messages.info(msg=f"Restoring {table} records ...")
+
+                if db[table] is not None and clean:
+                    (thisGood, count) = self.hardDeleteRecords(
+                        table, dict(projectId=projectId), "backuprestore"
+                    )
+                if thisGood:
+                    insertBatched(db[table], records, batchSize=batchSize)
+                    self.forget(table, structural=True)
+                else:
+                    good = False
 
         return good
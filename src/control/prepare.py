@@ -1,5 +1,3 @@
-from pybars import Compiler
-
 from .messages import Messages as MessagesCls
 from .config import Config as ConfigCls
 from .mongo import Mongo as MongoCls
@@ -14,6 +12,7 @@ from .pages import Pages as PagesCls
 from .auth import Auth as AuthCls
 from .generic import AttrDict
 from .authoidc import AuthOidc as AuthOidcCls
+from .handlebars import Handlebars as HandlebarsCls
 
 
 def prepare(design=False, migrate=False, trivial=False):
@@ -96,7 +95,7 @@ def prepare(design=False, migrate=False, trivial=False):
     Wrap = WrapCls(Settings, Messages, Viewers)
     Content = ContentCls(Settings, Messages, Viewers, Mongo, Wrap)
     Tailwind = TailwindCls(Settings)
-    Handlebars = Compiler()
+    Handlebars = HandlebarsCls(Settings.templateCacheDir)
 
     if design:
 
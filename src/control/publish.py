@@ -92,9 +92,15 @@ class Publish:
 
         def getNum(kind, pubNumLast, condition, itemsDir):
             if pubNumLast is None:
-                itemsDb = Mongo.getList(kind, condition)
+                itemsDb = Mongo.getList(
+                    kind,
+                    condition,
+                    sort=[("pubNum", -1)],
+                    projection=["pubNum"],
+                    limit=1,
+                )
                 nDb = len(itemsDb)
-                maxDb = 0 if nDb == 0 else max(r.pubNum or 0 for r in itemsDb)
+                maxDb = 0 if nDb == 0 else itemsDb[0].pubNum or 0
 
                 itemsFile = [int(n) for n in dirContents(itemsDir)[1] if n.isdecimal()]
                 nFile = len(itemsFile)
@@ -161,7 +167,9 @@ class Publish:
 
         try:
             self.addSiteFiles(site)
-            good = Static.genPages(pPubNum, ePubNum, featured=featured)
+            good = Static.genPages(
+                pPubNum, ePubNum, featured=featured, jobs=Settings.generateJobs
+            )
 
         except Exception as e1:
             Messages.error(logmsg="".join(format_exception(e1)))
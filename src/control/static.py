@@ -1,22 +1,29 @@
+import json
 import re
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from itertools import repeat
+from multiprocessing import get_context
 from traceback import format_exception
 
 from markdown import markdown
 
 from .files import (
     fileNm,
+    fileExists,
     dirNm,
     dirUpdate,
     dirAllFiles,
     dirContents,
     dirMake,
     stripExt,
+    readPath,
     readJson,
     readYaml,
     writeJson,
 )
-from .generic import AttrDict, deepAttrDict, deepdict
+from .generic import AttrDict, AttrChainMap, deepAttrDict, deepdict
+from .handlebars import Handlebars as HandlebarsCls
 from .helpers import prettify, genViewerSelector, ucFirst
 from .precheck import Precheck as PrecheckCls
 
@@ -25,6 +32,226 @@ COMMENT_RE = re.compile(r"""\{\{!--.*?--}}""", re.S)
 CONFIG_FILE = "client.yml"
 
 
+# state of a worker process that renders pages, see `initRenderer()`
+
+RENDERER = AttrDict()
+
+# the number of pages per worker process that are rendered in one batch,
+# see `control.static.Static.genPages()`
+
+BATCH_PER_JOB = 64
+
+
+def textHash(text):
+    """Computes a hash of a text, to detect whether it has changed."""
+    return sha256(text.encode("utf8")).hexdigest()
+
+
+def memberJson(key, value):
+    """The JSON of a single member of a dict, as it appears in `pageJson()`."""
+    return json.dumps({key: deepdict(value)}, ensure_ascii=False, indent=2)[2:-2]
+
+
+def pageJson(item, memberCache):
+    """Turns page data into JSON.
+
+    The result is the same as `writeJson(deepdict(item))`, but it is made without
+    copying the page data.
+
+    The pages of an edition are `AttrChainMap` objects that share their last map,
+    the data of the edition, see `control.static.Static.getData()`.
+    The members of that map are turned into JSON once, and reused for the
+    other pages of the same edition.
+
+    Parameters
+    ----------
+    item: AttrDict | AttrChainMap
+        The page data.
+    memberCache: AttrDict
+        Remembers the JSON of the members of the last shared map that we have met,
+        in `base` and `texts`.
+        The pages of an edition are made one after the other, so there is no need
+        to remember more.
+
+    Returns
+    -------
+    string
+        The page data as JSON.
+    """
+    if type(item) is not AttrChainMap:
+        return writeJson(deepdict(item))
+
+    maps = item.maps
+    base = maps[-1]
+
+    if memberCache.base is not base:
+        memberCache.base = base
+        memberCache.texts = {}
+
+    texts = memberCache.texts
+
+    # the members are ordered and looked up as in a `ChainMap`
+
+    owners = {}
+
+    for mapping in reversed(maps):
+        for key in mapping:
+            owners[key] = mapping
+
+    if not owners:
+        return "{}"
+
+    members = []
+
+    for key, mapping in owners.items():
+        if mapping is base:
+            text = texts.get(key, None)
+
+            if text is None:
+                text = memberJson(key, base[key])
+                texts[key] = text
+        else:
+            text = memberJson(key, mapping[key])
+
+        members.append(text)
+
+    return "{\n" + ",\n".join(members) + "\n}"
+
+
+def writeIfChanged(path, text):
+    """Writes a file, but only if its contents change.
+
+    Returns
+    -------
+    boolean
+        Whether the file has been written.
+    """
+    if fileExists(path) and readPath(path) == text:
+        return False
+
+    dirMake(dirNm(path))
+
+    with open(path, "w", encoding="utf8") as fh:
+        fh.write(text)
+
+    return True
+
+
+def renderPage(template, item, partials, htmlPath):
+    """Fills in a template and writes the page.
+
+    Parameters
+    ----------
+    template: function
+        The compiled template.
+    item: AttrDict | AttrChainMap
+        The page data.
+    partials: dict
+        The compiled partials.
+    htmlPath: string
+        Where the page is written.
+
+    Returns
+    -------
+    string, string
+        The outcome: `rendered`, `unchanged` (nothing written), or `failed`;
+        and an error message in case of failure.
+    """
+    try:
+        result = template(item, partials=partials)
+    except Exception as e:
+        return (
+            "failed",
+            f"Error filling template {item.template} : "
+            f"{''.join(format_exception(e))}",
+        )
+
+    return ("rendered" if writeIfChanged(htmlPath, result) else "unchanged", None)
+
+
+def initRenderer(partialSources, cacheDir):
+    """Prepares a worker process for rendering pages.
+
+    The partials are compiled once per worker.
+    Errors in partials are not reported here, the main process has done that
+    already.
+
+    Parameters
+    ----------
+    partialSources: dict
+        The sources of the partials, keyed by name.
+    cacheDir: string
+        The directory with compiled templates, see `control.handlebars.Handlebars`.
+    """
+    Handlebars = HandlebarsCls(cacheDir)
+    partials = {}
+
+    for partial, pContent in partialSources.items():
+        try:
+            partials[partial] = Handlebars.compile(pContent)
+        except Exception:
+            pass
+
+    RENDERER.Handlebars = Handlebars
+    RENDERER.partials = partials
+    RENDERER.templates = {}
+
+
+def renderChunk(templateSources, pages):
+    """Renders a chunk of pages in a worker process.
+
+    Templates are compiled at most once per worker.
+
+    Parameters
+    ----------
+    templateSources: dict
+        The sources of the templates needed by the pages, keyed by file name.
+    pages: list of tuple
+        Per page: file name, template file, the path of the page, and the page data
+        as JSON.
+
+    Returns
+    -------
+    list of tuple, dict
+        Per page: file name, outcome and error message, see `renderPage()`.
+        And the statistics of the template cache of this worker since its
+        previous chunk, see `control.handlebars.Handlebars.takeStats()`.
+    """
+    Handlebars = RENDERER.Handlebars
+    templates = RENDERER.templates
+    results = []
+
+    for fileName, templateFile, htmlPath, dataText in pages:
+        error = None
+
+        if templateFile not in templates:
+            try:
+                templates[templateFile] = Handlebars.compile(
+                    templateSources[templateFile]
+                )
+            except Exception as e:
+                templates[templateFile] = None
+                error = (
+                    f"Error compiling template {templateFile} : "
+                    f"{''.join(format_exception(e))}"
+                )
+
+        template = templates[templateFile]
+
+        if template is None:
+            results.append((fileName, "failed", error))
+            continue
+
+        item = deepAttrDict(json.loads(dataText))
+        results.append(
+            (fileName, *renderPage(template, item, RENDERER.partials, htmlPath))
+        )
+
+    # `AttrDict` objects cannot be unpickled, so we send a plain dict
+
+    return (results, dict(Handlebars.takeStats()))
+
+
 class Static:
     def __init__(self, Settings, Messages, Content, Viewers, Tailwind, Handlebars):
         """All about generating static pages."""
@@ -45,6 +272,7 @@ class Static:
 
         self.data = AttrDict()
         self.dbData = AttrDict()
+        self.switchViewers = Settings.editionPages == "single"
 
     def sanitizeMeta(self, table, record):
         """Checks for missing (sub)-fields in the Dublin Core.
@@ -105,7 +333,7 @@ class Static:
 
             F.setLogical(record, value)
 
-    def genPages(self, pPubNum, ePubNum, featured=[1, 2, 3]):
+    def genPages(self, pPubNum, ePubNum, featured=[1, 2, 3], jobs=1):
         """Generate html pages for a published edition.
 
         We assume the data of the projects and editions is already in place.
@@ -130,6 +358,39 @@ class Static:
         If a particular edition is specified, the **E** for that edition will
         also be (re)generated.
 
+        But a page is only rendered if its inputs have changed since it was
+        generated the last time.
+        We keep a build manifest in `pubModeDir` (see `Settings.buildManifest`)
+        that records for each generated page the hashes of its inputs:
+
+        *   the page data, which is distilled from the `db.json` files of the site,
+            the projects and the editions that the page draws upon;
+        *   the template;
+        *   the partials;
+        *   the list of viewers and their versions.
+
+        If these hashes are the same as in the manifest, and the page and its
+        JSON twin are still present, the page is skipped.
+        Otherwise it is rendered, but it is only written if the result differs from
+        what is on disk.
+
+        The page data is turned into JSON page by page, see `pageJson()`,
+        and the JSON twin is written straight away.
+        The pages that must be rendered are collected in batches of limited size,
+        see `BATCH_PER_JOB`, so that we do not hold the data of all pages at the
+        same time.
+
+        The pages may be rendered by several worker processes in parallel.
+        They get the page data as JSON.
+
+        An edition gets a page for each viewer version, plus a default page.
+        But if the setting `editionPages` is `single`, an edition gets one page,
+        in which the browser loads the viewer version, chosen from the ones
+        listed in `viewers.json`, see `js/viewerswitch.js`.
+        The pages for the viewer versions are then replaced by small pages that
+        redirect to the edition page, so that their urls keep working.
+        A new viewer version then only leads to new redirect pages.
+
         Parameters
         ----------
         pPubNUm, ePubNUm: integer or boolean or void
@@ -149,6 +410,11 @@ class Static:
         featured: list of integer
             The list of publication numbers of featured projects. They will appear
             in a special display on the home page.
+        jobs: integer, optional 1
+            The number of worker processes that render pages.
+            If 1, pages are rendered in the current process.
+            The workers are started with the `spawn` method, so that they do not
+            inherit threads and connections of the web app.
 
         Returns
         -------
@@ -159,6 +425,7 @@ class Static:
         Settings = self.Settings
         Tailwind = self.Tailwind
         Handlebars = self.Handlebars
+        switchViewers = self.switchViewers
         viewerDir = Settings.viewerDir
         pubModeDir = Settings.pubModeDir
         dataOutDir = f"{pubModeDir}/json"
@@ -168,8 +435,19 @@ class Static:
         jsDir = Settings.jsDir
         imageDir = Settings.imageDir
 
+        jobs = max(1, jobs or 1)
+
         partials = {}
+        partialSources = {}
+        templateSources = {}
         compiledTemplates = {}
+        inputHashes = AttrDict()
+        workers = AttrDict(pool=None)
+        compileStats = AttrDict(cached=0, compiled=0, saved=0.0)
+        Handlebars.takeStats()
+
+        manifestFile = Settings.buildManifest
+        manifest = readJson(asFile=manifestFile, plain=True)
 
         if type(featured) is list:
             msg = "skipping featured project '{}'"
@@ -257,6 +535,7 @@ class Static:
 
         def registerPartials():
             good = True
+            sources = []
 
             for partialFile in dirAllFiles(partialsIn):
                 pDir = dirNm(partialFile).replace(partialsIn, "").strip("/")
@@ -269,9 +548,12 @@ class Static:
                 sep = "" if pDir == "" else "/"
                 partial = f"{pDir}{sep}{pName}"
 
-                with open(partialFile) as fh:
+                with open(partialFile, encoding="utf8") as fh:
                     pContent = COMMENT_RE.sub("", fh.read())
 
+                partialSources[partial] = pContent
+                sources.append(f"{partial}\n{pContent}")
+
                 try:
                     partials[partial] = Handlebars.compile(pContent)
                 except Exception as e:
@@ -283,6 +565,8 @@ class Static:
                     )
                     good = False
 
+            inputHashes.partials = textHash("\n".join(sorted(sources)))
+
             report = f"{len(partials):<3} pieces"
             Messages.info(
                 msg=f"{report} compiled",
@@ -290,85 +574,239 @@ class Static:
             )
             return good
 
+        def getTemplate(templateFile):
+            """Reads a template, without compiling it.
+
+            Returns
+            -------
+            string
+                The hash of the source of the template.
+            """
+            if templateFile not in templateSources:
+                with open(templateFile, encoding="utf8") as fh:
+                    templateSources[templateFile] = COMMENT_RE.sub("", fh.read())
+
+            return textHash(templateSources[templateFile])
+
+        def compileTemplate(templateFile):
+            """Compiles a template, at most once."""
+            if templateFile in compiledTemplates:
+                return compiledTemplates[templateFile]
+
+            try:
+                template = Handlebars.compile(templateSources[templateFile])
+            except Exception as e:
+                Messages.error(
+                    logmsg=(
+                        f"Error compiling template {templateFile} : "
+                        f"{''.join(format_exception(e))}"
+                    )
+                )
+                template = None
+
+            compiledTemplates[templateFile] = template
+            return template
+
+        def addStats(stats):
+            for k, v in stats.items():
+                compileStats[k] += v
+
+        def reportStats():
+            """Reports how much compiling the template cache has saved."""
+            addStats(Handlebars.takeStats())
+            report = (
+                f"{compileStats.cached:>3} cached, {compileStats.compiled:>3} compiled"
+            )
+            saved = f"saved {compileStats.saved:.2f}s"
+            Messages.info(
+                msg=f"templates {report}, {saved}",
+                logmsg=f"{'templates':<10} {report:<37} {saved}",
+            )
+
+        def renderSerial(pages):
+            """Renders pages in the current process."""
+            for page in pages:
+                template = compileTemplate(page.templateFile)
+
+                if template is None:
+                    yield (page.fileName, "failed", None)
+                    continue
+
+                yield (
+                    page.fileName,
+                    *renderPage(template, page.item, partials, page.htmlPath),
+                )
+
+        def renderParallel(pages):
+            """Renders pages in worker processes.
+
+            The pages are divided in chunks, a few per worker, so that the workers
+            remain busy if some chunks take more time than others.
+            """
+            if workers.pool is None:
+                workers.pool = ProcessPoolExecutor(
+                    max_workers=jobs,
+                    mp_context=get_context("spawn"),
+                    initializer=initRenderer,
+                    initargs=(partialSources, Handlebars.cacheDir),
+                )
+
+            sources = {
+                page.templateFile: templateSources[page.templateFile]
+                for page in pages
+            }
+            size = -(-len(pages) // (4 * jobs))
+            chunks = [
+                [
+                    (page.fileName, page.templateFile, page.htmlPath, page.dataText)
+                    for page in pages[i : i + size]
+                ]
+                for i in range(0, len(pages), size)
+            ]
+            done = set()
+
+            try:
+                for results, stats in workers.pool.map(
+                    renderChunk, repeat(sources), chunks
+                ):
+                    addStats(stats)
+
+                    for result in results:
+                        done.add(result[0])
+                        yield result
+
+            except Exception as e:
+                error = f"Error in rendering worker : {''.join(format_exception(e))}"
+
+                for page in pages:
+                    if page.fileName not in done:
+                        yield (page.fileName, "failed", error)
+                        error = None
+
         def genTarget(target, pNum, eNum, nvv=1):
             items = self.getData(target, pNum, eNum)
 
-            success = 0
-            failure = 0
+            counts = AttrDict(rendered=0, skipped=0, unchanged=0, failure=0)
+            parallel = jobs > 1
+            batchSize = BATCH_PER_JOB * jobs
+
+            # only the edition pages show the viewers and their versions,
+            # and not if the viewers are switched in the browser
+
+            showsViewers = target == "editionpages" and not switchViewers
+
+            def renderBatch(pages):
+                """Renders a batch of pages and enters them in the manifest."""
+                outcomes = (
+                    renderParallel(pages)
+                    if parallel and len(pages) > jobs
+                    else renderSerial(pages)
+                )
+                pageInfo = {page.fileName: page for page in pages}
+                good = True
+
+                for fileName, outcome, error in outcomes:
+                    if error is not None:
+                        Messages.error(logmsg=error)
+
+                    if outcome == "failed":
+                        counts.failure += 1
+                        good = False
+                        continue
+
+                    page = pageInfo[fileName]
+
+                    if outcome == "rendered" or page.changedData:
+                        counts.rendered += 1
+                    else:
+                        counts.unchanged += 1
+
+                    manifest[fileName] = page.inputs
+
+                return good
+
             good = True
+            pending = []
+            memberCache = AttrDict()
 
             for item in items:
+                fileName = item.fileName
                 templateFile = f"{templateDir}/{item.template}"
+                htmlPath = f"{pubModeDir}/{fileName}"
+                dataPath = (
+                    None
+                    if item.isRedirect
+                    else f"{dataOutDir}/{fileName}".rsplit(".", 1)[0] + ".json"
+                )
+                dataText = pageJson(item, memberCache)
 
-                if templateFile in compiledTemplates:
-                    template = compiledTemplates[templateFile]
-                else:
-                    with open(templateFile) as fh:
-                        tContent = COMMENT_RE.sub("", fh.read())
-
-                    try:
-                        template = Handlebars.compile(tContent)
-                    except Exception as e:
-                        Messages.error(
-                            logmsg=(
-                                f"Error compiling template {templateFile} : "
-                                f"{''.join(format_exception(e))}"
-                            )
-                        )
-                        template = None
+                inputs = dict(
+                    data=textHash(dataText),
+                    template=getTemplate(templateFile),
+                    partials=inputHashes.partials,
+                )
 
-                    compiledTemplates[templateFile] = template
+                if showsViewers:
+                    inputs["viewers"] = inputHashes.viewers
 
-                if template is None:
-                    failure += 1
-                    good = False
+                if (
+                    manifest.get(fileName, None) == inputs
+                    and fileExists(htmlPath)
+                    and (dataPath is None or fileExists(dataPath))
+                ):
+                    counts.skipped += 1
                     continue
 
-                try:
-                    result = template(item, partials=partials)
-                except Exception as e:
-                    Messages.error(
-                        logmsg=(
-                            f"Error filling template {item.template} : "
-                            f"{''.join(format_exception(e))}"
-                        )
+                manifest.pop(fileName, None)
+                changedData = dataPath is not None and writeIfChanged(
+                    dataPath, dataText
+                )
+                pending.append(
+                    AttrDict(
+                        fileName=fileName,
+                        templateFile=templateFile,
+                        htmlPath=htmlPath,
+                        inputs=inputs,
+                        changedData=changedData,
+                        item=None if parallel else item,
+                        dataText=dataText if parallel else None,
                     )
-                    failure += 1
-                    good = False
-                    continue
-
-                for genDir, asData in ((pubModeDir, False), (dataOutDir, True)):
-                    path = f"{genDir}/{item.fileName}"
+                )
 
-                    if asData:
-                        ext = ".json"
-                        path = path.rsplit(".", 1)[0] + ext
+                if len(pending) >= batchSize:
+                    if not renderBatch(pending):
+                        good = False
 
-                    dirPart = dirNm(path)
-                    dirMake(dirPart)
+                    pending = []
 
-                    if asData:
-                        writeJson(deepdict(item), asFile=path)
-                    else:
-                        with open(path, "w") as fh:
-                            fh.write(result)
-
-                success += 1
+            if pending and not renderBatch(pending):
+                good = False
 
-            goodStr = f"{success:>3} ok"
-            badStr = f"{failure:>3} XX" if failure else ""
-            sep = ";" if failure else " "
-            report = f"{goodStr}{sep} {badStr}"
+            report = (
+                f"{counts.rendered:>3} rendered, {counts.skipped:>3} skipped, "
+                f"{counts.unchanged:>3} unchanged"
+            )
+            if counts.failure:
+                report += f"; {counts.failure:>3} XX"
             if target == "editionpages":
-                report += (
-                    f" = {(success + failure) // (nvv + 1)} eds x " f"(1 + {nvv} v-v)"
-                )
+                report += f" = {len(items) // (nvv + 1)} eds x (1 + {nvv} v-v)"
             Messages.info(
                 msg=f"generated {target} {report}",
                 logmsg=f"{'generated':<10} {target:<12} {report:<24} to {pubModeDir}",
             )
             return good
 
+        def writeManifest():
+            """Writes the build manifest.
+
+            Entries of pages that no longer exist are dropped.
+            """
+            for fileName in list(manifest):
+                if not fileExists(f"{pubModeDir}/{fileName}"):
+                    del manifest[fileName]
+
+            writeJson(manifest, asFile=manifestFile)
+
         pType = type(pPubNum)
         eType = type(ePubNum)
         pIsInt = pType is int
@@ -445,10 +883,22 @@ class Static:
             good = False
 
         self.getDbData()
+        viewersText = writeJson(deepdict(self.getData("viewers", None, None)))
+        inputHashes.viewers = textHash(viewersText)
 
-        for target in targets:
-            if not genTarget(*target, nvv=nvv):
-                good = False
+        if switchViewers:
+            writeIfChanged(f"{pubModeDir}/viewers.json", viewersText)
+
+        try:
+            for target in targets:
+                if not genTarget(*target, nvv=nvv):
+                    good = False
+        finally:
+            if workers.pool is not None:
+                workers.pool.shutdown()
+
+        writeManifest()
+        reportStats()
 
         if good:
             msg = "All tasks successful"
@@ -525,6 +975,7 @@ class Static:
 
         cfg = self.cfg
         generation1 = cfg.generation
+        switchViewers = self.switchViewers
         dbData = self.dbData
         data = self.data
 
@@ -847,6 +1298,39 @@ class Static:
                     ) = Precheck.checkEdition(None, pNum, eNum, eItem, asPublished=True)
                     er.citation = wrapCitation(er)
 
+                    if switchViewers:
+                        er.switchViewers = True
+                        er.origViewer = origViewer or ""
+                        er.origVersion = origVersion or ""
+                        er.fileName = f"{fileBase}.html"
+                        result.append(er)
+
+                        # the old urls of the pages for the viewer versions
+                        # redirect to the edition page
+
+                        for viewerInfo in viewers:
+                            viewer = viewerInfo.name
+
+                            for versionInfo in viewerInfo.versions:
+                                version = versionInfo.name
+                                result.append(
+                                    AttrDict(
+                                        template="redirect.html",
+                                        isRedirect=True,
+                                        name=er.name,
+                                        fileName=f"{fileBase}-{viewer}-{version}.html",
+                                        redirectTo=(
+                                            f"{fileBase}.html"
+                                            f"?viewer={viewer}&version={version}"
+                                        ),
+                                    )
+                                )
+
+                        continue
+
+                    # the pages for the viewer versions share the data of the
+                    # edition, we only layer the values that differ on top of it
+
                     for viewerInfo in viewers:
                         viewer = viewerInfo.name
                         element = viewerInfo.element
@@ -855,13 +1339,7 @@ class Static:
 
                         for versionInfo in versions:
                             version = versionInfo.name
-                            isDefault = versionInfo.isDefault
-                            ver = deepAttrDict(deepcopy(deepdict(er)))
-                            ver.viewer = viewer
-                            ver.version = version
-                            ver.element = element
-                            ver.fileName = f"{fileBase}-{viewer}-{version}.html"
-                            isDefault = isDefaultViewer and isDefault
+                            isDefault = isDefaultViewer and versionInfo.isDefault
 
                             viewerSelector = genViewerSelector(
                                 viewersLean,
@@ -872,13 +1350,21 @@ class Static:
                                 fileBase,
                             )
 
-                            ver.viewerSelector = viewerSelector
-                            result.append(ver)
+                            overlay = dict(
+                                viewer=viewer,
+                                version=version,
+                                element=element,
+                                fileName=f"{fileBase}-{viewer}-{version}.html",
+                                viewerSelector=viewerSelector,
+                            )
+                            result.append(AttrChainMap(overlay, er))
 
                             if isDefault:
-                                ver = deepAttrDict(deepcopy(deepdict(ver)))
-                                ver.fileName = f"{fileBase}.html"
-                                result.append(ver)
+                                result.append(
+                                    AttrChainMap(
+                                        dict(fileName=f"{fileBase}.html"), overlay, er
+                                    )
+                                )
 
             return result
 
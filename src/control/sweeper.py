@@ -230,7 +230,9 @@ class Sweeper:
         for table in tables:
             recordIds = [
                 r._id
-                for r in Mongo.getList(table, {}, deleted=True)
+                for r in Mongo.getList(
+                    table, {}, deleted=True, projection=[MDELDT]
+                )
                 if not lessAgo(delayDel, r.get(MDELDT, None))
             ]
 
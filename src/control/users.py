@@ -1,4 +1,7 @@
+from time import monotonic
+
 from .generic import AttrDict
+from .mongo import MDEL
 from .flask import (
     acg,
     requestArg,
@@ -60,6 +63,16 @@ class Users:
         """The object that gives access to authentication methods.
         """
 
+        self.userCache = {}
+        """Recently looked up user records and their roles, keyed by user.
+
+        See `Users.userRecord()` and `Users.myRoles()`.
+        """
+
+        self.userDirectoryCache = None
+        """Snapshot of the user table, see `Users.userDirectory()`.
+        """
+
     @staticmethod
     def initUser():
         """Initialize the storage that keeps the details of the currently
@@ -248,7 +261,13 @@ class Users:
         will be cleared.
 
         Otherwise, we make sure that we retrieve the current user's attributes from
-        the database.
+        the database, or from the cache of recently looked up users, see
+        `Users.userRecord()`.
+
+        The roles of the user with respect to projects and editions are not loaded
+        here, but when they are first needed, see `Users.myRoles()`.
+        Requests for static files and WebDAV requests that are authorised from the
+        cache do not need them.
 
         !!! note "No login"
             We do not try to perform a login of a user,
@@ -270,6 +289,150 @@ class Users:
                     acg.User.clear()
                     oidc.logout()
 
+    def loadRoles(self):
+        """Loads the roles of the current user with respect to projects and editions.
+
+        The roles are stored in the application-context-global `userRoles`,
+        so that `control.auth.Auth.authorise()` does not need to query the
+        database in order to find the roles of the current user.
+
+        There is one query per table that is coupled to users
+        (see `userCoupled` in `yaml/authorise.yml`) on the corresponding
+        link table (`projectUser`, `editionUser`).
+        If the master of such a table is also coupled to users,
+        the id of the master record is looked up in the same query,
+        by means of `$lookup`.
+
+        Only links that are not marked as deleted count.
+        Master ids are only looked up for records that are not marked as deleted.
+
+        This is done by `Users.myRoles()`, when the roles are needed and they are
+        not in the cache or have an older version than the current version of
+        users and roles.
+
+        Returns
+        -------
+        AttrDict
+            The roles, see `Users.myRoles()`.
+        """
+        Settings = self.Settings
+        Mongo = self.Mongo
+        auth = Settings.auth
+        userCoupled = set(auth.userCoupled)
+        detailMaster = Settings.datamodel.detailMaster
+
+        user = acg.User.user
+        version = Mongo.authVersion()
+        userRoles = AttrDict(
+            user=user, version=version, roles=AttrDict(), masters=AttrDict()
+        )
+        acg.userRoles = userRoles
+
+        if not user:
+            return userRoles
+
+        for table in userCoupled:
+            idField = f"{table}Id"
+            master = detailMaster[table]
+            roles = {}
+            masters = {}
+            userRoles.roles[table] = roles
+
+            pipeline = [
+                {"$match": {"user": user, MDEL: None, "role": {"$ne": None}}},
+                {"$project": {idField: 1, "role": 1}},
+            ]
+
+            if master in userCoupled:
+                masterIdField = f"{master}Id"
+                userRoles.masters[table] = masters
+                pipeline.extend(
+                    [
+                        {
+                            "$lookup": {
+                                "from": table,
+                                "localField": idField,
+                                "foreignField": "_id",
+                                "pipeline": [
+                                    {"$match": {MDEL: None}},
+                                    {"$project": {masterIdField: 1}},
+                                ],
+                                "as": "record",
+                            }
+                        },
+                        {
+                            "$addFields": {
+                                masterIdField: {"$first": f"$record.{masterIdField}"}
+                            }
+                        },
+                    ]
+                )
+
+            (good, links) = Mongo.executeMongo(
+                f"{table}User", "aggregate", pipeline, fetch=True
+            )
+
+            for link in links or []:
+                recordId = link[idField]
+                roles[recordId] = link.role
+
+                if master in userCoupled:
+                    masterId = link.get(f"{master}Id", None)
+
+                    if masterId is not None:
+                        masters[recordId] = masterId
+
+        entry = self.userCache.get(user, None)
+
+        if entry is not None and entry.version == version:
+            entry.roles = userRoles
+
+        return userRoles
+
+    def myRoles(self):
+        """The roles of the current user with respect to projects and editions.
+
+        The roles are kept in the application-context-global `userRoles`,
+        and with the record of the user in the cache of `Users.userRecord()`,
+        stamped with the version of users and roles, see
+        `control.mongo.Mongo.authVersion()`.
+
+        If the roles are not there for the current user and the current version,
+        they will be loaded, see `Users.loadRoles()`.
+
+        Returns
+        -------
+        AttrDict
+            With members:
+
+            *   `user`: the current user;
+            *   `roles`: keyed by table, then by record id, valued by the role that
+                the current user has with respect to that record;
+            *   `masters`: keyed by table, then by record id, valued by the id of
+                the master record, for the records in `roles` whose master table
+                is also coupled to users.
+        """
+        Mongo = self.Mongo
+        user = acg.User.user
+        version = Mongo.authVersion()
+
+        userRoles = acg.get("userRoles", None)
+
+        if userRoles is None or userRoles.user != user or userRoles.version != version:
+            entry = self.userCache.get(user, None) if user else None
+            userRoles = None if entry is None else entry.roles
+
+            if (
+                userRoles is None
+                or version is None
+                or userRoles.version != version
+            ):
+                userRoles = self.loadRoles()
+            else:
+                acg.userRoles = userRoles
+
+        return userRoles
+
     def myDetails(self):
         """Who is the currently authenticated user?
 
@@ -347,6 +510,124 @@ class Users:
 
         return (isSpecialUser, user)
 
+    def userRecord(self, user, warn=True, fresh=False):
+        """Looks up the record of a user in the user table, with caching.
+
+        The current user is looked up at the start of each request, see
+        `Users.identify()`. In order to save a database query per request,
+        the records that are found are cached for the number of seconds in the
+        setting `cacheTtl.user`.
+
+        Each cached record is stamped with the version of users and roles at the
+        time of the lookup, see `control.mongo.Mongo.authVersion()`.
+        That version is shared by all worker processes, and it is increased by
+        every change in users and roles, e.g. when an admin gives a user another
+        role. From then on, no worker uses the cached record anymore.
+
+        The cache entry also holds the roles of the user with respect to projects
+        and editions, see `Users.myRoles()`.
+
+        Parameters
+        ----------
+        user: string
+            The `user` field of the user record.
+        warn: boolean, optional True
+            Whether to warn if the user does not exist.
+        fresh: boolean, optional False
+            Whether to bypass the cache.
+
+        Returns
+        -------
+        AttrDict
+            The user record; empty if the user does not exist.
+        """
+        Settings = self.Settings
+        Mongo = self.Mongo
+        ttl = (Settings.cacheTtl or AttrDict()).user or 0
+        userCache = self.userCache
+        version = Mongo.authVersion() if ttl else None
+
+        entry = None if fresh else userCache.get(user, None)
+
+        if (
+            entry is not None
+            and version is not None
+            and entry.version == version
+            and monotonic() - entry.time < ttl
+        ):
+            return entry.record
+
+        record = Mongo.getRecord("user", dict(user=user), warn=warn)
+
+        if record and version is not None:
+            userCache[user] = AttrDict(
+                time=monotonic(), version=version, record=record, roles=None
+            )
+
+            if len(userCache) > 10000:
+                now = monotonic()
+
+                for k, v in list(userCache.items()):
+                    if now - v.time >= ttl:
+                        userCache.pop(k, None)
+        else:
+            userCache.pop(user, None)
+
+        return record
+
+    def userDirectory(self):
+        """A snapshot of the user table, for looking up names and site-wide roles.
+
+        The snapshot is shared by all requests in this worker process.
+        It is stamped with the version of users and roles, and it is not used
+        anymore when users are created, deleted, or change, in whatever worker,
+        see `control.mongo.Mongo.authVersion()`.
+        It also expires after the number of seconds in the setting
+        `cacheTtl.userDirectory`.
+
+        Returns
+        -------
+        AttrDict
+            With members:
+
+            *   `byUser`: keyed by user, valued by the user record with fields
+                `user`, `nickname`, `role`;
+            *   `byRole`: keyed by site-wide role, valued by a tuple of the
+                user records with that role, sorted by nickname.
+        """
+        Settings = self.Settings
+        Mongo = self.Mongo
+        ttl = (Settings.cacheTtl or AttrDict()).userDirectory or 0
+        userDirectoryCache = self.userDirectoryCache
+        version = Mongo.authVersion()
+
+        if (
+            userDirectoryCache is not None
+            and version is not None
+            and userDirectoryCache.version == version
+            and monotonic() - userDirectoryCache.time < ttl
+        ):
+            return userDirectoryCache.directory
+
+        userList = Mongo.getList(
+            "user", {}, sort="nickname", projection=["user", "nickname", "role"]
+        )
+        byUser = {}
+        byRole = {}
+
+        for uInfo in userList:
+            byUser[uInfo.user] = uInfo
+            byRole.setdefault(uInfo.role, []).append(uInfo)
+
+        directory = AttrDict(
+            byUser=byUser,
+            byRole={role: tuple(uInfos) for (role, uInfos) in byRole.items()},
+        )
+        self.userDirectoryCache = AttrDict(
+            time=monotonic(), version=version, directory=directory
+        )
+        return directory
+
     def wrapLogin(self):
         """Generate HTML for the login widget.
 
@@ -497,34 +778,62 @@ class Users:
         H = Settings.H
         auth = Settings.auth
 
-        involvedUsers = []
+        # first we determine which roles we may disclose,
+        # and we collect the records and roles for which we need to look up
+        # the role holders in the link tables
+
+        disclosed = []
+        linked = {}
 
         for table, record, role in tableRecordRoles:
             roles = auth.roles[table]
             allowed = self.authorise(table, record, action="read")
-            users = None
 
             if allowed and roles is not None and roles.get(role, None) is not None:
-                userInfo = Mongo.getList("user", {}, sort="nickname", asDict="user")
+                disclosed.append((table, record, role))
 
-                if table == "site":
-                    relatedUsers = [
-                        uInfo for uInfo in userInfo.values() if uInfo.role == role
-                    ]
-                else:
-                    criteria = {f"{table}Id": record._id, "role": role}
-                    relatedUserList = Mongo.getList(f"{table}User", criteria)
-                    relatedUsers = sorted(
-                        (
-                            userInfo[r.user]
-                            for r in relatedUserList
-                            if r.user in userInfo
-                        ),
-                        key=lambda x: x.nickname or "",
-                    )
-                users = tuple((u.user, u.nickname) for u in relatedUsers)
-
-                involvedUsers.append((table, role, users))
+                if table != "site":
+                    linked.setdefault(table, set()).add((record._id, role))
+
+        # site-wide roles and the names of users come from the user directory
+
+        directory = self.userDirectory()
+        byUser = directory.byUser
+        byRole = directory.byRole
+
+        # the other roles come from one query per link table
+
+        holders = {}
+
+        for table, recordRoles in linked.items():
+            idField = f"{table}Id"
+            criteria = {
+                idField: {"$in": list({recordId for (recordId, role) in recordRoles})},
+                "role": {"$in": list({role for (recordId, role) in recordRoles})},
+            }
+
+            for r in Mongo.getList(
+                f"{table}User", criteria, projection=["user", idField, "role"]
+            ):
+                holders.setdefault((table, r[idField], r.role), []).append(r.user)
+
+        involvedUsers = []
+
+        for table, record, role in disclosed:
+            if table == "site":
+                relatedUsers = byRole.get(role, ())
+            else:
+                relatedUsers = sorted(
+                    (
+                        byUser[u]
+                        for u in holders.get((table, record._id, role), [])
+                        if u in byUser
+                    ),
+                    key=lambda x: x.nickname or "",
+                )
+            users = tuple((u.user, u.nickname) for u in relatedUsers)
+
+            involvedUsers.append((table, role, users))
 
         if not asString:
             return tuple(involvedUsers)
@@ -626,10 +935,9 @@ class Users:
             application-context-global `User`.
         """
         Messages = self.Messages
-        Mongo = self.Mongo
         User = acg.User
 
-        record = Mongo.getRecord("user", dict(user=user))
+        record = self.userRecord(user)
 
         if not record:
             Messages.warning(msg="Unknown user", logmsg=f"Unknown user {user}")
@@ -677,7 +985,7 @@ class Users:
                     "sub", "unknown_name"
                 )
 
-        record = Mongo.getRecord("user", dict(user=user), warn=False)
+        record = self.userRecord(user, warn=False, fresh=update)
         newUser = None
 
         if not record:
@@ -156,7 +156,9 @@ class Viewers:
 
         usedVersions = collections.Counter()
 
-        for edition in Mongo.getList("edition", {}):
+        for edition in Mongo.getList(
+            "edition", {}, projection=["settings.authorTool"]
+        ):
             editionSettings = edition.settings or AttrDict()
             authorTool = editionSettings.authorTool or AttrDict()
             thisViewer = authorTool.name or viewerDefault
@@ -3,6 +3,7 @@ from wsgidav.wsgidav_app import WsgiDAVApp
 from .prepare import prepare
 from .app import appFactory as appFactoryMain
 from .flask import appMake
+from .webdavstore import getLockStorage
 
 
 def getWebdavApp(objects):
@@ -11,8 +12,14 @@ def getWebdavApp(objects):
     We get the WebDAV app ready-made from
     [WsgiDav](https://wsgidav.readthedocs.io/en/latest/),
     and configure it here.
+
+    Locks are stored in MongoDb, so that all workers see the same locks,
+    see `control.webdavstore`.
     """
     Settings = objects.Settings
+    Mongo = objects.Mongo
+
+    lockStorage = getLockStorage(Mongo)
 
     webdavConfig = {
         "provider_mapping": {
@@ -22,13 +29,14 @@ def getWebdavApp(objects):
             },
         },
         "simple_dc": {"user_mapping": {"*": True}},
+        "lock_storage": lockStorage,
         "verbose": 1,
     }
 
     return WsgiDAVApp(webdavConfig)
 
 
-def dispatchWebdav(app, webdavPrefix, webdavApp):
+def dispatchWebdav(app, webdavPrefix, webdavApp, objects):
     """Combines the main app with the webdavapp.
 
     A WSGI app is essentially a function that takes a request
@@ -63,6 +71,11 @@ def dispatchWebdav(app, webdavPrefix, webdavApp):
     the request to the main app, which is programmed to
     respond with a 404 to such requests.
 
+    The decisions are cached for a short time, keyed by the session cookie,
+    project, edition, and action of the request, see
+    `control.auth.Auth.webdavDecision()`.
+    When a decision is in the cache, the request is not fed to the main app.
+
     Parameters
     ----------
     app: object
@@ -71,7 +84,32 @@ def dispatchWebdav(app, webdavPrefix, webdavApp):
         Initial part of the url that is used as trigger to divert to the WEBDav app.
     webdavApp:
         A WEBDav server.
+    objects: AttrDict
+        The singleton objects of the main app.
     """
+    Settings = objects.Settings
+    Mongo = objects.Mongo
+    Auth = objects.Auth
+    webdavMethods = Settings.webdavMethods
+    cookieName = app.config["SESSION_COOKIE_NAME"]
+
+    def decisionKey(environ, url):
+        """The key under which the decision about a request is cached.
+
+        Returns None if the request is not about an edition.
+        """
+        parts = url.removeprefix(webdavPrefix).split("/", 4)
+
+        if len(parts) < 4 or parts[0] != "project" or parts[2] != "edition":
+            return None
+
+        action = webdavMethods.get(environ.get("REQUEST_METHOD", ""), None)
+
+        if action is None:
+            return None
+
+        cookie = app.request_class(environ).cookies.get(cookieName, None)
+        return (cookie, parts[1], parts[3], action)
 
     def wsgi_function(environ, start_response):
         """Internal function for to deliver as result.
@@ -81,11 +119,20 @@ def dispatchWebdav(app, webdavPrefix, webdavApp):
 
         if aimedAtWebdav:
             theApp = webdavApp
-            environ["PATH_INFO"] = f"/auth{url}"
-            with app.request_context(environ) as ctx:
-                ctx.push()
-                authorized = app.dispatch_request()
-                ctx.pop()
+            key = decisionKey(environ, url)
+            version = None if key is None else Mongo.decisionVersion()
+            authorized = None if key is None else Auth.webdavDecision(key, version)
+
+            if authorized is None:
+                environ["PATH_INFO"] = f"/auth{url}"
+                with app.request_context(environ) as ctx:
+                    ctx.push()
+                    authorized = app.dispatch_request()
+                    ctx.pop()
+
+                if key is not None:
+                    Auth.cacheWebdavDecision(key, authorized, version)
+
             if authorized:
                 environ["PATH_INFO"] = url
                 theApp = webdavApp
@@ -134,6 +181,13 @@ def appFactory():
         The solution is to run the app through a task runner like Gunicorn.
         However, the app does not run in debug mode then, so tracing errors becomes
         more difficult then.
+
+        Even then, the number of requests that can be handled at the same time
+        is limited by the number of workers and threads.
+        The worker profiles `gthread` and `gevent` in `gunicornConfig.py`
+        (set by the environment variable `GUNICORN_PROFILE`) allow many more
+        concurrent requests, so that long requests such as downloads do not
+        block the WebDAV requests of the viewers.
     """
 
     trivial = False
@@ -147,6 +201,8 @@ def appFactory():
         app = appFactoryMaster()
         objects.Messages.addApp(app)
 
-        app.wsgi_app = dispatchWebdav(origApp, "/webdav/", getWebdavApp(objects))
+        app.wsgi_app = dispatchWebdav(
+            origApp, "/webdav/", getWebdavApp(objects), objects
+        )
 
     return app
@@ -0,0 +1,232 @@
+"""Lock storage for WebDAV, shared by all workers.
+
+By default, [WsgiDav](https://wsgidav.readthedocs.io/en/latest/) keeps its locks
+in memory. When the app runs in several worker processes, every worker has its
+own lock table, and a LOCK that lands on one worker is not seen by an UNLOCK or
+PUT that lands on another one.
+
+Here we keep them in MongoDb instead, in a database of their own, next to the
+database of the app, so that they do not end up in backups and exports.
+
+WsgiDav's own lock storage classes keep their data in a dict, or in a shelve,
+which is a dict-like object on disk.
+We subclass them and give them a dict-like object that is backed by a
+MongoDb collection: `MongoMapping`.
+Like a shelve, it stores the values pickled, so that any value that WsgiDav
+stores comes back unchanged.
+
+The exception is the list of lock tokens per url.
+WsgiDav updates it by reading it, changing it, and writing it back, which is
+only safe within a single process.
+We store those lists as arrays, and update them in place, by atomic MongoDb
+operations, see `SharedLockStorage`.
+
+WsgiDav's dead properties remain switched off, as in its default configuration.
+"""
+
+import pickle
+import time
+from collections.abc import MutableMapping
+
+from wsgidav.lock_man.lock_manager import (
+    generate_lock_token,
+    normalize_lock_root,
+    validate_lock,
+)
+from wsgidav.lock_man.lock_storage import LockStorageDict
+
+
+LOCK_TABLE = "locks"
+URL_PREFIX = "URL2TOKEN:"
+
+
+class MongoMapping(MutableMapping):
+    def __init__(self, getCollection):
+        """A dict-like object backed by a MongoDb collection.
+
+        Each item is a document with the key as `_id` and the pickled value
+        as `value`.
+        Or, if the value is a set of members, maintained by
+        `MongoMapping.addMember()` and `MongoMapping.removeMember()`,
+        the members as an array in `members`; they are read as a list.
+
+        Parameters
+        ----------
+        getCollection: function
+            A function that returns the collection handle.
+            We ask for it at each operation, so that the connection is made
+            lazily, in the process where it is used.
+        """
+        self.getCollection = getCollection
+
+    def __getitem__(self, key):
+        doc = self.getCollection().find_one({"_id": key})
+
+        if doc is None:
+            raise KeyError(key)
+
+        return self.docValue(doc)
+
+    def __setitem__(self, key, value):
+        self.getCollection().replace_one(
+            {"_id": key}, {"_id": key, "value": pickle.dumps(value)}, upsert=True
+        )
+
+    def __delitem__(self, key):
+        if self.getCollection().delete_one({"_id": key}).deleted_count == 0:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return (doc["_id"] for doc in self.getCollection().find({}, {"_id": True}))
+
+    def __len__(self):
+        return self.getCollection().count_documents({})
+
+    def items(self):
+        """All items, fetched in one query."""
+        return [
+            (doc["_id"], self.docValue(doc)) for doc in self.getCollection().find({})
+        ]
+
+    @staticmethod
+    def docValue(doc):
+        """The value of an item, given its document."""
+        return list(doc["members"]) if "members" in doc else pickle.loads(doc["value"])
+
+    def addMember(self, key, member):
+        """Adds a member to the set of members of a key, in one atomic operation.
+
+        If the key has no item yet, it is created.
+        """
+        self.getCollection().update_one(
+            {"_id": key}, {"$addToSet": {"members": member}}, upsert=True
+        )
+
+    def removeMember(self, key, member):
+        """Removes a member from the set of members of a key.
+
+        When no members are left, the item is deleted, unless another process has
+        added a member in the meantime.
+        """
+        collection = self.getCollection()
+        collection.update_one({"_id": key}, {"$pull": {"members": member}})
+        collection.delete_one({"_id": key, "members": {"$size": 0}})
+
+    def clear(self):
+        self.getCollection().delete_many({})
+
+    def sync(self):
+        """Nothing to do: every change is written immediately."""
+        pass
+
+
+class SharedLockStorage(LockStorageDict):
+    def __init__(self, getCollection):
+        """WebDAV lock storage in MongoDb.
+
+        The methods `create()` and `delete()` are those of
+        `wsgidav.lock_man.lock_storage.LockStorageDict`, except for the way they
+        maintain the tokens per url: not read-modify-write, but by
+        `MongoMapping.addMember()` and `MongoMapping.removeMember()`,
+        so that concurrent locks in different workers do not lose tokens.
+
+        Parameters
+        ----------
+        getCollection: function
+            See `MongoMapping`.
+        """
+        super().__init__()
+        self.getCollection = getCollection
+
+    def __repr__(self):
+        return "SharedLockStorage(MongoDb)"
+
+    def open(self):
+        self._lock.acquire_write()
+
+        try:
+            self._dict = MongoMapping(self.getCollection)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire_write()
+
+        try:
+            self._dict = None
+        finally:
+            self._lock.release()
+
+    def create(self, path, lock):
+        self._lock.acquire_write()
+
+        try:
+            assert lock.get("token") is None
+            assert lock.get("expire") is None, "Use timeout instead of expire"
+            assert path and "/" in path
+
+            path = normalize_lock_root(path)
+            lock["root"] = path
+
+            timeout = lock.get("timeout")
+            timeout = (
+                LockStorageDict.LOCK_TIME_OUT_DEFAULT
+                if timeout is None
+                else float(timeout)
+            )
+
+            if timeout < 0 or timeout > LockStorageDict.LOCK_TIME_OUT_MAX:
+                timeout = LockStorageDict.LOCK_TIME_OUT_MAX
+
+            lock["timeout"] = timeout
+            lock["expire"] = time.time() + timeout
+
+            validate_lock(lock)
+
+            token = generate_lock_token()
+            lock["token"] = token
+
+            self._dict[token] = lock
+            self._dict.addMember(f"{URL_PREFIX}{path}", token)
+            return lock
+        finally:
+            self._lock.release()
+
+    def delete(self, token):
+        self._lock.acquire_write()
+
+        try:
+            lock = self._dict.get(token)
+
+            if lock is None:
+                return False
+
+            self._dict.removeMember(f"{URL_PREFIX}{lock.get('root')}", token)
+            self._dict.pop(token, None)
+            return True
+        finally:
+            self._lock.release()
+
+
+def getLockStorage(Mongo):
+    """Makes the lock storage for WsgiDav.
+
+    Parameters
+    ----------
+    Mongo: object
+        Singleton instance of `control.mongo.Mongo`.
+        Its connection to MongoDb is used, and the name of its database,
+        which depends on the run mode.
+
+    Returns
+    -------
+    object
+        The lock storage.
+    """
+    database = f"{Mongo.database}_webdav"
+
+    def getCollection():
+        Mongo.connect()
+        return Mongo.client[database][LOCK_TABLE]
+
+    return SharedLockStorage(getCollection)
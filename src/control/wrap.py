@@ -74,11 +74,12 @@ class Wrap:
             )
         )
 
+        permitted = Auth.authoriseMany("project", projects, action="read")
+
         for project in projects:
             projectId = project._id
-            permitted = Auth.authorise("project", project, action="read")
 
-            if not permitted:
+            if not permitted.get(projectId, False):
                 continue
 
             title = project.title
@@ -127,10 +128,12 @@ class Wrap:
 
         wrapped = []
 
+        permitted = Auth.authoriseMany("edition", editions, action="read")
+
         for edition in editions:
             editionId = edition._id
-            permitted = Auth.authorise("edition", record=edition, action="read")
-            if not permitted:
+
+            if not permitted.get(editionId, False):
                 continue
 
             title = edition.title
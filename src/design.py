@@ -4,7 +4,22 @@ from control.prepare import prepare
 from control.static import Static as StaticCls
 
 
-def build(featured):
+HELP = """
+Generate the static pages.
+
+USAGE
+
+python design.py [--jobs n] [featured ...]
+
+--jobs n
+    Render the pages in n worker processes (default 1).
+
+featured
+    The publication numbers of the featured projects (default 1 2 3).
+"""
+
+
+def build(featured, jobs=1):
     objects = prepare(design=True)
 
     Static = StaticCls(
@@ -16,8 +31,28 @@ def build(featured):
         objects.Handlebars,
     )
 
-    Static.genPages(True, True, featured=featured or [1, 2, 3])
+    return Static.genPages(True, True, featured=featured or [1, 2, 3], jobs=jobs)
+
+
+def main():
+    args = sys.argv[1:]
+    featured = []
+    jobs = 1
+
+    while args:
+        arg = args.pop(0)
+
+        if arg == "--jobs":
+            if not args or not args[0].isdecimal():
+                print(HELP)
+                return 1
+
+            jobs = int(args.pop(0))
+        else:
+            featured.append(arg)
+
+    return 0 if build(featured, jobs=jobs) else 1
 
 
 if __name__ == "__main__":
-    build(sys.argv[1:])
+    sys.exit(main())
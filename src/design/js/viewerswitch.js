@@ -0,0 +1,91 @@
+export class ViewerSwitch {
+  constructor(slotId, selectorId, manifest) {
+    this.slotId = slotId
+    this.selectorId = selectorId
+    this.manifest = manifest
+  }
+
+  choose(viewers) {
+    const params = new URLSearchParams(window.location.search)
+    const wanted = params.get("viewer")
+    const viewerInfo =
+      viewers.find((vw) => vw.name === wanted) ||
+      viewers.find((vw) => vw.isDefault) ||
+      viewers[0]
+    const wantedVersion = params.get("version")
+    const versionInfo =
+      viewerInfo.versions.find((vv) => vv.name === wantedVersion) ||
+      viewerInfo.versions.find((vv) => vv.isDefault) ||
+      viewerInfo.versions[0]
+    return { viewerInfo, version: versionInfo.name }
+  }
+
+  load(viewerInfo, version, slot) {
+    const { name, element } = viewerInfo
+    const resourceRoot = `/viewers/${name}/${version}/`
+
+    const fonts = document.createElement("link")
+    fonts.rel = "stylesheet"
+    fonts.href = `${resourceRoot}fonts/fonts.css`
+    document.head.appendChild(fonts)
+
+    const script = document.createElement("script")
+    script.defer = true
+    script.src = `${resourceRoot}js/${element}.min.js`
+    document.head.appendChild(script)
+
+    const viewer = document.createElement(element)
+    viewer.setAttribute("root", slot.dataset.root)
+    viewer.setAttribute("resourceroot", resourceRoot)
+    viewer.setAttribute("document", slot.dataset.scene)
+    viewer.id = slot.id
+    viewer.style.cssText = slot.style.cssText
+    slot.replaceWith(viewer)
+  }
+
+  selector(viewers, chosenViewer, chosenVersion, slot) {
+    const { origViewer, origVersion } = slot.dataset
+    const page = window.location.pathname
+
+    return viewers
+      .map(({ name: viewer, isDefault: vwDefault, versions }) => {
+        let viewerRep = vwDefault ? `<b>${viewer}</b>` : viewer
+        viewerRep = viewer === origViewer ? `<i>${viewerRep}</i>` : viewerRep
+
+        const entries = versions.map(({ name: version, isDefault: vvDefault }) => {
+          let versionRep = vwDefault && vvDefault ? `<b>${version}</b>` : version
+          versionRep =
+            viewer === origViewer && version === origVersion
+              ? `<i>${versionRep}</i>`
+              : versionRep
+          const entry =
+            viewer === chosenViewer && version === chosenVersion
+              ? `<span>${versionRep}</span>`
+              : `<a href="${page}?viewer=${viewer}&version=${version}">${versionRep}</a>`
+          return `<div>${entry}</div>`
+        })
+        return [
+          `<details><summary>${viewerRep} versions</summary>`,
+          ...entries,
+          "</details>",
+        ].join("\n")
+      })
+      .join("\n")
+  }
+
+  init() {
+    fetch(this.manifest)
+      .then((response) => response.json())
+      .then((viewers) => {
+        const slot = document.getElementById(this.slotId)
+        const { viewerInfo, version } = this.choose(viewers)
+        document.getElementById(this.selectorId).innerHTML = this.selector(
+          viewers,
+          viewerInfo.name,
+          version,
+          slot
+        )
+        this.load(viewerInfo, version, slot)
+      })
+  }
+}
@@ -1,8 +1,48 @@
 import os
+from importlib.util import find_spec
 
+# Worker profiles, chosen by GUNICORN_PROFILE:
+#
+# sync    (default) a few processes with a few threads each.
+# gthread a few processes with many threads each: the many small WebDAV requests
+#         of a viewer run concurrently, and long downloads or publish actions
+#         do not take all request slots.
+# gevent  a few processes with cooperative green threads; needs the gevent package.
+#
+# Processes, threads and gevent connections can be overridden by
+# GUNICORN_PROCESSES, GUNICORN_THREADS and GUNICORN_CONNECTIONS.
+# The database connection is made per process, after the fork,
+# see control.mongo.Mongo.connect.
 
-workers = int(os.environ.get("GUNICORN_PROCESSES", "2"))
-threads = int(os.environ.get("GUNICORN_THREADS", "2"))
+PROFILES = dict(
+    sync=dict(worker_class="sync", workers=2, threads=2),
+    gthread=dict(worker_class="gthread", workers=2, threads=16),
+    gevent=dict(worker_class="gevent", workers=2, worker_connections=200),
+)
+
+profileName = os.environ.get("GUNICORN_PROFILE", "") or "sync"
+
+# fail here, with a clear message, rather than in every worker at boot
+
+if profileName not in PROFILES:
+    raise SystemExit(
+        f"GUNICORN_PROFILE={profileName} is unknown; choose one of "
+        + ", ".join(PROFILES)
+    )
+
+if profileName == "gevent" and find_spec("gevent") is None:
+    raise SystemExit(
+        "GUNICORN_PROFILE=gevent needs the gevent package, which is not installed; "
+        "install it (see requirements.txt) or choose the gthread profile"
+    )
+
+profile = PROFILES[profileName]
+
+worker_class = profile["worker_class"]
+workers = int(os.environ.get("GUNICORN_PROCESSES", "") or profile["workers"])
+threads = int(os.environ.get("GUNICORN_THREADS", "") or profile.get("threads", 1))
+connections = profile.get("worker_connections", 1000)
+worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", "") or connections)
 timeout = int(os.environ.get('GUNICORN_TIMEOUT', '360'))
 # 14:57:12
 # bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
@@ -20,6 +20,16 @@ And if the destination is just `-` then a MongoDb export will be done from the s
 which must be the name of a run mode of Pure3d.
 The export will be done to the `db` directory belonging to the source.
 
+The export writes each table as a gzip-compressed `table.bson.gz` file,
+the tables are exported in parallel, and a `manifest.json` records the number of
+records and a checksum per table. The import reads these files, and also the
+uncompressed `table.bson` files of older exports. If there is a manifest, the files
+are checked against it before anything is imported.
+
+The export with `-` as destination is incremental: tables that did not change since
+the previous export are not written again, so that the hourly export does not
+produce new files for nothing.
+
 The operations with `-` prepare for backup/restore operations by other software,
 such as [Borg](https://borgbackup.readthedocs.io/en/stable/)
 
@@ -59,11 +69,14 @@ Options:
     Only migrate the database, no file system operations/checks will be performed
 --fileonly
     Only migrate the filesystem, no mongodb operations/checks will be performed
+--batch=n
+    When importing into MongoDb, insert the records in batches of n
+    (default 1000). The bson files are read record by record, so the memory
+    needed does not grow with the size of the export.
 """
 
 import sys
 
-from bson import BSON, decode_all
 from pymongo import MongoClient
 
 from control.environment import var
@@ -73,10 +86,17 @@ from control.files import (
     abspath,
     dirExists,
     dirMake,
-    dirRemove,
     dirCopy,
     dirContents,
 )
+from control.dbfiles import (
+    BATCH_SIZE,
+    readRecords,
+    insertBatched,
+    exportTables,
+    checkTables,
+    tableFiles,
+)
 from control.prepareMigrate import prepare
 
 
@@ -94,7 +114,7 @@ Migrate Pure3D data from one place or mode to another.
 
 USAGE
 
-python migrate.py src dst
+python migrate.py [--dbonly] [--fileonly] [--batch=n] src dst
 """
 
 DRY_RUN = False
@@ -176,37 +196,34 @@ def dbExport(Settings, srcMode, srcDb, srcDbFiles, isExportMode):
         print(f"\tDB export {srcDb} to {ux(srcDbFiles)}")
 
         if not DRY_RUN:
-            if isExportMode:
-                dirRemove(srcDbFiles)
-
             dirMake(srcDbFiles)
 
-        for table in srcConn.list_collection_names():
-            records = srcConn[table].find()
+        skipped = []
 
-            try:
-                n = 0
+        def report(table, n, unchanged):
+            nonlocal good
 
-                bh = None if DRY_RUN else open(f"{srcDbFiles}/{table}.bson", "wb")
+            if isinstance(n, Exception):
+                print(f"\tCould not export table {table}: {str(n)}")
+                good = False
+            elif unchanged:
+                skipped.append(table)
+            else:
+                plural = "" if n == 1 else "s"
+                print(f"\t\ttable {table} {n} record{plural}")
 
-                for record in records:
-                    if not DRY_RUN:
-                        bh.write(BSON.encode(record))
-                    n += 1
+        exportTables(srcConn, srcDbFiles, report=report, incremental=isExportMode)
 
-                if not DRY_RUN:
-                    bh.close()
-
-                plural = "" if n == 1 else "s"
-                print(f"\t\t{DRY if DRY_RUN else ''} table {table} {n} record{plural}")
-            except Exception as e:
-                print(f"\tCould not export table {table}: {str(e)}")
-                good = False
+        if skipped:
+            n = len(skipped)
+            plural = "" if n == 1 else "s"
+            skippedRep = ", ".join(sorted(skipped))
+            print(f"\t\t{n} unchanged table{plural} skipped: {skippedRep}")
 
     return good
 
 
-def dbImport(Settings, dstMode, dstDbFiles, dstDb, isImportMode):
+def dbImport(Settings, dstMode, dstDbFiles, dstDb, isImportMode, batchSize):
     if not dstMode:
         return True
 
@@ -217,6 +234,13 @@ def dbImport(Settings, dstMode, dstDbFiles, dstDb, isImportMode):
 
     good = True
 
+    problems = checkTables(dstDbFiles)
+
+    if problems:
+        for problem in problems:
+            print(f"\tExport is damaged: {problem}")
+        return False
+
     if dstMode:
         if dstDb in allDatabases:
             if isImportMode:
@@ -230,23 +254,12 @@ def dbImport(Settings, dstMode, dstDbFiles, dstDb, isImportMode):
 
             print(f"\tDB import {ux(dstDbFiles)} into {dstDb}")
 
-            tables = [
-                x.removesuffix(".bson")
-                for x in dirContents(dstDbFiles)[0]
-                if x.endswith(".bson")
-            ]
-
-            for table in tables:
+            for table, name in tableFiles(dstDbFiles).items():
                 try:
-                    with open(f"{dstDbFiles}/{table}.bson", "rb") as f:
-                        records = decode_all(f.read())
-
-                    print(f"\t\ttable {table} {len(records)} record(s)")
+                    records = readRecords(f"{dstDbFiles}/{name}")
+                    n = insertBatched(dstConn[table], records, batchSize=batchSize)
 
-                    if DRY_RUN:
-                        print(f"\t\t{DRY}")
-                    else:
-                        dstConn[table].insert_many(records)
+                    print(f"\t\ttable {table} {n} record(s)")
                 except Exception as e:
                     print(f"\tCould not import table {table}: {str(e)}")
                     good = False
@@ -267,12 +280,21 @@ def main(args):
     newargs = []
     fileOnly = False
     dbOnly = False
+    batchSize = BATCH_SIZE
 
     for arg in args:
         if arg == "--dbonly":
             dbOnly = True
         elif arg == "--fileonly":
             fileOnly = True
+        elif arg.startswith("--batch="):
+            batchSize = arg.removeprefix("--batch=")
+
+            if not batchSize.isdecimal() or int(batchSize) == 0:
+                print(f"--batch needs a positive number, not {batchSize}")
+                return -1
+
+            batchSize = int(batchSize)
         else:
             newargs.append(arg)
 
@@ -372,7 +394,9 @@ def main(args):
                 return 1
 
     if not fileOnly:
-        if not dbImport(Settings, dstMode, dstDbFiles, dstDb, isImportMode):
+        if not dbImport(
+            Settings, dstMode, dstDbFiles, dstDb, isImportMode, batchSize
+        ):
             return 1
 
     return 0
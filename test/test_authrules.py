@@ -0,0 +1,33 @@
+from benchauth import authoriseAfter, authoriseBefore, loadAuth, makeCases
+from control.authrules import allowedActions
+
+
+def test_compiled_rules_match_rule_evaluation():
+    (auth, detailMaster) = loadAuth()
+    cases = makeCases(auth)
+
+    assert cases
+
+    for case in cases:
+        assert authoriseBefore(auth, detailMaster, *case) == authoriseAfter(
+            auth, *case
+        ), case
+
+
+def test_allowed_actions_examples():
+    permissions = loadAuth()[0].permissions
+
+    def allowed(table, state, roles, nameSpace=None):
+        return allowedActions(permissions, table, state, roles, nameSpace=nameSpace)
+
+    assert "read" not in allowed("project", True, {None})
+    assert "read" in allowed("project", True, {"guest"})
+    assert "read" in allowed("project", True, {"user"})
+    assert "read" not in allowed("project", False, {"user"})
+    assert "read" in allowed("project", False, {"user", "organiser"})
+    assert "update" in allowed("project", True, {"user", "organiser"})
+    assert "update" not in allowed("project", True, {"admin"})
+    assert "delete" in allowed("project", False, {"admin"})
+    assert "delete" not in allowed("project", True, {"admin"})
+    assert "create" in allowed("edition", False, {"user", "organiser"})
+    assert "create" not in allowed("edition", True, {"user", "organiser"})
@@ -0,0 +1,272 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from bson import ObjectId
+
+from control.dbfiles import (
+    MANIFEST,
+    checkTables,
+    exportTables,
+    hashRecords,
+    insertBatched,
+    readManifest,
+    readRecords,
+    tableFiles,
+    writeRecords,
+)
+
+
+def makeRecords(n, title="record"):
+    return [
+        dict(_id=ObjectId(), title=f"{title} {i}", dc=dict(tags=["a", "b"]), n=i)
+        for i in range(n)
+    ]
+
+
+class Collection:
+    def __init__(self, records):
+        self.records = records
+        self.batches = []
+        self.failAfter = None
+
+    def find(self, criteria, batch_size=None):
+        for i, record in enumerate(self.records):
+            if i == self.failAfter:
+                raise OSError("connection lost")
+
+            yield record
+
+    def estimated_document_count(self):
+        return len(self.records)
+
+    def insert_many(self, batch):
+        self.batches.append(batch)
+
+
+class Db:
+    """Just enough of a pymongo database for exporting tables."""
+
+    def __init__(self, tables, dbHash=False):
+        self.tables = {
+            table: Collection(records) for (table, records) in tables.items()
+        }
+        self.dbHash = dbHash
+
+    def list_collection_names(self):
+        return list(self.tables)
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+    def command(self, name, collections=()):
+        if not self.dbHash:
+            raise Exception("not authorized")
+
+        return dict(
+            collections={
+                table: str(hash(repr(self.tables[table].records)))
+                for table in collections
+            }
+        )
+
+
+def dirFiles(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_records_round_trip(tmp_path):
+    records = makeRecords(5)
+
+    for fileName in ("table.bson", "table.bson.gz"):
+        path = f"{tmp_path}/{fileName}"
+        (n, checksum) = writeRecords(path, records)
+
+        assert n == 5
+        assert list(readRecords(path)) == records
+        assert hashRecords(records) == (n, checksum)
+
+    with gzip.open(f"{tmp_path}/table.bson.gz") as fh:
+        assert fh.read() == open(f"{tmp_path}/table.bson", "rb").read()
+
+    assert [r["n"] for r in readRecords(path, keep=lambda r: r["n"] % 2)] == [1, 3]
+
+
+def test_table_files_prefer_compressed(tmp_path):
+    for fileName in ("a.bson", "b.bson", "b.bson.gz", "c.json", MANIFEST):
+        open(f"{tmp_path}/{fileName}", "w").close()
+
+    assert tableFiles(tmp_path) == {"a": "a.bson", "b": "b.bson.gz"}
+    assert tableFiles(f"{tmp_path}/nothing") == {}
+
+
+def test_insert_batched():
+    collection = Collection([])
+
+    assert insertBatched(collection, iter(makeRecords(5)), batchSize=2) == 5
+    assert [len(batch) for batch in collection.batches] == [2, 2, 1]
+
+
+def test_export_writes_manifest(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)))
+    entries = exportTables(db, tmp_path)
+    manifest = readManifest(tmp_path)
+
+    assert manifest == entries
+    assert manifest["edition"]["file"] == "edition.bson.gz"
+    assert manifest["edition"]["records"] == 4
+    assert (
+        manifest["project"]["records"],
+        manifest["project"]["sha256"],
+    ) == hashRecords(db["project"].records)
+    assert list(readRecords(f"{tmp_path}/edition.bson.gz")) == db["edition"].records
+    assert checkTables(tmp_path) == []
+
+
+def test_check_tables_finds_problems(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)))
+    exportTables(db, tmp_path, compress=False)
+
+    with open(f"{tmp_path}/project.bson", "ab") as fh:
+        fh.write(b"\0")
+
+    os.unlink(f"{tmp_path}/edition.bson")
+
+    assert checkTables(tmp_path) == [
+        "edition: file edition.bson is missing",
+        "project: checksum mismatch",
+    ]
+
+
+def test_check_tables_without_manifest(tmp_path):
+    writeRecords(f"{tmp_path}/project.bson", makeRecords(2))
+
+    assert checkTables(tmp_path) == []
+
+
+def test_export_replaces_file_of_other_kind(tmp_path):
+    db = Db(dict(project=makeRecords(3)))
+    exportTables(db, tmp_path, compress=False)
+    exportTables(db, tmp_path)
+
+    assert sorted(os.listdir(tmp_path)) == [MANIFEST, "project.bson.gz"]
+    assert checkTables(tmp_path) == []
+
+
+def test_failed_write_leaves_files_alone(tmp_path):
+    path = f"{tmp_path}/project.bson.gz"
+    jsonPath = f"{tmp_path}/project.json"
+    records = makeRecords(3)
+    writeRecords(path, records, jsonPath=jsonPath)
+    collection = Collection(makeRecords(5))
+    collection.failAfter = 2
+
+    with pytest.raises(OSError):
+        writeRecords(path, collection.find({}), jsonPath=jsonPath)
+
+    assert dirFiles(tmp_path) == ["project.bson.gz", "project.json"]
+    assert list(readRecords(path)) == records
+
+    with open(jsonPath, encoding="utf8") as fh:
+        assert len(json.load(fh)) == 3
+
+
+def test_failed_export_drops_table_from_manifest(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)))
+    exportTables(db, tmp_path)
+    db["edition"].records.append(makeRecords(1)[0])
+    db["edition"].failAfter = 2
+    problems = []
+
+    def report(table, n, skipped):
+        if isinstance(n, Exception):
+            problems.append(table)
+
+    exportTables(db, tmp_path, report=report)
+
+    assert problems == ["edition"]
+    assert sorted(readManifest(tmp_path)) == ["project"]
+    assert checkTables(tmp_path) == []
+    assert len(list(readRecords(f"{tmp_path}/edition.bson.gz"))) == 4
+    assert dirFiles(tmp_path) == ["edition.bson.gz", MANIFEST, "project.bson.gz"]
+
+    db["edition"].failAfter = None
+    exportTables(db, tmp_path)
+
+    assert readManifest(tmp_path)["edition"]["records"] == 5
+
+
+def exportReport(db, dst, **kwargs):
+    reports = {}
+
+    def report(table, n, skipped):
+        reports[table] = (n, skipped)
+
+    exportTables(db, dst, report=report, incremental=True, **kwargs)
+    return reports
+
+
+def test_incremental_export_by_checksum(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)))
+
+    assert exportReport(db, tmp_path) == dict(project=(3, False), edition=(4, False))
+    assert exportReport(db, tmp_path) == dict(project=(3, True), edition=(4, True))
+
+    db["edition"].records[0]["title"] = "changed"
+
+    assert exportReport(db, tmp_path) == dict(project=(3, True), edition=(4, False))
+    assert list(readRecords(f"{tmp_path}/edition.bson.gz")) == db["edition"].records
+    assert checkTables(tmp_path) == []
+
+
+def test_incremental_export_by_fingerprint(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)), dbHash=True)
+
+    exportReport(db, tmp_path)
+    manifest = readManifest(tmp_path)
+
+    assert manifest["project"]["fingerprint"].startswith("3:")
+    assert exportReport(db, tmp_path) == dict(project=(3, True), edition=(4, True))
+
+    db["project"].records.append(makeRecords(1)[0])
+
+    assert exportReport(db, tmp_path) == dict(project=(4, False), edition=(4, True))
+    assert readManifest(tmp_path)["edition"] == manifest["edition"]
+
+
+def test_incremental_export_rewrites_lost_files(tmp_path):
+    db = Db(dict(project=makeRecords(3)))
+    exportReport(db, tmp_path)
+    os.unlink(f"{tmp_path}/project.bson.gz")
+
+    assert exportReport(db, tmp_path) == dict(project=(3, False))
+    assert exportReport(db, tmp_path, compress=False) == dict(project=(3, False))
+    assert checkTables(tmp_path) == []
+
+
+def test_incremental_export_rewrites_damaged_files(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)), dbHash=True)
+    exportReport(db, tmp_path)
+    path = f"{tmp_path}/edition.bson.gz"
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+
+    with open(path, "wb") as fh:
+        fh.write(data[0 : len(data) // 2])
+
+    assert exportReport(db, tmp_path) == dict(project=(3, True), edition=(4, False))
+    assert checkTables(tmp_path) == []
+    assert list(readRecords(path)) == db["edition"].records
+
+
+def test_incremental_export_drops_old_tables(tmp_path):
+    db = Db(dict(project=makeRecords(3), edition=makeRecords(4)))
+    exportReport(db, tmp_path)
+    del db.tables["edition"]
+
+    assert exportReport(db, tmp_path) == dict(project=(3, True))
+    assert sorted(readManifest(tmp_path)) == ["project"]
+    assert sorted(os.listdir(tmp_path)) == [MANIFEST, "project.bson.gz"]
@@ -0,0 +1,112 @@
+import pickle
+from copy import deepcopy
+
+from control.files import writeJson
+from control.generic import AttrDict, AttrChainMap, deepAttrDict, deepdict
+from control.handlebars import Handlebars
+from control.static import pageJson
+
+
+def makeEdition():
+    return AttrDict(
+        template="edition.html",
+        name="Edition 1",
+        fileName="project/1/edition/1/index.html",
+        dc=AttrDict(title="Edition 1", creator=("Anne", "Bob"), subject=["a", "b"]),
+        boilerplate=dict(leftText="left", rightText="right"),
+        isPublished=True,
+        obfuscated=False,
+        toc="<details><summary>Ä</summary></details>",
+        empty={},
+    )
+
+
+def pageCopy(edition, **values):
+    """A page as it was made before: a deep copy of the edition data."""
+    page = deepAttrDict(deepcopy(deepdict(edition)))
+
+    for k, v in values.items():
+        page[k] = v
+
+    return page
+
+
+def test_chain_map_reads_like_attr_dict():
+    edition = makeEdition()
+    overlay = dict(viewer="voyager", fileName="index-voyager.html")
+    page = AttrChainMap(overlay, edition)
+
+    assert page.viewer == "voyager"
+    assert page.fileName == "index-voyager.html"
+    assert page.dc.title == "Edition 1"
+    assert page.missing is None
+    assert page["missing"] is None
+    assert edition.fileName == "project/1/edition/1/index.html"
+
+
+def test_chain_map_deepdict_equals_copy():
+    edition = makeEdition()
+    overlay = dict(viewer="voyager", version="0.40.0")
+    defaultPage = AttrChainMap(dict(fileName="index.html"), overlay, edition)
+
+    assert deepdict(AttrChainMap(overlay, edition)) == deepdict(
+        pageCopy(edition, **overlay)
+    )
+    assert deepdict(defaultPage) == deepdict(
+        pageCopy(edition, fileName="index.html", **overlay)
+    )
+    assert list(deepdict(defaultPage)) == list(
+        deepdict(pageCopy(edition, **overlay, fileName="index.html"))
+    )
+
+
+def test_chain_map_pickles():
+    edition = makeEdition()
+    pages = [AttrChainMap(dict(version=v), edition) for v in ("1", "2")]
+    result = pickle.loads(pickle.dumps([deepdict(p) for p in pages]))
+
+    assert result == [deepdict(p) for p in pages]
+    assert pickle.loads(pickle.dumps(AttrChainMap(dict(a=1)))).maps == [dict(a=1)]
+
+
+def test_page_json_equals_json_of_copy():
+    edition = makeEdition()
+    memberCache = AttrDict()
+    pages = []
+
+    for version in ("0.40.0", "0.41.0"):
+        overlay = dict(viewer="voyager", version=version, fileName=f"{version}.html")
+        pages.append(AttrChainMap(overlay, edition))
+        pages.append(AttrChainMap(dict(fileName="index.html"), overlay, edition))
+
+    pages.append(AttrChainMap({}, {}))
+    pages.append(makeEdition())
+
+    for page in pages:
+        assert pageJson(page, memberCache) == writeJson(deepdict(page))
+
+
+def test_page_json_uses_new_edition_data():
+    memberCache = AttrDict()
+    first = makeEdition()
+    second = makeEdition()
+    second.name = "Edition 2"
+
+    pageJson(AttrChainMap(dict(version="1"), first), memberCache)
+    page = AttrChainMap(dict(version="1"), second)
+
+    assert pageJson(page, memberCache) == writeJson(deepdict(page))
+
+
+def test_chain_map_renders_as_copy(tmp_path):
+    template = Handlebars(f"{tmp_path}/cache").compile(
+        "{{name}} {{viewer}} {{fileName}} {{#with dc}}{{title}}{{/with}}"
+        "{{#each dc.creator}} {{this}}{{/each}} {{boilerplate.leftText}}"
+        "{{#if isPublished}} published{{/if}}{{#if missing}} missing{{/if}}"
+    )
+    edition = makeEdition()
+    overlay = dict(viewer="voyager", fileName="index-voyager.html")
+
+    assert template(AttrChainMap(overlay, edition)) == template(
+        pageCopy(edition, **overlay)
+    )
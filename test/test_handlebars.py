@@ -0,0 +1,82 @@
+import os
+
+import pybars
+
+from control.handlebars import Handlebars
+
+
+SOURCE = "<p>{{name}}</p>{{#each items}}<i>{{this}}</i>{{/each}}"
+DATA = dict(name="edition", items=["a", "b"])
+RESULT = "<p>edition</p><i>a</i><i>b</i>"
+
+
+def stats(handlebars):
+    return dict(handlebars.takeStats())
+
+
+def cacheFiles(cacheDir):
+    return sorted(os.listdir(cacheDir))
+
+
+def test_no_cache():
+    handlebars = Handlebars()
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    assert stats(handlebars) == dict(cached=0, compiled=0, saved=0.0)
+
+
+def test_compiled_once(tmp_path):
+    handlebars = Handlebars(tmp_path)
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    assert stats(handlebars)["compiled"] == 1
+    assert len(cacheFiles(tmp_path)) == 1
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    counts = stats(handlebars)
+    assert (counts["cached"], counts["compiled"]) == (1, 0)
+    assert counts["saved"] > 0
+
+
+def test_cache_on_disk(tmp_path):
+    Handlebars(tmp_path).compile(SOURCE)
+    handlebars = Handlebars(tmp_path)
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    assert stats(handlebars)["cached"] == 1
+
+
+def test_changed_source(tmp_path):
+    handlebars = Handlebars(tmp_path)
+    handlebars.compile(SOURCE)
+    handlebars.takeStats()
+
+    template = handlebars.compile(f"{SOURCE}<b>{{{{name}}}}</b>")
+
+    assert template(DATA) == f"{RESULT}<b>edition</b>"
+    assert stats(handlebars)["compiled"] == 1
+    assert len(cacheFiles(tmp_path)) == 2
+
+
+def test_corrupt_cache_file(tmp_path):
+    Handlebars(tmp_path).compile(SOURCE)
+    (cacheFile,) = cacheFiles(tmp_path)
+
+    with open(f"{tmp_path}/{cacheFile}", "w") as fh:
+        fh.write("def render(:\n")
+
+    handlebars = Handlebars(tmp_path)
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    assert stats(handlebars)["compiled"] == 1
+    assert Handlebars(tmp_path).compile(SOURCE)(DATA) == RESULT
+
+
+def test_other_pybars_version(tmp_path, monkeypatch):
+    Handlebars(tmp_path).compile(SOURCE)
+    monkeypatch.setattr(pybars, "__version__", "0.0.0", raising=False)
+    handlebars = Handlebars(tmp_path)
+
+    assert handlebars.compile(SOURCE)(DATA) == RESULT
+    assert stats(handlebars)["compiled"] == 1
+    assert len(cacheFiles(tmp_path)) == 2
@@ -0,0 +1,138 @@
+import flask
+from bson import ObjectId
+
+from control.generic import AttrDict
+from control.mongo import Mongo as MongoCls
+
+
+class Messages:
+    def debugAdd(self, obj):
+        pass
+
+    def warning(self, msg=None, logmsg=None):
+        pass
+
+
+def makeMongo(monkeypatch, record):
+    Mongo = MongoCls(AttrDict(database="test", runMode="test"), Messages())
+    calls = []
+
+    def executeMongo(table, command, *args, **kwargs):
+        calls.append((table, command))
+        return (True, AttrDict(record))
+
+    monkeypatch.setattr(Mongo, "executeMongo", executeMongo)
+    return (Mongo, calls)
+
+
+def test_identity_map_saves_round_trips(monkeypatch):
+    recordId = ObjectId()
+    (Mongo, calls) = makeMongo(monkeypatch, dict(_id=recordId, title="A"))
+
+    with flask.Flask(__name__).app_context():
+        for _ in range(3):
+            assert Mongo.getRecord("project", dict(_id=recordId)).title == "A"
+
+        assert calls == [("project", "find_one")]
+        assert Mongo.identityMap().hits == 2
+
+
+def test_identity_map_delivers_copies(monkeypatch):
+    recordId = ObjectId()
+    (Mongo, calls) = makeMongo(monkeypatch, dict(_id=recordId, title="A"))
+
+    with flask.Flask(__name__).app_context():
+        first = Mongo.getRecord("project", dict(_id=recordId))
+        first.title = "changed"
+        del first["_id"]
+        second = Mongo.getRecord("project", dict(_id=recordId))
+        second.extra = 1
+        third = Mongo.getRecord("project", dict(_id=recordId))
+
+        assert third == dict(_id=recordId, title="A")
+        assert len(calls) == 1
+
+
+def test_writes_forget_records(monkeypatch):
+    recordId = ObjectId()
+    (Mongo, calls) = makeMongo(monkeypatch, dict(_id=recordId, title="A"))
+    monkeypatch.setattr(Mongo, "bumpAuthVersion", lambda: None)
+
+    with flask.Flask(__name__).app_context():
+        Mongo.getRecord("project", dict(_id=recordId))
+        Mongo.forget("project")
+        Mongo.getRecord("project", dict(_id=recordId))
+
+        assert len(calls) == 2
+
+
+class VersionTable:
+    def __init__(self):
+        self.counters = {}
+        self.reads = 0
+
+    def find(self, criteria):
+        self.reads += 1
+        return [dict(_id=k, version=v) for (k, v) in self.counters.items()]
+
+    def find_one_and_update(self, criteria, update, **kwargs):
+        name = criteria["_id"]
+        self.counters[name] = self.counters.get(name, 0) + 1
+        return dict(_id=name, version=self.counters[name])
+
+
+def makeVersionedMongo(monkeypatch):
+    Mongo = MongoCls(AttrDict(database="test", runMode="test"), Messages())
+    table = VersionTable()
+    monkeypatch.setattr(Mongo, "versionTable", lambda: table)
+    return (Mongo, table)
+
+
+def test_versions_read_once_per_request(monkeypatch):
+    (Mongo, table) = makeVersionedMongo(monkeypatch)
+
+    with flask.Flask(__name__).app_context():
+        assert Mongo.authVersion() == 0
+        assert Mongo.decisionVersion() == (0, 0)
+        assert table.reads == 1
+
+    table.counters["auth"] = 3
+
+    with flask.Flask(__name__).app_context():
+        assert Mongo.decisionVersion() == (3, 0)
+        assert table.reads == 2
+
+
+def test_publishing_leaves_auth_version(monkeypatch):
+    (Mongo, table) = makeVersionedMongo(monkeypatch)
+
+    with flask.Flask(__name__).app_context():
+        Mongo.authVersion()
+        Mongo.bumpDecisionVersion()
+
+        assert Mongo.decisionVersion() == (0, 1)
+
+    with flask.Flask(__name__).app_context():
+        Mongo.forget("user")
+
+        assert (Mongo.authVersion(), Mongo.decisionVersion()) == (1, (1, 1))
+
+
+def test_versions_remembered_outside_requests(monkeypatch):
+    (Mongo, table) = makeVersionedMongo(monkeypatch)
+    Mongo.Settings.cacheTtl = AttrDict(versions=60)
+
+    for _ in range(3):
+        assert Mongo.decisionVersion() == (0, 0)
+
+    assert table.reads == 1
+
+    Mongo.bumpDecisionVersion()
+
+    assert Mongo.decisionVersion() == (0, 1)
+    assert table.reads == 2
+
+    Mongo.versionMemo = (0, Mongo.versionMemo[1])
+    table.counters["auth"] = 5
+
+    assert Mongo.decisionVersion() == (5, 1)
@@ -0,0 +1,238 @@
+import os
+
+import pytest
+
+from control.files import readJson, readPath
+from control.generic import AttrDict
+from control.handlebars import Handlebars
+from control import static
+from control.static import Static
+
+
+TEMPLATE = """<h1>{{title}}</h1>\n{{> footer}}\n"""
+PARTIAL = """<p>{{name}}</p>"""
+
+
+class Messages:
+    def __init__(self):
+        self.infos = []
+        self.errors = []
+
+    def debugAdd(self, obj):
+        pass
+
+    def info(self, msg=None, logmsg=None):
+        self.infos.append(msg)
+
+    def special(self, msg=None, logmsg=None):
+        pass
+
+    def warning(self, msg=None, logmsg=None):
+        pass
+
+    def error(self, msg=None, logmsg=None):
+        self.errors.append(logmsg)
+
+    def generated(self, target):
+        prefix = f"generated {target} "
+        reports = [m for m in self.infos if m and m.startswith(prefix)]
+        return reports[-1].removeprefix(prefix)
+
+
+class Tailwind:
+    def generate(self):
+        return True
+
+
+class SiteStatic(Static):
+    """Static with page data that is given by the test instead of the database."""
+
+    def __init__(self, *args, pages=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pages = pages
+
+    def getDbData(self):
+        pass
+
+    def getData(self, kind, pNumGiven, eNumGiven):
+        if kind == "viewers":
+            return []
+
+        return [AttrDict(p) for p in self.pages] if kind == "site" else []
+
+
+@pytest.fixture
+def site(tmp_path):
+    srcDir = f"{os.path.dirname(__file__)}/../src"
+    names = ("viewers", "published", "templates", "partials", "js", "images")
+    dirs = AttrDict({name: f"{tmp_path}/{name}" for name in names})
+
+    for d in dirs.values():
+        os.makedirs(d)
+
+    with open(f"{dirs.templates}/page.html", "w") as fh:
+        fh.write(TEMPLATE)
+
+    with open(f"{dirs.partials}/footer.html", "w") as fh:
+        fh.write(PARTIAL)
+
+    Settings = AttrDict(
+        yamlDir=f"{srcDir}/yaml",
+        viewerDir=dirs.viewers,
+        pubModeDir=dirs.published,
+        templateDir=dirs.templates,
+        partialsIn=dirs.partials,
+        jsDir=dirs.js,
+        imageDir=dirs.images,
+        buildManifest=f"{dirs.published}/build.json",
+        editionPages="versions",
+    )
+    return AttrDict(Settings=Settings, dirs=dirs, cacheDir=f"{tmp_path}/cache")
+
+
+def makePages(n, title="Title"):
+    return [
+        dict(template="page.html", fileName=f"page{i}.html", title=title, name=f"p{i}")
+        for i in range(n)
+    ]
+
+
+def generate(site, pages, jobs=1):
+    messages = Messages()
+    static = SiteStatic(
+        site.Settings,
+        messages,
+        None,
+        None,
+        Tailwind(),
+        Handlebars(site.cacheDir),
+        pages=pages,
+    )
+    good = static.genPages(None, None, jobs=jobs)
+    assert good, messages.errors
+    return messages.generated("site")
+
+
+def counts(rendered=0, skipped=0, unchanged=0):
+    return f"{rendered:>3} rendered, {skipped:>3} skipped, {unchanged:>3} unchanged"
+
+
+def test_first_build_renders_and_records(site):
+    pubDir = site.dirs.published
+
+    assert generate(site, makePages(3)) == counts(rendered=3)
+    assert readPath(f"{pubDir}/page1.html") == "<h1>Title</h1>\n<p>p1</p>\n"
+    assert readJson(asFile=f"{pubDir}/json/page1.json", plain=True)["name"] == "p1"
+    assert set(readJson(asFile=site.Settings.buildManifest, plain=True)) == {
+        "page0.html",
+        "page1.html",
+        "page2.html",
+    }
+
+
+def test_unchanged_inputs_are_skipped(site):
+    pages = makePages(3)
+    generate(site, pages)
+
+    assert generate(site, pages) == counts(skipped=3)
+
+
+def test_changed_data_renders_only_that_page(site):
+    pages = makePages(3)
+    generate(site, pages)
+    pages[1]["title"] = "Other"
+
+    assert generate(site, pages) == counts(rendered=1, skipped=2)
+    assert readPath(f"{site.dirs.published}/page1.html").startswith("<h1>Other</h1>")
+
+
+def test_changed_template_renders_all_pages(site):
+    pages = makePages(3)
+    generate(site, pages)
+
+    with open(f"{site.dirs.templates}/page.html", "w") as fh:
+        fh.write(f"<!-- new -->\n{TEMPLATE}")
+
+    assert generate(site, pages) == counts(rendered=3)
+
+
+def test_changed_partial_renders_all_pages(site):
+    pages = makePages(3)
+    generate(site, pages)
+
+    with open(f"{site.dirs.partials}/footer.html", "w") as fh:
+        fh.write(f"<hr>{PARTIAL}")
+
+    assert generate(site, pages) == counts(rendered=3)
+    assert readPath(f"{site.dirs.published}/page2.html").endswith("<hr><p>p2</p>\n")
+
+
+def test_lost_manifest_renders_without_writing(site):
+    pages = makePages(3)
+    generate(site, pages)
+    os.unlink(site.Settings.buildManifest)
+
+    assert generate(site, pages) == counts(unchanged=3)
+    assert generate(site, pages) == counts(skipped=3)
+
+
+def test_missing_files_are_regenerated(site):
+    pages = makePages(3)
+    pubDir = site.dirs.published
+    generate(site, pages)
+    os.unlink(f"{pubDir}/page0.html")
+    os.unlink(f"{pubDir}/json/page2.json")
+
+    assert generate(site, pages) == counts(rendered=2, skipped=1)
+    assert os.path.exists(f"{pubDir}/page0.html")
+    assert os.path.exists(f"{pubDir}/json/page2.json")
+
+
+def test_parallel_build_matches_serial_build(site, tmp_path):
+    pages = makePages(40)
+
+    assert generate(site, pages, jobs=2) == counts(rendered=40)
+
+    pubDir = site.dirs.published
+    parallel = {
+        fileName: readPath(f"{pubDir}/{fileName}")
+        for fileName in os.listdir(pubDir)
+        if fileName.endswith(".html")
+    }
+
+    for fileName in parallel:
+        os.unlink(f"{pubDir}/{fileName}")
+
+    assert generate(site, pages) == counts(rendered=40)
+
+    for fileName, text in parallel.items():
+        assert readPath(f"{pubDir}/{fileName}") == text
+
+
+def test_pages_are_rendered_in_batches(site, monkeypatch):
+    monkeypatch.setattr(static, "BATCH_PER_JOB", 2)
+    pages = makePages(5)
+
+    assert generate(site, pages) == counts(rendered=5)
+    assert generate(site, pages) == counts(skipped=5)
+
+
+def test_redirect_pages_have_no_json_twin(site):
+    pages = makePages(2)
+    pages[1]["isRedirect"] = True
+
+    assert generate(site, pages) == counts(rendered=2)
+    assert os.path.exists(f"{site.dirs.published}/json/page0.json")
+    assert not os.path.exists(f"{site.dirs.published}/json/page1.json")
+    assert generate(site, pages) == counts(skipped=2)
+
+
+def test_non_ascii_pages_are_written_as_utf8(site):
+    pages = makePages(1, title="Ærø – 3D")
+
+    assert generate(site, pages) == counts(rendered=1)
+
+    with open(f"{site.dirs.published}/page0.html", encoding="utf8") as fh:
+        assert fh.read().startswith("<h1>Ærø – 3D</h1>")
+
+    assert generate(site, pages) == counts(skipped=1)